@@ -0,0 +1,137 @@
+"""
+Admission control for the mapping routes.
+
+When the NLM APIs slow down, mapping requests pile up behind their terminology
+lookups until the load balancer times them out. The admission limiter lets
+at most ADMISSION_MAX_IN_FLIGHT mapping requests run at once in a worker, and
+at most ADMISSION_MAX_WAITING more wait (up to ADMISSION_WAIT_TIMEOUT seconds)
+for one of them to finish. Any other request is refused at once with 429 and
+Retry-After, which a client or load balancer can retry elsewhere or later,
+instead of being accepted and abandoned.
+
+The limit applies per worker process, so it only matters for workers serving
+several requests at once (gunicorn threads or gthread workers). It is disabled
+while ADMISSION_MAX_IN_FLIGHT is 0.
+"""
+
+import logging
+import threading
+import time
+
+try:
+    from metrics import observe_admission, observe_admission_rejected, observe_admission_wait
+except ImportError:
+    from harmon_service.metrics import observe_admission, observe_admission_rejected, observe_admission_wait
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADMISSION_MAX_WAITING = 0
+DEFAULT_ADMISSION_WAIT_TIMEOUT = 1.0
+DEFAULT_ADMISSION_RETRY_AFTER = 1
+
+# Routes (blueprint endpoints) the limiter applies to
+ADMISSION_ENDPOINTS = ('main.map_document', 'main.map_document_async', 'main.map_documents')
+
+
+class OverloadedError(Exception):
+    """Raised when a request is refused because the worker is at its admission limit."""
+
+
+class AdmissionLimiter:
+    """Per-worker limit on mapping requests running at once, with a short bounded wait queue."""
+
+    def __init__(self, max_in_flight=0, max_waiting=DEFAULT_ADMISSION_MAX_WAITING,
+                 wait_timeout=DEFAULT_ADMISSION_WAIT_TIMEOUT, retry_after=DEFAULT_ADMISSION_RETRY_AFTER):
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.configure(max_in_flight, max_waiting, wait_timeout, retry_after)
+
+    def configure(self, max_in_flight=0, max_waiting=DEFAULT_ADMISSION_MAX_WAITING,
+                  wait_timeout=DEFAULT_ADMISSION_WAIT_TIMEOUT, retry_after=DEFAULT_ADMISSION_RETRY_AFTER):
+        with self._condition:
+            self.max_in_flight = max_in_flight
+            self.max_waiting = max_waiting
+            self.wait_timeout = wait_timeout
+            self.retry_after = retry_after
+            self.rejected = 0
+            self._condition.notify_all()
+
+    @property
+    def enabled(self):
+        return self.max_in_flight > 0
+
+    def acquire(self, endpoint):
+        """
+        Admits a request, waiting for a running one to finish if the wait queue has room.
+
+        Returns:
+            bool: True if admitted (release() must follow), False if the limiter is disabled.
+
+        Raises:
+            OverloadedError: If the wait queue is full or no request finished within wait_timeout.
+        """
+        start = time.monotonic()
+        with self._condition:
+            if self.max_in_flight <= 0:
+                return False
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.max_waiting:
+                    self._reject(endpoint, f"{self.in_flight} requests running, {self.waiting} waiting")
+                self.waiting += 1
+                observe_admission(self.in_flight, self.waiting)
+                try:
+                    deadline = start + self.wait_timeout
+                    while self.max_in_flight > 0 and self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject(endpoint, f"no request finished within {self.wait_timeout}s")
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            observe_admission(self.in_flight, self.waiting)
+        observe_admission_wait(endpoint, time.monotonic() - start)
+        return True
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            observe_admission(self.in_flight, self.waiting)
+            self._condition.notify()
+
+    def _reject(self, endpoint, reason):
+        # Called holding the condition's lock
+        self.rejected += 1
+        observe_admission(self.in_flight, self.waiting)
+        observe_admission_rejected(endpoint)
+        raise OverloadedError(f"Service overloaded ({reason}), retry later")
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'enabled': self.max_in_flight > 0,
+                'max_in_flight': self.max_in_flight,
+                'max_waiting': self.max_waiting,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'rejected': self.rejected,
+            }
+
+
+admission_limiter = AdmissionLimiter()
+
+
+def configure_admission(config):
+    """Applies the ADMISSION_* settings."""
+    admission_limiter.configure(
+        config.get('ADMISSION_MAX_IN_FLIGHT', 0),
+        config.get('ADMISSION_MAX_WAITING', DEFAULT_ADMISSION_MAX_WAITING),
+        config.get('ADMISSION_WAIT_TIMEOUT', DEFAULT_ADMISSION_WAIT_TIMEOUT),
+        config.get('ADMISSION_RETRY_AFTER', DEFAULT_ADMISSION_RETRY_AFTER),
+    )
+    if admission_limiter.enabled:
+        logger.info(
+            f"Admission control: {admission_limiter.max_in_flight} mapping requests per worker, "
+            f"{admission_limiter.max_waiting} waiting up to {admission_limiter.wait_timeout}s"
+        )
@@ -17,6 +17,54 @@ def create_app(config_name=None):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
 
+    from terminology import configure_terminology, import_snapshot, start_warmup, warmup_state
+    configure_terminology(app.config)
+
+    snapshot_path = app.config.get('TERMINOLOGY_SNAPSHOT_PATH')
+    if snapshot_path and os.path.exists(snapshot_path):
+        try:
+            import_snapshot(snapshot_path)
+        except Exception as e:
+            logger.error(f"Could not load terminology snapshot '{snapshot_path}': {e}")
+
+    warmup_path = app.config.get('TERMINOLOGY_WARMUP_TERMS_PATH')
+    if warmup_path:
+        try:
+            start_warmup(warmup_path, app.config.get('TERMINOLOGY_WARMUP_TOP_N', 1000))
+        except Exception as e:
+            # Serve cold rather than not at all, and don't leave /health at "warming"
+            logger.warning(f"Could not start terminology warm-up from '{warmup_path}': {e}")
+            warmup_state.update(status='failed', error=str(e))
+
+    from date_normalizer import configure_date_normalizer
+    configure_date_normalizer(app.config)
+
+    from serialization import configure_serialization
+    configure_serialization(app)
+
+    from result_cache import configure_result_cache
+    configure_result_cache(app.config)
+
+    from jobs import configure_jobs
+    configure_jobs(app.config)
+
+    from harmonization_service import configure_harmonization
+    configure_harmonization(app.config)
+
+    from profiling import configure_profiling
+    configure_profiling(app.config)
+
+    from tracing import configure_tracing
+    configure_tracing(app.config)
+
+    from admission import configure_admission
+    configure_admission(app.config)
+
+    if app.config.get('PRELOAD_FHIR_MODELS'):
+        # Already imported in the gunicorn master, if preloaded there
+        from document_mapper import preload_models
+        preload_models()
+
     # Register Blueprints
     from routes import main_bp
     app.register_blueprint(main_bp)
@@ -24,9 +72,10 @@ def create_app(config_name=None):
     logger.info(f"FHIR Harmonization Service initialized in {config_name} mode")
     
     # Print all registered routes
-    logger.info("Registered Routes:")
-    for rule in app.url_map.iter_rules():
-        logger.info(f"{rule} -> {rule.endpoint}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Registered Routes:")
+        for rule in app.url_map.iter_rules():
+            logger.debug(f"{rule} -> {rule.endpoint}")
         
     @app.route('/test', methods=['GET'])
     def test_route():
@@ -0,0 +1 @@
+"""Micro-benchmarks for the mapping and harmonization paths (run with python -m)."""
@@ -0,0 +1,150 @@
+"""
+Compares the two DocumentMapper build modes ("model" and "dict").
+
+Terminology caches are pre-populated so no lookup leaves the process, and
+resource ids are made deterministic so both modes can be checked for
+byte-identical output before they are timed.
+
+    python -m benchmarks.bench_build_modes --iterations 200
+"""
+
+import argparse
+import itertools
+import json
+import time
+import uuid
+from unittest import mock
+
+from cachetools.keys import hashkey
+
+from document_mapper import BUILD_MODES, get_document_mapper
+from terminology import terminology_caches
+
+CONCEPTS = {
+    "icd10": {
+        "Hypertension": ("I10", "Essential (primary) hypertension"),
+        "Type 2 diabetes mellitus": ("E11.9", "Type 2 diabetes mellitus without complications"),
+        "Pneumonia": ("J18.9", "Pneumonia, unspecified organism"),
+        "Chest pain": ("R07.9", "Chest pain, unspecified"),
+    },
+    "loinc": {
+        "Hemoglobin": ("718-7", "Hemoglobin [Mass/volume] in Blood"),
+        "Glucose": ("2345-7", "Glucose [Mass/volume] in Serum or Plasma"),
+        "Creatinine": ("2160-0", "Creatinine [Mass/volume] in Serum or Plasma"),
+    },
+    "rxnorm": {
+        "Metformin": ("860975", "metformin hydrochloride 500 MG Oral Tablet"),
+        "Lisinopril": ("314076", "lisinopril 10 MG Oral Tablet"),
+    },
+}
+
+SYSTEMS = {
+    "icd10": "http://hl7.org/fhir/sid/icd-10-cm",
+    "loinc": "http://loinc.org",
+    "rxnorm": "http://www.nlm.nih.gov/research/umls/rxnorm",
+}
+
+DOCUMENTS = [
+    ("Medical Report", {
+        "PII": {"Name": "John Michael Doe", "DOB": "1980-05-15", "ID": "PAT_001", "Gender": "M", "Date": "March 3, 2025"},
+        "Disease_disorder": ["Hypertension", "Type 2 diabetes mellitus", "Unmapped condition"],
+        "Medication": ["Metformin", "Lisinopril", "Unmapped drug"],
+        "Dosage": ["500mg twice daily"],
+        "Procedure": ["ECG", "Chest X-ray"],
+    }),
+    ("Lab Report", {
+        "PII": {"Name": "Jane Roe", "DOB": "TKN_DOB_8812", "ID": "PAT_002", "Gender": "female", "Date": "12/01/2025"},
+        "Lab_Tests": [
+            {"Name": "Hemoglobin", "Value": "13.5", "Unit": "g/dL", "Reference_Range": "12-16"},
+            {"Name": "Glucose", "Value": 110, "Unit": "mg/dL"},
+            {"Name": "Creatinine", "Value": "1e20"},
+            {"Name": "Culture", "Value": "No growth"},
+            {"Name": "Troponin", "Value": "0.0000001", "Unit": "ng/mL"},
+            {"Name": "Potassium", "Value": "nan"},
+        ],
+    }),
+    ("Discharge Summary", {
+        "PII": {"Name": "Cher", "DOB": "1946-05-20", "ID": "PAT_003",
+                "Admission_Date": "2025-01-02T08:00:00", "Discharge_Date": "2025-01-09"},
+        "Diagnosis": ["Pneumonia", ""],
+        "Outcome": "Recovered",
+        "Instructions": ["Rest", "Finish antibiotics"],
+    }),
+    ("Admission Slip", {
+        "PII": {"Name": "   ", "DOB": "20 May 1970", "Gender": "x", "Date": "2025/02/14"},
+        "Admission_Reason": "Chest pain, Hypertension, Dizziness",
+        "Department": "Cardiology",
+    }),
+]
+
+
+def prime_terminology_caches():
+    """Seeds every cache so mapping runs without network access."""
+    for code_system, concepts in CONCEPTS.items():
+        cache = terminology_caches[code_system]
+        for text, (code, display) in concepts.items():
+            cache[hashkey(text)] = {
+                "coding": [{"system": SYSTEMS[code_system], "code": code, "display": display}],
+                "text": text,
+            }
+    unmapped = {
+        "icd10": ["Unmapped condition", "Dizziness"],
+        "loinc": ["Culture", "Troponin", "Potassium"],
+        "rxnorm": ["Unmapped drug"],
+    }
+    for code_system, texts in unmapped.items():
+        for text in texts:
+            terminology_caches[code_system][hashkey(text)] = {"text": text}
+
+
+def _deterministic_uuids():
+    counter = itertools.count()
+    return mock.patch("document_mapper.uuid.uuid4", side_effect=lambda: uuid.UUID(int=next(counter)))
+
+
+def map_all(build_mode):
+    outputs = []
+    for document_type, data in DOCUMENTS:
+        mapper = get_document_mapper(document_type, build_mode)
+        outputs.append(mapper.map_to_fhir(json.loads(json.dumps(data))))
+    return outputs
+
+
+def check_identical():
+    """Raises AssertionError if the build modes disagree on any document."""
+    results = {}
+    for build_mode in BUILD_MODES:
+        with _deterministic_uuids():
+            results[build_mode] = map_all(build_mode)
+    for (document_type, _), model_out, dict_out in zip(DOCUMENTS, results["model"], results["dict"]):
+        assert model_out == dict_out, f"{document_type}: build modes differ\n{model_out}\n{dict_out}"
+
+
+def bench(build_mode, iterations):
+    resources = sum(len(json.loads(out)["entry"]) for out in map_all(build_mode))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        map_all(build_mode)
+    elapsed = time.perf_counter() - start
+    return {
+        "build_mode": build_mode,
+        "iterations": iterations,
+        "seconds": round(elapsed, 4),
+        "documents_per_second": round(iterations * len(DOCUMENTS) / elapsed, 1),
+        "resources_per_second": round(iterations * resources / elapsed, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark DocumentMapper build modes.")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    prime_terminology_caches()
+    check_identical()
+    results = [bench(build_mode, args.iterations) for build_mode in BUILD_MODES]
+    print(json.dumps({"identical_output": True, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmarks validate-mode harmonization of a large roster Bundle on one core
+against the process pool, by worker count, and checks the output is identical.
+
+    python -m benchmarks.bench_parallel_harmonize --entries 50000 --workers 1,2,4,8
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+import warnings
+
+from benchmarks.harness import finish
+from harmonization_service import HarmonizationService, configure_harmonization
+
+
+def roster_bundle(entries):
+    """A Bundle of Patients (the roster) with an Observation after every fourth one."""
+    entry = []
+    for i in range(entries):
+        if i % 5 == 4:
+            resource = {
+                "resourceType": "Observation", "id": f"o{i}", "status": "final",
+                "code": {"text": "Hemoglobin"}, "subject": {"reference": f"Patient/p{i - 1}"},
+                "valueQuantity": {"value": 13.5, "unit": "g/dL"},
+            }
+        else:
+            resource = {
+                "resourceType": "Patient", "id": f"p{i}", "gender": "female", "birthDate": "1980-05-15",
+                "name": [{"family": f"doe{i}", "given": ["jane", "q"]}],
+            }
+        entry.append({"resource": resource, "request": {"method": "POST", "url": resource["resourceType"]}})
+    return json.dumps({"resourceType": "Bundle", "type": "transaction", "entry": entry})
+
+
+def _timed(bundle_json, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = HarmonizationService.harmonize_bundle(bundle_json, mode="validate")
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return output, best
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Benchmark parallel harmonization.")
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, 8, 16) if n <= cpus) or "1")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    warnings.simplefilter("ignore")
+    # Also silences pydantic serializer warnings in the pool's processes
+    os.environ.setdefault("PYTHONWARNINGS", "ignore")
+    bundle_json = roster_bundle(args.entries)
+
+    configure_harmonization({"HARMONIZE_PARALLEL_WORKERS": 0})
+    serial_output, serial_s = _timed(bundle_json, args.repeat)
+    report = {"entries": args.entries, "cpus": cpus, "serial_s": round(serial_s, 3), "parallel": []}
+
+    for workers in (int(n) for n in args.workers.split(",")):
+        configure_harmonization({
+            "HARMONIZE_PARALLEL_WORKERS": workers,
+            "HARMONIZE_PARALLEL_THRESHOLD": 1,
+            "HARMONIZE_PARALLEL_CHUNK_SIZE": args.chunk_size,
+        })
+        # Start the pool (and import the models in its processes) before timing
+        HarmonizationService.harmonize_bundle(roster_bundle(workers * args.chunk_size), mode="validate")
+        output, seconds = _timed(bundle_json, args.repeat)
+        report["parallel"].append({
+            "workers": workers,
+            "seconds": round(seconds, 3),
+            "speedup": round(serial_s / seconds, 2),
+            "identical_output": output == serial_output,
+        })
+    configure_harmonization({"HARMONIZE_PARALLEL_WORKERS": 0})
+
+    finish(report, failed=not all(run["identical_output"] for run in report["parallel"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Cold-start benchmark: how long a fresh worker process takes to import the
+service, create the app and answer its first request of each document type.
+
+Each run is a new interpreter (so nothing is already imported), talking to the
+stub NLM server. Runs are repeated with FHIR models loaded lazily (the default)
+and with PRELOAD_FHIR_MODELS, which moves the model imports into create_app
+(or, under gunicorn, into the master before forking):
+
+    python -m benchmarks.bench_startup --runs 5 --build-mode model
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.stub_nlm_server import StubNLMServer
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _child():
+    """Runs in the fresh interpreter; prints its timings as one JSON line."""
+    timings = {}
+    start = time.perf_counter()
+    import app as app_module
+    timings["import_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    app = app_module.create_app("production")
+    timings["create_app_ms"] = (time.perf_counter() - start) * 1000
+
+    client = app.test_client()
+    for document_type, generate in DOCUMENT_GENERATORS.items():
+        body = {"document_type": document_type, "data": generate(size=3, seed=1)}
+        for request in ("first", "second"):
+            start = time.perf_counter()
+            response = client.post("/api/v1/map/document", json=body)
+            timings[f"{document_type} {request}_request_ms"] = (time.perf_counter() - start) * 1000
+            if response.status_code != 200:
+                raise SystemExit(f"{document_type}: HTTP {response.status_code}")
+    print(json.dumps(timings))
+
+
+def _run(env):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+        cwd=REPO_ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark worker cold start.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--build-mode", default="model", choices=["model", "dict"])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child()
+        return
+
+    # Medians over the runs, in milliseconds
+    report = {"runs": args.runs, "build_mode": args.build_mode, "python": sys.version.split()[0], "cases": {}}
+    with StubNLMServer() as server:
+        base_env = dict(os.environ, MAPPER_BUILD_MODE=args.build_mode, **server.endpoint_config())
+        for case, preload in (("lazy", "false"), ("preload", "true")):
+            env = dict(base_env, PRELOAD_FHIR_MODELS=preload)
+            results = [_run(env) for _ in range(args.runs)]
+            report["cases"][case] = {
+                metric: round(statistics.median(r[metric] for r in results), 2)
+                for metric in results[0]
+            }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
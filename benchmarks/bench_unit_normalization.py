@@ -0,0 +1,115 @@
+"""
+Benchmarks the Observation unit normalization stage by Bundle size, with NumPy
+and with the plain-Python fallback, and checks that both give the same values,
+that a second pass changes nothing, and that the fast, validate and streaming
+harmonizers write the same converted quantities.
+
+    python -m benchmarks.bench_unit_normalization --labs 10,100,1000,10000
+"""
+
+import argparse
+import copy
+import io
+import json
+import logging
+import time
+import warnings
+
+import unit_normalization
+from harmonization_service import HarmonizationService, configure_harmonization
+from unit_normalization import LOINC_SYSTEM, normalize_observation_units
+
+# (LOINC code, display, unit, value) of the labs in the generated bundles, in source units
+LABS = (
+    ("2345-7", "Glucose", "mmol/L", 5.4),
+    ("2160-0", "Creatinine", "umol/L", 88.0),
+    ("2093-3", "Cholesterol", "mmol/L", 5.2),
+    ("718-7", "Hemoglobin", "g/L", 135.0),
+    ("4548-4", "Hemoglobin A1c", "mmol/mol", 48.0),
+    ("29463-7", "Body weight", "lb", 154.0),
+    ("8310-5", "Body temperature", "[degF]", 98.6),
+    ("2345-7", "Glucose", "mg/dL", 97.0),
+)
+
+
+def lab_bundle(labs):
+    """A Bundle of one Patient and `labs` Observations in mixed units."""
+    entry = [{"resource": {"resourceType": "Patient", "id": "p0", "name": [{"family": "doe", "given": ["jane"]}]}}]
+    for i in range(labs):
+        code, display, unit, value = LABS[i % len(LABS)]
+        entry.append({"resource": {
+            "resourceType": "Observation", "id": f"o{i}", "status": "final",
+            "code": {"coding": [{"system": LOINC_SYSTEM, "code": code, "display": display}]},
+            "subject": {"reference": "Patient/p0"},
+            "valueQuantity": {"value": value + i % 7, "unit": unit},
+        }})
+    return {"resourceType": "Bundle", "type": "collection", "entry": entry}
+
+
+def _per_lab_us(bundle, repeat):
+    best = None
+    for _ in range(repeat):
+        entries = copy.deepcopy(bundle["entry"])
+        start = time.perf_counter()
+        normalize_observation_units(entries)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6 / max(len(bundle["entry"]) - 1, 1)
+
+
+def _quantities(bundle_json):
+    return [
+        entry["resource"]["valueQuantity"] for entry in json.loads(bundle_json)["entry"]
+        if "valueQuantity" in entry["resource"]
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Observation unit normalization.")
+    parser.add_argument("--labs", default="10,100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    warnings.simplefilter("ignore")
+    numpy = unit_normalization.np
+    report = {"numpy": numpy.__version__ if numpy is not None else None, "per_lab_us": []}
+
+    for labs in (int(n) for n in args.labs.split(",")):
+        bundle = lab_bundle(labs)
+        row = {"labs": labs}
+        if numpy is not None:
+            row["numpy"] = round(_per_lab_us(bundle, args.repeat), 3)
+        unit_normalization.np = None
+        row["python"] = round(_per_lab_us(bundle, args.repeat), 3)
+        unit_normalization.np = numpy
+        report["per_lab_us"].append(row)
+
+    bundle = lab_bundle(len(LABS) * 10)
+    converted = copy.deepcopy(bundle)
+    report["converted"] = normalize_observation_units(converted["entry"])
+    report["idempotent"] = normalize_observation_units(converted["entry"]) == 0
+    fallback = copy.deepcopy(bundle)
+    unit_normalization.np = None
+    normalize_observation_units(fallback["entry"])
+    unit_normalization.np = numpy
+    report["fallback_identical"] = fallback == converted
+
+    configure_harmonization({"HARMONIZE_NORMALIZE_UNITS": True})
+    bundle_json = json.dumps(bundle)
+    fast = HarmonizationService.harmonize_bundle(bundle_json, mode="fast")
+    validate = HarmonizationService.harmonize_bundle(bundle_json, mode="validate")
+    stream = "".join(HarmonizationService.harmonize_bundle_stream(io.BytesIO(bundle_json.encode())))
+    report["stream_identical_to_fast"] = stream == fast
+    # The models write integral decimals without ".0"; compare the numbers
+    report["validate_matches_fast"] = _quantities(validate) == _quantities(fast)
+    report["sample"] = _quantities(fast)[:len(LABS)]
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if not (report["idempotent"] and report["fallback_identical"]
+            and report["stream_identical_to_fast"] and report["validate_matches_fast"]):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Plumbing shared by the benchmarks: the stub NLM server the code under test
+is pointed at, and the JSON report each benchmark prints.
+"""
+
+import contextlib
+import json
+import os
+
+from benchmarks.stub_nlm_server import StubNLMServer
+from terminology import configure_terminology
+
+
+@contextlib.contextmanager
+def stub_nlm(latency, recordings=None, **env):
+    """
+    Runs the stub NLM server for the block and points the terminology lookups
+    at it. env is set as environment variables too, before the block imports
+    the app, since the config classes read them at import.
+
+    Yields:
+        StubNLMServer
+    """
+    with StubNLMServer(latency=latency, recordings=recordings) as server:
+        os.environ.update(server.endpoint_config())
+        os.environ.update(env)
+        configure_terminology(server.endpoint_config())
+        yield server
+
+
+def finish(report, failed):
+    """Prints the report as JSON, and exits with status 1 if the run failed its own check."""
+    print(json.dumps(report, indent=2))
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,163 @@
+"""
+Local stand-in for the NLM terminology APIs, with configurable latency.
+
+Serves the three endpoints the terminology module calls, in the same
+response shapes, from a small fixed vocabulary:
+
+    /icd10   clinicaltables icd10cm search     [total, codes, extra, [[code, name], ...]]
+    /loinc   clinicaltables loinc_items search [total, codes, extra, [[code, name], ...]]
+    /rxnorm  RxNav drugs.json                  {"drugGroup": {"conceptGroup": [...]}}
+
+Responses recorded from the real APIs can be replayed instead: a JSON file of
+{"icd10" | "loinc" | "rxnorm": {"<search term>": <response body>}} takes
+precedence over the built-in vocabulary.
+
+Point the service at it with TERMINOLOGY_ICD10_URL / _LOINC_URL / _RXNORM_URL
+(see endpoint_config), or run it standalone:
+
+    python -m benchmarks.stub_nlm_server --port 8099 --latency 0.2 [--recording responses.json]
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+VOCABULARY = {
+    "icd10": {
+        "hypertension": ("I10", "Essential (primary) hypertension"),
+        "type 2 diabetes mellitus": ("E11.9", "Type 2 diabetes mellitus without complications"),
+        "diabetes": ("E11.9", "Type 2 diabetes mellitus without complications"),
+        "pneumonia": ("J18.9", "Pneumonia, unspecified organism"),
+        "chest pain": ("R07.9", "Chest pain, unspecified"),
+        "fever": ("R50.9", "Fever, unspecified"),
+        "asthma": ("J45.909", "Unspecified asthma, uncomplicated"),
+    },
+    "loinc": {
+        "hemoglobin": ("718-7", "Hemoglobin [Mass/volume] in Blood"),
+        "glucose": ("2345-7", "Glucose [Mass/volume] in Serum or Plasma"),
+        "creatinine": ("2160-0", "Creatinine [Mass/volume] in Serum or Plasma"),
+        "potassium": ("2823-3", "Potassium [Moles/volume] in Serum or Plasma"),
+    },
+    "rxnorm": {
+        "metformin": ("860975", "metformin hydrochloride 500 MG Oral Tablet"),
+        "lisinopril": ("314076", "lisinopril 10 MG Oral Tablet"),
+        "amoxicillin": ("308191", "amoxicillin 500 MG Oral Capsule"),
+    },
+}
+
+
+def _search_body(code_system, term):
+    match = VOCABULARY[code_system].get(term.strip().lower())
+    if code_system == "rxnorm":
+        if not match:
+            return {"drugGroup": {"name": term}}
+        return {"drugGroup": {"name": term, "conceptGroup": [
+            {"tty": "BN"},
+            {"tty": "SCD", "conceptProperties": [{"rxcui": match[0], "name": match[1], "tty": "SCD"}]},
+        ]}}
+    if not match:
+        return [0, [], None, []]
+    return [1, [match[0]], None, [[match[0], match[1]]]]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connection bursts from concurrent clients
+    request_queue_size = 128
+
+
+class StubNLMServer:
+    """Threaded stub server; usable as a context manager."""
+
+    def __init__(self, port=0, latency=0.0, fail_status=None, recordings=None):
+        self.latency = latency
+        self.recordings = recordings or {}
+        self.fail_status = fail_status
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; avoid Nagle/delayed-ACK stalls
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with stub._count_lock:
+                    stub.requests += 1
+                url = urlparse(self.path)
+                code_system = url.path.strip("/")
+                params = parse_qs(url.query)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if code_system not in VOCABULARY:
+                    status, body = 404, {"error": "not found"}
+                elif stub.fail_status:
+                    status, body = stub.fail_status, {"error": "stub failure"}
+                else:
+                    term = (params.get("terms") or params.get("name") or [""])[0]
+                    recorded = stub.recordings.get(code_system, {})
+                    status = 200
+                    body = recorded[term] if term in recorded else _search_body(code_system, term)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _Server(("127.0.0.1", port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def endpoint_config(self):
+        """TERMINOLOGY_*_URL settings pointing the service at this server."""
+        return {f"TERMINOLOGY_{code_system.upper()}_URL": f"{self.base_url}/{code_system}" for code_system in VOCABULARY}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def load_recordings(path):
+    """Reads a recorded-responses file; None gives no recordings."""
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stub NLM terminology server.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--recording", help="JSON file of recorded responses")
+    args = parser.parse_args(argv)
+    server = StubNLMServer(args.port, args.latency, recordings=load_recordings(args.recording))
+    for name, url in server.endpoint_config().items():
+        print(f"{name}={url}")
+    server._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Benchmark suite for the mapping, harmonization, date and terminology paths.
+
+Terminology calls go to a local stub of the NLM APIs (benchmarks/stub_nlm_server.py)
+with configurable latency. Every case reports ops/sec, p50/p95/p99 latency and
+the traced peak allocation per operation, as JSON:
+
+    python -m benchmarks.suite --sizes 10,100,1000 --latency 0.02 --output results.json
+    python -m benchmarks.suite --only "Lab Report" --iterations 50
+
+Mapper and harmonizer cases run with warm terminology caches (the first,
+unmeasured, warm-up call fills them); the terminology cases report both a cold
+lookup (cache cleared before each call, so it pays the stub latency) and a warm one.
+"""
+
+import argparse
+import io
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from benchmarks.harness import stub_nlm
+from benchmarks.stub_nlm_server import load_recordings
+from benchmarks.synthetic import DATE_SAMPLES, DOCUMENT_GENERATORS
+from document_mapper import DocumentMapper, get_document_mapper
+from harmonization_service import HarmonizationService
+from terminology import get_condition_code, get_loinc_code, get_rxnorm_code, terminology_caches
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(name, op, iterations, setup=None, alloc_samples=5, **labels):
+    """
+    Times op() `iterations` times (setup() runs untimed before each call) and
+    traces allocations over a few extra calls.
+
+    Returns:
+        dict: Case name, labels, ops_per_sec, latency percentiles (ms) and
+              alloc_peak_kib (mean traced peak per call).
+    """
+    if setup:
+        setup()
+    op()  # warm-up
+
+    timings = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        op()
+        timings.append(time.perf_counter() - start)
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_samples):
+            if setup:
+                setup()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            op()
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    total = sum(timings)
+    result = {"case": name}
+    result.update(labels)
+    result.update({
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / total, 2) if total else None,
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "p50_ms": round(_percentile(timings, 0.50) * 1000, 3),
+        "p95_ms": round(_percentile(timings, 0.95) * 1000, 3),
+        "p99_ms": round(_percentile(timings, 0.99) * 1000, 3),
+        "alloc_peak_kib": round(statistics.fmean(peaks) / 1024, 1),
+    })
+    return result
+
+
+def _clear_caches():
+    for cache in terminology_caches.values():
+        cache.clear()
+
+
+def mapper_cases(sizes, iterations, build_modes, only=None):
+    results = []
+    for document_type, generate in DOCUMENT_GENERATORS.items():
+        if only and only != document_type:
+            continue
+        for size in sizes:
+            document = generate(size)
+            for build_mode in build_modes:
+                def op(document=document, document_type=document_type, build_mode=build_mode):
+                    return get_document_mapper(document_type, build_mode).map_to_fhir(document)
+                results.append(measure(
+                    "map_to_fhir", op, iterations,
+                    document_type=document_type, size=size, build_mode=build_mode
+                ))
+    return results
+
+
+def harmonizer_cases(sizes, iterations):
+    results = []
+    for size in sizes:
+        bundle_json = get_document_mapper("Lab Report").map_to_fhir(DOCUMENT_GENERATORS["Lab Report"](size))
+        for mode in ("validate", "fast"):
+            results.append(measure(
+                "harmonize_bundle",
+                lambda mode=mode, bundle_json=bundle_json: HarmonizationService.harmonize_bundle(bundle_json, mode=mode),
+                iterations, entries=size + 1, mode=mode
+            ))
+        bundle_bytes = bundle_json.encode("utf-8")
+        results.append(measure(
+            "harmonize_bundle",
+            lambda: "".join(HarmonizationService.harmonize_bundle_stream(io.BytesIO(bundle_bytes))),
+            iterations, entries=size + 1, mode="stream"
+        ))
+    return results
+
+
+def date_cases(iterations):
+    mapper = DocumentMapper()
+
+    def op():
+        for value in DATE_SAMPLES:
+            mapper._normalize_date(value)
+
+    result = measure("normalize_date", op, iterations, dates_per_op=len(DATE_SAMPLES))
+    return [result]
+
+
+def terminology_cases(iterations):
+    lookups = [
+        ("get_condition_code", get_condition_code, "Hypertension"),
+        ("get_condition_code", get_condition_code, "High Fever"),
+        ("get_loinc_code", get_loinc_code, "Hemoglobin"),
+        ("get_rxnorm_code", get_rxnorm_code, "Metformin"),
+    ]
+    results = []
+    for name, lookup, term in lookups:
+        results.append(measure(name, lambda lookup=lookup, term=term: lookup(term), iterations,
+                               setup=_clear_caches, term=term, cache="cold"))
+        results.append(measure(name, lambda lookup=lookup, term=term: lookup(term), iterations,
+                               term=term, cache="warm"))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated document sizes")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.01, help="Stub NLM latency in seconds")
+    parser.add_argument("--recording", help="JSON file of recorded NLM responses for the stub")
+    parser.add_argument("--build-modes", default="model,dict")
+    parser.add_argument("--only", help="Run only this document type's mapper cases")
+    parser.add_argument("--output", help="Write results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    build_modes = args.build_modes.split(",")
+
+    with stub_nlm(args.latency, recordings=load_recordings(args.recording)) as server:
+        results = mapper_cases(sizes, args.iterations, build_modes, args.only)
+        if not args.only:
+            results += harmonizer_cases(sizes, args.iterations)
+            results += date_cases(args.iterations)
+            results += terminology_cases(args.iterations)
+        upstream_requests = server.requests
+
+    report = {
+        "python": platform.python_version(),
+        "stub_latency_s": args.latency,
+        "upstream_requests": upstream_requests,
+        "results": results,
+    }
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(encoded + "\n")
+    else:
+        print(encoded)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
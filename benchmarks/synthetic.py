@@ -0,0 +1,104 @@
+"""
+Synthetic input documents of configurable size for the benchmarks.
+
+Terms are drawn from the stub server's vocabulary, mixed with a share of
+unknown terms so both matched and text-only concepts are exercised.
+Generation is seeded, so every run sees the same documents.
+"""
+
+import random
+
+from benchmarks.stub_nlm_server import VOCABULARY
+
+UNKNOWN_TERMS = ["Rare syndrome", "Unlisted finding", "Investigational agent", "Custom panel"]
+
+DATE_SAMPLES = [
+    "2025-03-03",
+    "2025-03-03T10:15:00",
+    "03/12/2025",
+    "12-03-2025",
+    "December 27, 2025",
+    "December 27 2025",
+    "Dec 27, 2025",
+    "27 December 2025",
+    "2025/12/27",
+    "TKN_DATE_1234",
+    "not a date",
+]
+
+
+def _terms(rng, code_system, count, unknown_share=0.2):
+    known = [term.title() for term in VOCABULARY[code_system]]
+    return [
+        rng.choice(UNKNOWN_TERMS) if rng.random() < unknown_share else rng.choice(known)
+        for _ in range(count)
+    ]
+
+
+def _pii(rng, index, **extra):
+    pii = {
+        "Name": f"Patient{index} Synthetic",
+        "DOB": f"19{rng.randint(30, 99)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+        "ID": f"SYN_{index}",
+        "Gender": rng.choice(["M", "F"]),
+    }
+    pii.update(extra)
+    return pii
+
+
+def medical_report(size, seed=0):
+    """Medical Report with `size` diagnoses, medications and procedures each."""
+    rng = random.Random(seed)
+    return {
+        "PII": _pii(rng, seed, Date=rng.choice(DATE_SAMPLES[:9])),
+        "Disease_disorder": _terms(rng, "icd10", size),
+        "Medication": _terms(rng, "rxnorm", size),
+        "Dosage": [f"{rng.choice([5, 10, 250, 500])}mg daily" for _ in range(size)],
+        "Procedure": [f"Procedure {i}" for i in range(size)],
+    }
+
+
+def lab_report(size, seed=0):
+    """Lab Report with `size` tests (mostly numeric values)."""
+    rng = random.Random(seed)
+    return {
+        "PII": _pii(rng, seed, Date="2025-01-12"),
+        "Lab_Tests": [
+            {
+                "Name": name,
+                "Value": str(round(rng.uniform(0.1, 300), 2)) if rng.random() < 0.9 else "Negative",
+                "Unit": rng.choice(["g/dL", "mg/dL", "mmol/L"]),
+                "Reference_Range": "see lab",
+            }
+            for name in _terms(rng, "loinc", size)
+        ],
+    }
+
+
+def discharge_summary(size, seed=0):
+    """Discharge Summary with `size` diagnoses and instructions."""
+    rng = random.Random(seed)
+    return {
+        "PII": _pii(rng, seed, Admission_Date="2025-01-02", Discharge_Date="January 9, 2025"),
+        "Diagnosis": _terms(rng, "icd10", size),
+        "Outcome": "Recovered",
+        "Instructions": [f"Instruction {i}" for i in range(size)],
+    }
+
+
+def admission_slip(size, seed=0):
+    """Admission Slip with `size` comma-separated admission reasons."""
+    rng = random.Random(seed)
+    return {
+        "PII": _pii(rng, seed, Date="2025/02/14"),
+        "Admission_Reason": ", ".join(_terms(rng, "icd10", size)),
+        "Department": "Cardiology",
+    }
+
+
+DOCUMENT_GENERATORS = {
+    "Medical Report": medical_report,
+    "Lab Report": lab_report,
+    "Discharge Summary": discharge_summary,
+    "Admission Slip": admission_slip,
+}
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -9,6 +10,124 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key')
     PORT = int(os.environ.get('PORT', 5005))
 
+    # JSON encoder for request parsing and plain-dict responses: 'json' or
+    # 'orjson' (faster; used only if the orjson package is installed)
+    JSON_ENCODER = os.environ.get('JSON_ENCODER', 'json')
+    # How the document mappers assemble resources: 'model' (fhir.resources
+    # objects) or 'dict' (plain dicts, cheaper; identical output)
+    MAPPER_BUILD_MODE = os.environ.get('MAPPER_BUILD_MODE', 'model')
+    # Harmonization: 'validate' (full Bundle model validation) or 'fast' (edits
+    # Patient entries of the raw JSON only, validating a sampled fraction of bundles)
+    HARMONIZE_MODE = os.environ.get('HARMONIZE_MODE', 'validate')
+    HARMONIZE_VALIDATION_SAMPLE_RATE = float(os.environ.get('HARMONIZE_VALIDATION_SAMPLE_RATE', 0.0))
+    # Validate/harmonize bundles of at least THRESHOLD entries in chunks of
+    # CHUNK_SIZE on a pool of WORKERS processes per server worker (0 = off)
+    HARMONIZE_PARALLEL_WORKERS = int(os.environ.get('HARMONIZE_PARALLEL_WORKERS', 0))
+    HARMONIZE_PARALLEL_THRESHOLD = int(os.environ.get('HARMONIZE_PARALLEL_THRESHOLD', 5000))
+    HARMONIZE_PARALLEL_CHUNK_SIZE = int(os.environ.get('HARMONIZE_PARALLEL_CHUNK_SIZE', 1000))
+    # Convert Observation quantities to the canonical unit of their LOINC code (off by default)
+    HARMONIZE_NORMALIZE_UNITS = os.environ.get('HARMONIZE_NORMALIZE_UNITS', 'false').lower() == 'true'
+    # Dominant date format per document type, tried first when normalizing its
+    # dates, as JSON, e.g. {"Lab Report": "%m/%d/%Y"}
+    DATE_FORMAT_HINTS = json.loads(os.environ.get('DATE_FORMAT_HINTS', '{}'))
+    # Import every fhir.resources model at startup instead of on the first
+    # model-mode request of each document type. Under gunicorn this happens
+    # once in the master (gunicorn.conf.py), before the workers are forked
+    PRELOAD_FHIR_MODELS = os.environ.get('PRELOAD_FHIR_MODELS', 'false').lower() == 'true'
+    # Derive resource IDs from the patient ID and the document's content instead
+    # of uuid4, so resubmitting a document yields the same Bundle
+    MAPPER_DETERMINISTIC_IDS = os.environ.get('MAPPER_DETERMINISTIC_IDS', 'false').lower() == 'true'
+    # Per-worker cache of mapped Bundles by document digest (0 = disabled)
+    MAPPING_RESULT_CACHE_SIZE = int(os.environ.get('MAPPING_RESULT_CACHE_SIZE', 0))
+    MAPPING_RESULT_CACHE_TTL = int(os.environ.get('MAPPING_RESULT_CACHE_TTL', 3600))
+
+    # Terminology lookups
+    TERMINOLOGY_PREFETCH_WORKERS = int(os.environ.get('TERMINOLOGY_PREFETCH_WORKERS', 8))
+
+    # 'remote' = NLM APIs, 'local' = offline indexes built with terminology_index.py
+    TERMINOLOGY_MODE = os.environ.get('TERMINOLOGY_MODE', 'remote')
+    TERMINOLOGY_INDEX_DIR = os.environ.get('TERMINOLOGY_INDEX_DIR')
+
+    # NLM HTTP client: keep-alive pool per worker (size it to the worker's concurrent
+    # lookups, i.e. threads x prefetch workers) and a circuit breaker per endpoint
+    TERMINOLOGY_HTTP_POOL_SIZE = int(os.environ.get('TERMINOLOGY_HTTP_POOL_SIZE', 10))
+    TERMINOLOGY_HTTP_TIMEOUT = float(os.environ.get('TERMINOLOGY_HTTP_TIMEOUT', 5))
+    TERMINOLOGY_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('TERMINOLOGY_BREAKER_FAILURE_THRESHOLD', 5))
+    TERMINOLOGY_BREAKER_RESET_TIMEOUT = float(os.environ.get('TERMINOLOGY_BREAKER_RESET_TIMEOUT', 30))
+    # Upstream calls in flight per worker (0 = unbounded); a call waits up to
+    # TERMINOLOGY_CALL_WAIT_TIMEOUT seconds for a slot, then falls back to text
+    TERMINOLOGY_MAX_CONCURRENT_CALLS = int(os.environ.get('TERMINOLOGY_MAX_CONCURRENT_CALLS', 32))
+    TERMINOLOGY_CALL_WAIT_TIMEOUT = float(os.environ.get('TERMINOLOGY_CALL_WAIT_TIMEOUT', 2))
+    TERMINOLOGY_ICD10_URL = os.environ.get('TERMINOLOGY_ICD10_URL')
+    TERMINOLOGY_LOINC_URL = os.environ.get('TERMINOLOGY_LOINC_URL')
+    TERMINOLOGY_RXNORM_URL = os.environ.get('TERMINOLOGY_RXNORM_URL')
+
+    # Terminology caches: in-memory L1, plus an optional persistent L2 shared by
+    # all workers on the host ('memory' = no L2, 'sqlite' = file at TERMINOLOGY_CACHE_PATH)
+    TERMINOLOGY_CACHE_BACKEND = os.environ.get('TERMINOLOGY_CACHE_BACKEND', 'memory')
+    TERMINOLOGY_CACHE_PATH = os.environ.get('TERMINOLOGY_CACHE_PATH')
+    # Rows kept in the sqlite file (0 = no limit); expired rows are purged every 1000 writes
+    TERMINOLOGY_CACHE_MAX_ENTRIES = int(os.environ.get('TERMINOLOGY_CACHE_MAX_ENTRIES', 100000))
+    # Size and TTL of each code system's cache
+    TERMINOLOGY_ICD10_CACHE_SIZE = int(os.environ.get('TERMINOLOGY_ICD10_CACHE_SIZE', 2000))
+    TERMINOLOGY_ICD10_CACHE_TTL = int(os.environ.get('TERMINOLOGY_ICD10_CACHE_TTL', 86400))
+    TERMINOLOGY_LOINC_CACHE_SIZE = int(os.environ.get('TERMINOLOGY_LOINC_CACHE_SIZE', 2000))
+    TERMINOLOGY_LOINC_CACHE_TTL = int(os.environ.get('TERMINOLOGY_LOINC_CACHE_TTL', 86400))
+    TERMINOLOGY_RXNORM_CACHE_SIZE = int(os.environ.get('TERMINOLOGY_RXNORM_CACHE_SIZE', 2000))
+    TERMINOLOGY_RXNORM_CACHE_TTL = int(os.environ.get('TERMINOLOGY_RXNORM_CACHE_TTL', 86400))
+    # Shorter lifetimes for "no match" results and for fallbacks caused by upstream failures
+    TERMINOLOGY_CACHE_NEGATIVE_TTL = int(os.environ.get('TERMINOLOGY_CACHE_NEGATIVE_TTL', 3600))
+    TERMINOLOGY_CACHE_FAILURE_TTL = int(os.environ.get('TERMINOLOGY_CACHE_FAILURE_TTL', 60))
+    # Cache snapshot loaded at startup (if the file exists) and written by the admin endpoint
+    TERMINOLOGY_SNAPSHOT_PATH = os.environ.get('TERMINOLOGY_SNAPSHOT_PATH')
+    # Term-frequency list (CSV: code_system,term,count) whose top N terms are
+    # resolved in the background at startup; /health reports "warming" until done
+    TERMINOLOGY_WARMUP_TERMS_PATH = os.environ.get('TERMINOLOGY_WARMUP_TERMS_PATH')
+    TERMINOLOGY_WARMUP_TOP_N = int(os.environ.get('TERMINOLOGY_WARMUP_TOP_N', 1000))
+
+    # Async jobs ("Prefer: respond-async"): pool threads and maximum queued or
+    # running jobs per worker, and where jobs are kept ('memory' = per worker,
+    # 'sqlite' = file at JOB_STORE_PATH shared by all workers; gunicorn.conf.py
+    # makes it the default with more than one worker and refuses 'memory' there)
+    # and for how long after they finish
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+    JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 100))
+    JOB_STORE = os.environ.get('JOB_STORE', 'memory')
+    JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH')
+    JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))
+    # Callback POST timeout, and the hosts callback URLs may use (comma-separated;
+    # empty = callbacks disabled). Hosts resolving to loopback, link-local or
+    # private addresses are refused unless JOB_CALLBACK_ALLOW_PRIVATE_NETWORKS is true
+    JOB_CALLBACK_TIMEOUT = float(os.environ.get('JOB_CALLBACK_TIMEOUT', 10))
+    JOB_CALLBACK_ALLOWED_HOSTS = [h.strip() for h in os.environ.get('JOB_CALLBACK_ALLOWED_HOSTS', '').split(',') if h.strip()]
+    JOB_CALLBACK_ALLOW_PRIVATE_NETWORKS = os.environ.get('JOB_CALLBACK_ALLOW_PRIVATE_NETWORKS', 'false').lower() == 'true'
+
+    # Admission control of the mapping routes, per worker: at most
+    # ADMISSION_MAX_IN_FLIGHT requests run at once (0 = no limit) and
+    # ADMISSION_MAX_WAITING more wait up to ADMISSION_WAIT_TIMEOUT seconds;
+    # others get 429 with Retry-After: ADMISSION_RETRY_AFTER
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 0))
+    ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', 0))
+    ADMISSION_WAIT_TIMEOUT = float(os.environ.get('ADMISSION_WAIT_TIMEOUT', 1))
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 1))
+
+    # Per-request profiling of /map/document and /harmonize, on requests sent
+    # with "X-Profile: 1" (report and .prof file in PROFILE_DIR) or "X-Profile:
+    # inline" (report in the response); PROFILE_TOP = functions/allocation sites listed
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    PROFILE_TOP = int(os.environ.get('PROFILE_TOP', 25))
+
+    # Trace spans of each request (routes, mapper builders, terminology lookups
+    # and upstream calls), exported as JSON lines to 'stdout' or 'file' (TRACE_FILE)
+    TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+    TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'stdout')
+    TRACE_FILE = os.environ.get('TRACE_FILE')
+
+    # Token required in the X-Admin-Token header by /api/v1/admin endpoints
+    # (the endpoints are disabled when unset)
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
 class DevelopmentConfig(Config):
     DEBUG = True
 
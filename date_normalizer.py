@@ -0,0 +1,158 @@
+"""
+Date normalization for the document mappers.
+
+normalize_date turns the date strings found in extracted documents into
+ISO-8601 dates (YYYY-MM-DD). Each string is first classified with compiled
+patterns, so only the formats it can possibly match are handed to strptime,
+in the same order as before; results are memoized per worker, since the same
+date recurs across the resources of a document and across documents.
+
+A source whose dates follow one dominant format can pass it as a hint: the
+hinted format is tried first and wins for strings that several formats accept
+(e.g. "03/12/2025" as '%m/%d/%Y'). Without a hint the output is exactly that of
+the plain format-by-format parse. A hint using directives other than %d, %m, %Y,
+%B and %b has no pattern and is handed to strptime for every string.
+"""
+
+import functools
+import logging
+import re
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Formats tried in order; the first that parses wins
+DATE_FORMATS = (
+    '%Y-%m-%d',
+    '%d/%m/%Y',
+    '%m/%d/%Y',
+    '%d-%m-%Y',
+    '%B %d, %Y',   # December 27, 2025
+    '%B %d %Y',    # December 27 2025
+    '%b %d, %Y',   # Dec 27, 2025
+    '%d %B %Y',    # 27 December 2025
+    '%Y/%m/%d',
+)
+
+# Distinct normalized strings kept per worker
+DATE_CACHE_SIZE = 4096
+
+# Shape of each format's field, loose enough to accept everything strptime
+# accepts (day may be " 7", a space in the format matches any whitespace run)
+_DAY = r'\s?\d{1,2}'
+_MONTH = r'\d{1,2}'
+_YEAR = r'\d{4}'
+_MONTH_NAME = r'[^\W\d_]+\.?'
+
+_FIELD_PATTERNS = {'%d': _DAY, '%m': _MONTH, '%Y': _YEAR, '%B': _MONTH_NAME, '%b': _MONTH_NAME}
+_DIRECTIVE = re.compile(r'%.?')
+
+
+def unsupported_directives(fmt):
+    """The strptime directives of fmt that the patterns do not model (e.g. %y, %H)."""
+    return sorted(set(_DIRECTIVE.findall(fmt)) - _FIELD_PATTERNS.keys())
+
+
+def _format_pattern(fmt):
+    """Compiled shape of the strings fmt accepts, or None if fmt has unsupported directives."""
+    if unsupported_directives(fmt):
+        return None
+    pattern = re.escape(fmt)
+    for directive, field in _FIELD_PATTERNS.items():
+        pattern = pattern.replace(re.escape(directive), field)
+    pattern = re.sub(r'(\\ )+', r'\\s+', pattern)
+    return re.compile(pattern, re.IGNORECASE)
+
+
+_FORMAT_PATTERNS = {fmt: _format_pattern(fmt) for fmt in DATE_FORMATS}
+
+
+def _candidate_formats(cleaned, hint=None):
+    """Formats whose shape matches the string, hinted format first."""
+    formats = DATE_FORMATS
+    if hint:
+        formats = (hint,) + tuple(fmt for fmt in DATE_FORMATS if fmt != hint)
+    for fmt in formats:
+        if fmt not in _FORMAT_PATTERNS:
+            _FORMAT_PATTERNS.setdefault(fmt, _format_pattern(fmt))
+        pattern = _FORMAT_PATTERNS[fmt]
+        # Without a pattern, strptime decides
+        if pattern is None or pattern.fullmatch(cleaned):
+            yield fmt
+
+
+def _normalize(date_str, hint=None):
+    if not date_str:
+        return None
+
+    # Already ISO-8601 format (YYYY-MM-DD or YYYY-MM-DDThh:mm:ss)
+    # Check specifically for date-like structure to avoid matching tokens like 'TKN_...'
+    if len(date_str) >= 10 and date_str[4] == '-' and date_str[7] == '-':
+        if 'T' in date_str:
+            return date_str.split('T')[0]
+        return date_str[:10]
+
+    # Clean the string
+    cleaned_date = date_str.strip().replace(" ,", ",")
+
+    for fmt in _candidate_formats(cleaned_date, hint):
+        try:
+            return datetime.strptime(cleaned_date, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            # Right shape, impossible date (e.g. 31/02/2025)
+            continue
+
+    # If parsing fails or it's a token (start with TKN), return None
+    # Returning empty string causes validation errors
+    if 'tkn' in date_str.lower():
+        logger.info(f"Ignored tokenized date: {date_str}")
+        return None
+
+    logger.warning(f"Could not parse date '{date_str}', returning None to avoid validation errors.")
+    return None
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _normalize_cached(date_str, hint):
+    return _normalize(date_str, hint)
+
+
+def normalize_date(date_str, hint=None):
+    """
+    Normalize date to ISO-8601 format (YYYY-MM-DD).
+    Handles various input formats including natural language dates.
+
+    Args:
+        date_str: Date as found in the source document
+        hint: strptime format most of this source's dates use, tried first
+
+    Returns:
+        str: YYYY-MM-DD, or None if the string is not a recognizable date
+    """
+    if isinstance(date_str, str):
+        return _normalize_cached(date_str, hint)
+    return _normalize(date_str, hint)
+
+
+def configure_date_normalizer(config):
+    """
+    Checks the DATE_FORMAT_HINTS setting ({document type: strptime format}).
+
+    Raises:
+        ValueError: If it is not an object of strings.
+    """
+    hints = config.get('DATE_FORMAT_HINTS', {})
+    if not isinstance(hints, dict) or not all(isinstance(hint, str) for hint in hints.values()):
+        raise ValueError('DATE_FORMAT_HINTS must map document types to strptime format strings')
+    for document_type, hint in hints.items():
+        unsupported = unsupported_directives(hint)
+        if unsupported:
+            logger.warning(
+                f"Date format hint '{hint}' for {document_type} uses {', '.join(unsupported)}: "
+                f"it is tried with strptime on every date instead of being matched first"
+            )
+
+
+def cache_info():
+    """lru_cache statistics of the memoized normalizer in this worker."""
+    return _normalize_cached.cache_info()
@@ -13,46 +13,322 @@ CRITICAL RULES:
 """
 
 
+import contextvars
+import functools
+import importlib
 import logging
+import math
+import re
+import time
 import uuid
-from datetime import datetime
-from typing import Dict, List, Any, Optional
-from fhir.resources.bundle import Bundle, BundleEntry, BundleEntryRequest
-from fhir.resources.patient import Patient
-from fhir.resources.identifier import Identifier
-from fhir.resources.humanname import HumanName
-from fhir.resources.condition import Condition
-from fhir.resources.codeableconcept import CodeableConcept
-from fhir.resources.medicationstatement import MedicationStatement
-from fhir.resources.dosage import Dosage
-from fhir.resources.procedure import Procedure
-from fhir.resources.observation import Observation, ObservationReferenceRange
-from fhir.resources.quantity import Quantity
-from fhir.resources.encounter import Encounter
+from datetime import date, datetime
+from decimal import Decimal
+from typing import TYPE_CHECKING, Dict, List, Any, Optional
+from pydantic_core import to_json
+
+# fhir.resources models are imported where they are built (model build mode
+# only), so importing this module stays cheap; see preload_models
+if TYPE_CHECKING:
+    from fhir.resources.bundle import Bundle
+    from fhir.resources.patient import Patient
+    from fhir.resources.condition import Condition
+    from fhir.resources.medicationstatement import MedicationStatement
+    from fhir.resources.procedure import Procedure
+    from fhir.resources.observation import Observation
+    from fhir.resources.encounter import Encounter
 
 try:
-    from terminology import get_condition_code, get_loinc_code, get_rxnorm_code
+    from terminology import CODE_SYSTEM_LOOKUPS, prefetch_codes, prefetch_codes_async
+    from date_normalizer import normalize_date
+    from terminology_cache import FailedLookup
+    from result_cache import document_digest
+    from tracing import traced, tracer
 except ImportError:
-    from harmon_service.terminology import get_condition_code, get_loinc_code, get_rxnorm_code
+    from harmon_service.terminology import CODE_SYSTEM_LOOKUPS, prefetch_codes, prefetch_codes_async
+    from harmon_service.date_normalizer import normalize_date
+    from harmon_service.terminology_cache import FailedLookup
+    from harmon_service.result_cache import document_digest
+    from harmon_service.tracing import traced, tracer
 
 logger = logging.getLogger(__name__)
 
+BUILD_MODE_MODEL = 'model'
+BUILD_MODE_DICT = 'dict'
+BUILD_MODES = (BUILD_MODE_MODEL, BUILD_MODE_DICT)
 
-class DocumentMapper:
-    """Base class for FHIR document mapping with common resource builders."""
+# Namespace of the uuid5 resource IDs derived in deterministic-ID mode (never change it:
+# resubmitted documents must keep producing the IDs already sent downstream)
+RESOURCE_ID_NAMESPACE = uuid.UUID('5f0c7a52-3b7e-4d8e-9a61-2f4c8e1d9b37')
+
+# Constant fragments shared by every resource built in dict mode (never mutated)
+_CONDITION_CLINICAL_STATUS_ACTIVE = {
+    "coding": [{
+        "system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
+        "code": "active"
+    }]
+}
+_CONDITION_VERIFICATION_STATUS_CONFIRMED = {
+    "coding": [{
+        "system": "http://terminology.hl7.org/CodeSystem/condition-ver-status",
+        "code": "confirmed"
+    }]
+}
+_ENCOUNTER_CLASS_INPATIENT = [{
+    "coding": [{
+        "system": "http://terminology.hl7.org/CodeSystem/v3-ActCode",
+        "code": "IMP",
+        "display": "inpatient encounter"
+    }]
+}]
+_GENDER_CODES = {
+    'm': 'male', 'male': 'male', 'man': 'male',
+    'f': 'female', 'female': 'female', 'woman': 'female',
+    'o': 'other', 'other': 'other',
+}
+_FHIR_DATE = re.compile(r'([0-9]([0-9]([0-9][1-9]|[1-9]0)|[1-9]00)|[1-9]000)-(0[1-9]|1[0-2])-(0[1-9]|[1-2][0-9]|3[0-1])')
+
+
+def _concept_dict(concept_data: Dict[str, Any]) -> Dict[str, Any]:
+    """CodeableConcept dict with keys in element order and nulls dropped."""
+    concept = {}
+    if concept_data.get('coding') is not None:
+        concept['coding'] = [
+            {key: coding[key] for key in ('system', 'code', 'display') if coding.get(key) is not None}
+            for coding in concept_data['coding']
+        ]
+    if concept_data.get('text') is not None:
+        concept['text'] = concept_data['text']
+    return concept
+
+
+def _check_date(value: Optional[str]) -> Optional[str]:
+    """
+    Reject dates that the model path rejects when assigning them to a
+    date/dateTime element, so both build modes fail on the same input.
+    """
+    if value is None:
+        return None
+    if not _FHIR_DATE.fullmatch(value):
+        raise ValueError(f"Invalid FHIR date: {value}")
+    date.fromisoformat(value)
+    return value
+
+
+def _check_text(value: Any) -> str:
+    """
+    Reject terms that are not strings, which the model path rejects when
+    assigning them to a string element, so both build modes fail on the same
+    input instead of the dict path emitting them as they are.
+    """
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid FHIR string: {type(value).__name__} value")
+    return value
+
+
+def _fhir_decimal(value: float) -> Any:
+    """
+    Quantity.value as the model path emits it: assignment converts the float
+    to a FHIR decimal, which serializes integral values with a non-negative
+    exponent (e.g. 1e+20) as integers. Non-finite values are rejected.
+    """
+    if not math.isfinite(value):
+        raise ValueError(f"Invalid FHIR decimal: {value}")
+    decimal_value = Decimal(repr(value))
+    if decimal_value == decimal_value.to_integral_value() and decimal_value.as_tuple().exponent >= 0:
+        return int(decimal_value)
+    return value
+
+
+class MappingContext:
+    """
+    State of one document being mapped. Mappers themselves are stateless and
+    shared; each map_to_fhir call works on its own context.
+    """
+    
+    __slots__ = ('patient_id', 'concepts', 'resolved_async', 'degraded', 'id_seed', 'id_counts',
+                 'timings', 'resource_counts')
     
     def __init__(self):
         self.patient_id = None
-        self.entries = []
+        # (code_system, text) -> prefetched CodeableConcept dict
+        self.concepts = {}
+        # Set by map_to_fhir_async once every lookup has been awaited
+        self.resolved_async = False
+        # Set when a term fell back to text because its lookup failed
+        self.degraded = False
+        # Digest of the document in deterministic-ID mode (None: random IDs),
+        # and IDs issued so far per resource type
+        self.id_seed = None
+        self.id_counts = {}
+        # Seconds spent per stage ("terminology", "serialize") and resources
+        # built by type, for metrics
+        self.timings = {}
+        self.resource_counts = {}
+
+
+# Context of the document being mapped by the current thread or task
+_current_context = contextvars.ContextVar('document_mapping_context')
+
+
+class DocumentMapper:
+    """
+    Base class for FHIR document mapping with common resource builders.
+    
+    Resources are built either as fhir.resources models (build_mode "model",
+    the default) or as plain dicts (build_mode "dict"), which skips the
+    per-resource model allocation; both produce byte-identical JSON.
+    
+    Instances hold configuration only and are safe to share between threads
+    and tasks: per-document state lives in a MappingContext bound for the
+    duration of map_to_fhir (see the properties below).
+    """
+    
+    # fhir.resources modules the model builders of this document type import
+    FHIR_MODEL_MODULES = (
+        'fhir.resources.bundle',
+        'fhir.resources.patient',
+        'fhir.resources.humanname',
+        'fhir.resources.identifier',
+        'fhir.resources.codeableconcept',
+    )
     
-    def map_to_fhir(self, data: Dict[str, Any]) -> str:
+    def __init__(self, build_mode: str = BUILD_MODE_MODEL, date_format_hint: Optional[str] = None,
+                 deterministic_ids: bool = False):
+        if build_mode not in BUILD_MODES:
+            raise ValueError(f"Unsupported build mode: {build_mode}. Supported modes: {', '.join(BUILD_MODES)}")
+        self.build_mode = build_mode
+        # strptime format most dates of this source use, tried first
+        self.date_format_hint = date_format_hint
+        # Derive resource IDs from the document instead of uuid4 (see _new_id)
+        self.deterministic_ids = deterministic_ids
+    
+    @property
+    def context(self) -> MappingContext:
+        try:
+            return _current_context.get()
+        except LookupError:
+            raise RuntimeError("No document is being mapped; builders run inside map_to_fhir") from None
+    
+    @property
+    def patient_id(self) -> Optional[str]:
+        return self.context.patient_id
+    
+    @patient_id.setter
+    def patient_id(self, value: Optional[str]) -> None:
+        self.context.patient_id = value
+    
+    @property
+    def concepts(self) -> Dict[tuple, Dict[str, Any]]:
+        return self.context.concepts
+    
+    def map_to_fhir(self, data: Dict[str, Any], context: Optional[MappingContext] = None) -> str:
         """
-        Main entry point for mapping. Must be implemented by subclasses.
+        Main entry point for mapping.
+        
+        Args:
+            data: Document JSON
+            context: Optional MappingContext to use, e.g. to read its timings afterwards
         Returns: JSON string of FHIR Bundle
         """
-        raise NotImplementedError("Subclasses must implement map_to_fhir")
+        context = context or MappingContext()
+        self._seed_ids(context, data)
+        token = _current_context.set(context)
+        try:
+            with tracer.span('mapper.map', mapper=type(self).__name__, build_mode=self.build_mode):
+                return self._map(data)
+        finally:
+            _current_context.reset(token)
+    
+    async def map_to_fhir_async(self, data: Dict[str, Any], context: Optional[MappingContext] = None) -> str:
+        """
+        Async variant of map_to_fhir: awaits all of the document's terminology
+        lookups together on the running event loop, then builds the Bundle.
+        Lookups that failed fall back to text-only concepts without blocking.
+        Returns: JSON string of FHIR Bundle
+        """
+        context = context or MappingContext()
+        self._seed_ids(context, data)
+        token = _current_context.set(context)
+        try:
+            with tracer.span('mapper.map', mapper=type(self).__name__, build_mode=self.build_mode, resolved_async=True):
+                terms = self._terminology_terms(data)
+                with tracer.span('mapper.prefetch_terminology', terms=len(terms)):
+                    start = time.perf_counter()
+                    context.concepts = await prefetch_codes_async(terms)
+                    context.timings['terminology'] = time.perf_counter() - start
+                context.resolved_async = True
+                return self._map(data)
+        finally:
+            _current_context.reset(token)
+    
+    def _map(self, data: Dict[str, Any]) -> str:
+        """Maps one document within the current context. Must be implemented by subclasses."""
+        raise NotImplementedError("Subclasses must implement _map")
+    
+    def _seed_ids(self, context: MappingContext, data: Dict[str, Any]) -> None:
+        if self.deterministic_ids and context.id_seed is None:
+            context.id_seed = document_digest(type(self).__name__, data)
+    
+    def _new_id(self, resource_type: str) -> str:
+        """
+        ID for the next resource of a type: random, or in deterministic-ID mode
+        a uuid5 of the patient ID, the document digest and the resource's
+        position among its type, so resubmitting the same document yields the
+        same IDs.
+        """
+        context = self.context
+        if context.id_seed is None:
+            return str(uuid.uuid4())
+        index = context.id_counts.get(resource_type, 0)
+        context.id_counts[resource_type] = index + 1
+        name = f"{context.patient_id or ''}/{resource_type}/{index}/{context.id_seed}"
+        return str(uuid.uuid5(RESOURCE_ID_NAMESPACE, name))
+    
+    def _terminology_terms(self, data: Dict[str, Any]) -> List[tuple]:
+        """(code_system, text) pairs of every terminology lookup a document needs."""
+        return []
+    
+    def _prefetch_terminology(self, terms: List[tuple]) -> None:
+        """
+        Resolve every terminology lookup of a document up front, concurrently.
+        
+        Args:
+            terms: (code_system, text) pairs; duplicates are resolved once
+        """
+        context = self.context
+        if context.resolved_async:
+            return
+        with tracer.span('mapper.prefetch_terminology', terms=len(terms)):
+            start = time.perf_counter()
+            context.concepts = prefetch_codes(terms)
+            context.timings['terminology'] = time.perf_counter() - start
+    
+    def _lookup_code(self, code_system: str, text: str) -> Dict[str, Any]:
+        """
+        Return the CodeableConcept dict for a term, preferring prefetched results.
+        Terms that were not prefetched (or whose prefetch failed) are looked up directly,
+        except under map_to_fhir_async, where they raise and the builders use the text.
+        """
+        context = self.context
+        concept_data = context.concepts.get((code_system, text))
+        if concept_data is None:
+            if context.resolved_async:
+                context.degraded = True
+                raise LookupError(f"No {code_system} concept resolved for '{text}'")
+            concept_data = CODE_SYSTEM_LOOKUPS[code_system](text)
+        if isinstance(concept_data, FailedLookup):
+            context.degraded = True
+        return concept_data
+    
+    @staticmethod
+    def _split_reasons(admission_reason: Optional[str]) -> List[str]:
+        """Split a comma-separated admission reason into individual reasons."""
+        if not admission_reason:
+            return []
+        return [r.strip() for r in admission_reason.split(',') if r.strip()]
     
-    def _build_patient(self, pii: Dict[str, Any]) -> Patient:
+    @traced('mapper.build', resource_type='Patient')
+    def _build_patient(self, pii: Dict[str, Any]) -> 'Patient':
         """
         Build FHIR Patient resource from PII data.
         
@@ -61,6 +337,13 @@ class DocumentMapper:
         - DOB: date of birth (ISO-8601)
         - ID: patient identifier (string)
         """
+        if self.build_mode == BUILD_MODE_DICT:
+            return self._build_patient_dict(pii)
+        
+        from fhir.resources.patient import Patient
+        from fhir.resources.humanname import HumanName
+        from fhir.resources.identifier import Identifier
+        
         patient = Patient.model_construct()
         
         # Set patient ID
@@ -72,12 +355,11 @@ class DocumentMapper:
             patient.id = self.patient_id
         else:
             # Generate UUID if no ID provided
-            self.patient_id = str(uuid.uuid4())
+            self.patient_id = self._new_id('Patient')
             patient.id = self.patient_id
         
         # Parse name
         name_str = pii.get('Name') or pii.get('name')
-        print(name_str)
         if name_str:
             name = HumanName.model_construct()
             name_parts = name_str.strip().split()
@@ -120,7 +402,8 @@ class DocumentMapper:
         
         return patient
     
-    def _build_condition(self, text: str, date: Optional[str] = None) -> Condition:
+    @traced('mapper.build', resource_type='Condition')
+    def _build_condition(self, text: str, date: Optional[str] = None) -> 'Condition':
         """
         Build FHIR Condition resource for disease/diagnosis.
         
@@ -128,15 +411,22 @@ class DocumentMapper:
             text: Disease or diagnosis name
             date: Optional recorded date
         """
+        _check_text(text)
+        if self.build_mode == BUILD_MODE_DICT:
+            return self._build_condition_dict(text, date)
+        
+        from fhir.resources.condition import Condition
+        from fhir.resources.codeableconcept import CodeableConcept
+        
         condition = Condition.model_construct()
-        condition.id = str(uuid.uuid4())
+        condition.id = self._new_id('Condition')
         
         # Reference patient
         condition.subject = {"reference": f"Patient/{self.patient_id}"}
         
         try:
              # Use terminology service to look up ICD-10 code
-            concept_data = get_condition_code(text)
+            concept_data = self._lookup_code('icd10', text)
             condition.code = CodeableConcept.model_construct(**concept_data)
         except Exception as e:
             logger.warning(f"Terminology lookup failed for '{text}', using raw text: {e}")
@@ -164,7 +454,8 @@ class DocumentMapper:
         
         return condition
     
-    def _build_medication_statement(self, medication: str, dosage_text: Optional[str] = None) -> MedicationStatement:
+    @traced('mapper.build', resource_type='MedicationStatement')
+    def _build_medication_statement(self, medication: str, dosage_text: Optional[str] = None) -> 'MedicationStatement':
         """
         Build FHIR MedicationStatement resource.
         
@@ -172,9 +463,18 @@ class DocumentMapper:
             medication: Medication name
             dosage_text: Optional dosage instructions
         """
+        _check_text(medication)
+        if dosage_text:
+            _check_text(dosage_text)
+        if self.build_mode == BUILD_MODE_DICT:
+            return self._build_medication_statement_dict(medication, dosage_text)
+        
+        from fhir.resources.medicationstatement import MedicationStatement
+        from fhir.resources.codeableconcept import CodeableConcept
+        
         # Build data dict for MedicationStatement
         med_data = {
-            "id": str(uuid.uuid4()),
+            "id": self._new_id('MedicationStatement'),
             "subject": {"reference": f"Patient/{self.patient_id}"},
             "status": "active"
         }
@@ -182,7 +482,7 @@ class DocumentMapper:
         # Prepare concept with RxNorm lookup
         concept = None
         try:
-            concept_data = get_rxnorm_code(medication)
+            concept_data = self._lookup_code('rxnorm', medication)
             concept = CodeableConcept.model_construct(**concept_data)
         except Exception:
             # Fallback
@@ -209,7 +509,8 @@ class DocumentMapper:
         
         return med_statement
     
-    def _build_procedure(self, procedure_name: str, date: Optional[str] = None) -> Procedure:
+    @traced('mapper.build', resource_type='Procedure')
+    def _build_procedure(self, procedure_name: str, date: Optional[str] = None) -> 'Procedure':
         """
         Build FHIR Procedure resource.
         
@@ -217,8 +518,14 @@ class DocumentMapper:
             procedure_name: Name of the procedure
             date: Optional procedure date
         """
+        _check_text(procedure_name)
+        if self.build_mode == BUILD_MODE_DICT:
+            return self._build_procedure_dict(procedure_name, date)
+        
+        from fhir.resources.procedure import Procedure
+        
         proc_data = {
-            "id": str(uuid.uuid4()),
+            "id": self._new_id('Procedure'),
             "subject": {"reference": f"Patient/{self.patient_id}"},
             "status": "completed",  # Required field
             "code": {"text": procedure_name}
@@ -232,8 +539,9 @@ class DocumentMapper:
         
         return procedure
     
+    @traced('mapper.build', resource_type='Observation')
     def _build_observation(self, test_name: str, value: Any, unit: Optional[str] = None,
-                          reference_range: Optional[str] = None, date: Optional[str] = None) -> Observation:
+                          reference_range: Optional[str] = None, date: Optional[str] = None) -> 'Observation':
         """
         Build FHIR Observation resource for lab tests ONLY.
         
@@ -244,16 +552,24 @@ class DocumentMapper:
             reference_range: Reference range text
             date: Test date
         """
+        _check_text(test_name)
+        if self.build_mode == BUILD_MODE_DICT:
+            return self._build_observation_dict(test_name, value, unit, reference_range, date)
+        
+        from fhir.resources.observation import Observation, ObservationReferenceRange
+        from fhir.resources.codeableconcept import CodeableConcept
+        from fhir.resources.quantity import Quantity
+        
         # Build data dict
         obs_data = {
-            "id": str(uuid.uuid4()),
+            "id": self._new_id('Observation'),
             "subject": {"reference": f"Patient/{self.patient_id}"},
             "status": "final"
         }
         
         # Set observation code (lab test name)
         try:
-            concept_data = get_loinc_code(test_name)
+            concept_data = self._lookup_code('loinc', test_name)
             obs_data["code"] = CodeableConcept.model_construct(**concept_data)
         except Exception:
             obs_data["code"] = CodeableConcept.model_construct(text=test_name)
@@ -287,9 +603,10 @@ class DocumentMapper:
         
         return observation
     
+    @traced('mapper.build', resource_type='Encounter')
     def _build_encounter(self, admission_date: Optional[str] = None, discharge_date: Optional[str] = None,
                         admission_reason: Optional[str] = None, department: Optional[str] = None,
-                        outcome: Optional[str] = None, instructions: Optional[List[str]] = None) -> Encounter:
+                        outcome: Optional[str] = None, instructions: Optional[List[str]] = None) -> 'Encounter':
         """
         Build FHIR Encounter resource for admission/discharge.
         
@@ -301,8 +618,14 @@ class DocumentMapper:
             outcome: Discharge outcome
             instructions: Discharge instructions
         """
+        if self.build_mode == BUILD_MODE_DICT:
+            return self._build_encounter_dict(admission_date, discharge_date, admission_reason, department, outcome, instructions)
+        
+        from fhir.resources.encounter import Encounter
+        from fhir.resources.codeableconcept import CodeableConcept
+        
         encounter = Encounter.model_construct(
-            id=str(uuid.uuid4()),
+            id=self._new_id('Encounter'),
             subject={"reference": f"Patient/{self.patient_id}"},
             status="finished"
         )
@@ -334,14 +657,14 @@ class DocumentMapper:
         if admission_reason:
             encounter_reasons = []
             # Split by comma to handle multiple reasons
-            reasons = [r.strip() for r in admission_reason.split(',') if r.strip()]
+            reasons = self._split_reasons(admission_reason)
             
             for r_text in reasons:
                 # Default to text only
                 concept_data = {"text": r_text}
                 try:
                     # Attempt terminology lookup (ICD-10)
-                    concept_data = get_condition_code(r_text)
+                    concept_data = self._lookup_code('icd10', r_text)
                 except Exception as e:
                     logger.warning(f"Reason terminology lookup failed for '{r_text}': {e}")
                 
@@ -380,13 +703,24 @@ class DocumentMapper:
         
         return encounter
     
-    def _build_bundle(self, resources: List[Any]) -> Bundle:
+    @traced('mapper.build', resource_type='Bundle')
+    def _build_bundle(self, resources: List[Any]) -> 'Bundle':
         """
         Build FHIR transaction Bundle from resources.
         
         Args:
             resources: List of FHIR resources
         """
+        resource_counts = self.context.resource_counts
+        for resource in resources:
+            resource_type = resource["resourceType"] if isinstance(resource, dict) else type(resource).__name__
+            resource_counts[resource_type] = resource_counts.get(resource_type, 0) + 1
+        
+        if self.build_mode == BUILD_MODE_DICT:
+            return self._build_bundle_dict(resources)
+        
+        from fhir.resources.bundle import Bundle, BundleEntry
+        
         bundle = Bundle.model_construct()
         bundle.type = "transaction"
         
@@ -401,57 +735,239 @@ class DocumentMapper:
         
         return bundle
     
+    @traced('mapper.serialize')
+    def _serialize_bundle(self, bundle: Any) -> str:
+        """
+        Encode the Bundle once, as compact JSON without null fields.
+        The routes send this string as the response body unchanged.
+        """
+        start = time.perf_counter()
+        if self.build_mode == BUILD_MODE_DICT:
+            body = to_json(bundle).decode('utf-8')
+        else:
+            body = bundle.model_dump_json(exclude_none=True)
+        self.context.timings['serialize'] = time.perf_counter() - start
+        return body
+    
+    # ------------------------------------------------------------------
+    # Dict build mode
+    #
+    # Same resources as the model builders above, assembled as plain dicts
+    # (keys in FHIR element order, shared constant fragments) and encoded with
+    # pydantic_core, so the output is byte-identical to the model path.
+    # ------------------------------------------------------------------
+    
+    def _build_patient_dict(self, pii: Dict[str, Any]) -> Dict[str, Any]:
+        patient = {"resourceType": "Patient"}
+        
+        patient_id = pii.get('ID') or pii.get('id')
+        if patient_id:
+            self.patient_id = str(patient_id).replace('_', '-')
+        else:
+            self.patient_id = self._new_id('Patient')
+        patient["id"] = self.patient_id
+        
+        name = None
+        name_str = pii.get('Name') or pii.get('name')
+        if name_str:
+            name_parts = name_str.strip().split()
+            if len(name_parts) >= 2:
+                name = {"family": name_parts[-1], "given": name_parts[:-1]}
+            elif len(name_parts) == 1:
+                name = {"family": name_parts[0]}
+            else:
+                name = {"text": name_str}
+        
+        birth_date = None
+        dob = pii.get('DOB') or pii.get('dob')
+        if dob:
+            birth_date = _check_date(self._normalize_date(dob))
+            if not birth_date and 'tkn' in str(dob).lower():
+                patient["identifier"] = [{"system": "http://privacy.service/dob-token", "value": dob}]
+        
+        if name is not None:
+            patient["name"] = [name]
+        
+        gender_raw = pii.get('Gender') or pii.get('gender')
+        if gender_raw:
+            patient["gender"] = _GENDER_CODES.get(gender_raw.lower().strip(), 'unknown')
+        
+        if birth_date:
+            patient["birthDate"] = birth_date
+        
+        return patient
+    
+    def _build_condition_dict(self, text: str, date: Optional[str] = None) -> Dict[str, Any]:
+        condition = {
+            "resourceType": "Condition",
+            "id": self._new_id('Condition'),
+            "clinicalStatus": _CONDITION_CLINICAL_STATUS_ACTIVE,
+            "verificationStatus": _CONDITION_VERIFICATION_STATUS_CONFIRMED,
+        }
+        
+        try:
+            condition["code"] = _concept_dict(self._lookup_code('icd10', text))
+        except Exception as e:
+            logger.warning(f"Terminology lookup failed for '{text}', using raw text: {e}")
+            condition["code"] = {"text": text}
+        
+        condition["subject"] = {"reference": f"Patient/{self.patient_id}"}
+        
+        if date:
+            recorded_date = _check_date(self._normalize_date(date))
+            if recorded_date:
+                condition["recordedDate"] = recorded_date
+        
+        return condition
+    
+    def _build_medication_statement_dict(self, medication: str, dosage_text: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            concept = _concept_dict(self._lookup_code('rxnorm', medication))
+        except Exception:
+            concept = {"text": medication}
+        
+        med_statement = {
+            "resourceType": "MedicationStatement",
+            "id": self._new_id('MedicationStatement'),
+            "status": "active",
+            "medication": {"concept": concept},
+            "subject": {"reference": f"Patient/{self.patient_id}"},
+        }
+        if dosage_text:
+            med_statement["dosage"] = [{"text": dosage_text}]
+        
+        return med_statement
+    
+    def _build_procedure_dict(self, procedure_name: str, date: Optional[str] = None) -> Dict[str, Any]:
+        # R5 Procedure has no performedDateTime; the model path drops it when
+        # serializing, so it is not emitted here either.
+        return {
+            "resourceType": "Procedure",
+            "id": self._new_id('Procedure'),
+            "status": "completed",
+            "code": {"text": procedure_name},
+            "subject": {"reference": f"Patient/{self.patient_id}"},
+        }
+    
+    def _build_observation_dict(self, test_name: str, value: Any, unit: Optional[str] = None,
+                                reference_range: Optional[str] = None, date: Optional[str] = None) -> Dict[str, Any]:
+        observation = {
+            "resourceType": "Observation",
+            "id": self._new_id('Observation'),
+            "status": "final",
+        }
+        
+        try:
+            observation["code"] = _concept_dict(self._lookup_code('loinc', test_name))
+        except Exception:
+            observation["code"] = {"text": test_name}
+        
+        observation["subject"] = {"reference": f"Patient/{self.patient_id}"}
+        
+        if date:
+            effective = self._normalize_date(date)
+            if effective is not None:
+                observation["effectiveDateTime"] = effective
+        else:
+            observation["effectiveDateTime"] = datetime.utcnow().isoformat()
+        
+        if value is not None:
+            try:
+                quantity = {"value": _fhir_decimal(float(value))}
+                if unit:
+                    quantity["unit"] = unit
+                observation["valueQuantity"] = quantity
+            except (ValueError, TypeError):
+                observation["valueString"] = str(value)
+        
+        if reference_range:
+            observation["referenceRange"] = [{"text": reference_range}]
+        
+        return observation
+    
+    def _build_encounter_dict(self, admission_date: Optional[str] = None, discharge_date: Optional[str] = None,
+                              admission_reason: Optional[str] = None, department: Optional[str] = None,
+                              outcome: Optional[str] = None, instructions: Optional[List[str]] = None) -> Dict[str, Any]:
+        encounter = {
+            "resourceType": "Encounter",
+            "id": self._new_id('Encounter'),
+            "status": "finished",
+            "class": _ENCOUNTER_CLASS_INPATIENT,
+        }
+        
+        if department:
+            encounter["serviceType"] = [{"concept": {"text": department}}]
+        
+        encounter["subject"] = {"reference": f"Patient/{self.patient_id}"}
+        
+        if admission_date or discharge_date:
+            period = {}
+            if admission_date:
+                start = _check_date(self._normalize_date(admission_date))
+                if start:
+                    period["start"] = start
+            if discharge_date:
+                end = _check_date(self._normalize_date(discharge_date))
+                if end:
+                    period["end"] = end
+            encounter["actualPeriod"] = period
+        
+        if admission_reason:
+            encounter_reasons = []
+            for r_text in self._split_reasons(admission_reason):
+                concept_data = {"text": r_text}
+                try:
+                    concept_data = self._lookup_code('icd10', r_text)
+                except Exception as e:
+                    logger.warning(f"Reason terminology lookup failed for '{r_text}': {e}")
+                encounter_reasons.append({"value": [{"concept": _concept_dict(concept_data)}]})
+            encounter["reason"] = encounter_reasons
+        
+        if outcome or instructions:
+            disposition_text = []
+            if outcome:
+                disposition_text.append(f"Outcome: {outcome}")
+            if instructions:
+                disposition_text.append("Instructions: " + "; ".join(instructions))
+            encounter["admission"] = {"dischargeDisposition": {"text": " | ".join(disposition_text)}}
+        
+        return encounter
+    
+    def _build_bundle_dict(self, resources: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "resourceType": "Bundle",
+            "type": "transaction",
+            "entry": [
+                {"resource": resource, "request": {"method": "POST", "url": resource["resourceType"]}}
+                for resource in resources
+            ],
+        }
+    
     def _normalize_date(self, date_str: str) -> str:
         """
         Normalize date to ISO-8601 format (YYYY-MM-DD).
         Handles various input formats including natural language dates.
+        Uses the mapper's date format hint, if any (see date_normalizer).
         """
-        if not date_str:
-            return None
-        
-        # Already ISO-8601 format (YYYY-MM-DD or YYYY-MM-DDThh:mm:ss)
-        # Check specifically for date-like structure to avoid matching tokens like 'TKN_...'
-        if len(date_str) >= 10 and date_str[4] == '-' and date_str[7] == '-':
-             if 'T' in date_str:
-                 return date_str.split('T')[0]
-             return date_str[:10]
-             
-        # Clean the string
-        cleaned_date = date_str.strip().replace(" ,", ",").replace(", ", ", ")
-        
-        formats_to_try = [
-            '%Y-%m-%d', 
-            '%d/%m/%Y', 
-            '%m/%d/%Y', 
-            '%d-%m-%Y',
-            '%B %d, %Y',   # December 27, 2025
-            '%B %d %Y',    # December 27 2025
-            '%b %d, %Y',   # Dec 27, 2025
-            '%d %B %Y',    # 27 December 2025
-            '%Y/%m/%d'
-        ]
-
-        for fmt in formats_to_try:
-            try:
-                dt = datetime.strptime(cleaned_date, fmt)
-                return dt.strftime('%Y-%m-%d')
-            except ValueError:
-                continue
-                
-        # If parsing fails or it's a token (start with TKN), return None
-        # Returning empty string causes validation errors
-        if 'tkn' in date_str.lower():
-            logger.info(f"Ignored tokenized date: {date_str}")
-            return None
-            
-        logger.warning(f"Could not parse date '{date_str}', returning None to avoid validation errors.")
-        return None
+        return normalize_date(date_str, self.date_format_hint)
 
 
 class MedicalReportMapper(DocumentMapper):
     """Maps Medical Report JSON to FHIR Bundle."""
     
-    def map_to_fhir(self, data: Dict[str, Any]) -> str:
+    FHIR_MODEL_MODULES = DocumentMapper.FHIR_MODEL_MODULES + (
+        'fhir.resources.condition',
+        'fhir.resources.medicationstatement',
+        'fhir.resources.procedure',
+    )
+    
+    def _terminology_terms(self, data: Dict[str, Any]) -> List[tuple]:
+        return (
+            [('icd10', d) for d in data.get('Disease_disorder') or [] if d] +
+            [('rxnorm', m) for m in data.get('Medication') or [] if m]
+        )
+    
+    def _map(self, data: Dict[str, Any]) -> str:
         """
         Map Medical Report to FHIR Bundle.
         
@@ -473,8 +989,13 @@ class MedicalReportMapper(DocumentMapper):
         
         report_date = pii.get('Date')
         
-        # 2. Create Condition resources for diseases
         diseases = data.get('Disease_disorder', [])
+        medications = data.get('Medication', [])
+        
+        # Resolve all ICD-10 and RxNorm codes for the document concurrently
+        self._prefetch_terminology(self._terminology_terms(data))
+        
+        # 2. Create Condition resources for diseases
         if diseases:
             for disease in diseases:
                 if disease:  # Skip empty strings
@@ -482,12 +1003,11 @@ class MedicalReportMapper(DocumentMapper):
                     resources.append(condition)
         
         # 3. Create MedicationStatement resources
-        medications = data.get('Medication', [])
         dosages = data.get('Dosage', [])
         
-        # Ensure dosages list is same length as medications
-        while len(dosages) < len(medications):
-            dosages.append(None)
+        # Ensure dosages list is same length as medications (without touching the input)
+        if len(dosages) < len(medications):
+            dosages = list(dosages) + [None] * (len(medications) - len(dosages))
         
         for med, dose in zip(medications, dosages):
             if med:  # Skip empty strings
@@ -505,13 +1025,24 @@ class MedicalReportMapper(DocumentMapper):
         # 5. Build transaction Bundle
         bundle = self._build_bundle(resources)
         
-        return bundle.model_dump_json(exclude_none=True)
+        return self._serialize_bundle(bundle)
 
 
 class LabReportMapper(DocumentMapper):
     """Maps Lab Report JSON to FHIR Bundle."""
     
-    def map_to_fhir(self, data: Dict[str, Any]) -> str:
+    FHIR_MODEL_MODULES = DocumentMapper.FHIR_MODEL_MODULES + (
+        'fhir.resources.observation',
+        'fhir.resources.quantity',
+    )
+    
+    def _terminology_terms(self, data: Dict[str, Any]) -> List[tuple]:
+        return [
+            ('loinc', test.get('Name'))
+            for test in data.get('Lab_Tests') or [] if isinstance(test, dict) and test.get('Name')
+        ]
+    
+    def _map(self, data: Dict[str, Any]) -> str:
         """
         Map Lab Report to FHIR Bundle.
         
@@ -532,8 +1063,12 @@ class LabReportMapper(DocumentMapper):
         
         test_date = pii.get('Date')
         
-        # 2. Create Observation resources for each lab test
         lab_tests = data.get('Lab_Tests', [])
+        
+        # Resolve all LOINC codes for the document concurrently
+        self._prefetch_terminology(self._terminology_terms(data))
+        
+        # 2. Create Observation resources for each lab test
         if lab_tests:
             for test in lab_tests:
                 if isinstance(test, dict):
@@ -551,13 +1086,21 @@ class LabReportMapper(DocumentMapper):
         # 3. Build transaction Bundle
         bundle = self._build_bundle(resources)
         
-        return bundle.json()
+        return self._serialize_bundle(bundle)
 
 
 class DischargeSummaryMapper(DocumentMapper):
     """Maps Discharge Summary JSON to FHIR Bundle."""
     
-    def map_to_fhir(self, data: Dict[str, Any]) -> str:
+    FHIR_MODEL_MODULES = DocumentMapper.FHIR_MODEL_MODULES + (
+        'fhir.resources.condition',
+        'fhir.resources.encounter',
+    )
+    
+    def _terminology_terms(self, data: Dict[str, Any]) -> List[tuple]:
+        return [('icd10', d) for d in data.get('Diagnosis') or [] if d]
+    
+    def _map(self, data: Dict[str, Any]) -> str:
         """
         Map Discharge Summary to FHIR Bundle.
         
@@ -580,6 +1123,9 @@ class DischargeSummaryMapper(DocumentMapper):
         diagnoses = data.get('Diagnosis', [])
         discharge_date = pii.get('Discharge_Date')
         
+        # Resolve all ICD-10 codes for the document concurrently
+        self._prefetch_terminology(self._terminology_terms(data))
+        
         if diagnoses:
             for diagnosis in diagnoses:
                 if diagnosis:  # Skip empty strings
@@ -602,13 +1148,20 @@ class DischargeSummaryMapper(DocumentMapper):
         # 4. Build transaction Bundle
         bundle = self._build_bundle(resources)
         
-        return bundle.model_dump_json(exclude_none=True)
+        return self._serialize_bundle(bundle)
 
 
 class AdmissionSlipMapper(DocumentMapper):
     """Maps Admission Slip JSON to FHIR Bundle."""
     
-    def map_to_fhir(self, data: Dict[str, Any]) -> str:
+    FHIR_MODEL_MODULES = DocumentMapper.FHIR_MODEL_MODULES + (
+        'fhir.resources.encounter',
+    )
+    
+    def _terminology_terms(self, data: Dict[str, Any]) -> List[tuple]:
+        return [('icd10', r) for r in self._split_reasons(data.get('Admission_Reason'))]
+    
+    def _map(self, data: Dict[str, Any]) -> str:
         """
         Map Admission Slip to FHIR Bundle.
         
@@ -632,6 +1185,9 @@ class AdmissionSlipMapper(DocumentMapper):
         admission_reason = data.get('Admission_Reason')
         department = data.get('Department')
         
+        # Resolve the ICD-10 codes of every admission reason concurrently
+        self._prefetch_terminology(self._terminology_terms(data))
+        
         encounter = self._build_encounter(
             admission_date=admission_date,
             admission_reason=admission_reason,
@@ -646,36 +1202,75 @@ class AdmissionSlipMapper(DocumentMapper):
         # 3. Build transaction Bundle
         bundle = self._build_bundle(resources)
         
-        return bundle.json()
+        return self._serialize_bundle(bundle)
 
 
 # Factory function for getting the right mapper
-def get_document_mapper(document_type: str) -> DocumentMapper:
+MAPPER_CLASSES = {
+    "Medical Report": MedicalReportMapper,
+    "Lab Report": LabReportMapper,
+    "Discharge Summary": DischargeSummaryMapper,
+    "Admission Slip": AdmissionSlipMapper
+}
+
+# Shared, stateless mapper per document type with the default options
+MAPPERS = {document_type: mapper_class() for document_type, mapper_class in MAPPER_CLASSES.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def _configured_mapper(document_type: str, build_mode: str, date_format_hint: Optional[str],
+                       deterministic_ids: bool) -> DocumentMapper:
+    return MAPPER_CLASSES[document_type](
+        build_mode=build_mode, date_format_hint=date_format_hint, deterministic_ids=deterministic_ids
+    )
+
+
+def get_document_mapper(document_type: str, build_mode: str = BUILD_MODE_MODEL,
+                        date_format_hint: Optional[str] = None, deterministic_ids: bool = False) -> DocumentMapper:
     """
-    Factory function to get appropriate mapper for document type.
+    Returns the shared mapper for a document type. Mappers are stateless, so
+    the same instance serves every request and thread.
     
     Args:
         document_type: One of "Medical Report", "Lab Report", 
                       "Discharge Summary", "Admission Slip"
+        build_mode: "model" (fhir.resources objects) or "dict" (plain dicts)
+        date_format_hint: Dominant strptime date format of the source, e.g. "%m/%d/%Y"
+        deterministic_ids: Derive resource IDs from the document instead of uuid4
     
     Returns:
         DocumentMapper instance
     
     Raises:
-        ValueError: If document type is not supported
+        ValueError: If document type or build mode is not supported
     """
-    mappers = {
-        "Medical Report": MedicalReportMapper,
-        "Lab Report": LabReportMapper,
-        "Discharge Summary": DischargeSummaryMapper,
-        "Admission Slip": AdmissionSlipMapper
-    }
-    
-    mapper_class = mappers.get(document_type)
-    if not mapper_class:
+    if document_type not in MAPPER_CLASSES:
         raise ValueError(
             f"Unsupported document type: {document_type}. "
-            f"Supported types: {', '.join(mappers.keys())}"
+            f"Supported types: {', '.join(MAPPER_CLASSES.keys())}"
         )
     
-    return mapper_class()
+    if build_mode == BUILD_MODE_MODEL and date_format_hint is None and not deterministic_ids:
+        return MAPPERS[document_type]
+    return _configured_mapper(document_type, build_mode, date_format_hint, bool(deterministic_ids))
+
+
+def preload_models(document_types: Optional[List[str]] = None) -> float:
+    """
+    Imports the fhir.resources models that the given document types (default:
+    all) build, instead of on their first model-mode request. Called in the
+    gunicorn master before forking, the imported modules are shared by every
+    worker copy-on-write.
+    
+    Returns:
+        Seconds spent importing
+    """
+    start = time.perf_counter()
+    modules = {'fhir.resources.bundle', 'fhir.resources.patient', 'fhir.resources.meta'}  # harmonization
+    for document_type in document_types or MAPPER_CLASSES:
+        modules.update(MAPPER_CLASSES[document_type].FHIR_MODEL_MODULES)
+    for module in sorted(modules):
+        importlib.import_module(module)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Preloaded {len(modules)} FHIR model modules in {elapsed:.2f}s")
+    return elapsed
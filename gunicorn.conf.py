@@ -0,0 +1,35 @@
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5005)}"
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+
+# Each worker has its own memory job store, so a job polled on another worker
+# would be "not found": share jobs through SQLite unless told otherwise
+if workers > 1:
+    os.environ.setdefault('JOB_STORE', 'sqlite')
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and os.environ.get('JOB_STORE', 'memory') == 'memory':
+        raise RuntimeError(
+            f"JOB_STORE=memory cannot be used with {server.cfg.workers} workers: "
+            "jobs would only be visible to the worker that accepted them; set JOB_STORE=sqlite"
+        )
+
+    # Metric files from a previous run would be aggregated into this one's
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+    # Import the FHIR models once here, so forked workers share them copy-on-write
+    # instead of each importing them on its first request
+    if os.environ.get('PRELOAD_FHIR_MODELS', 'false').lower() == 'true':
+        from document_mapper import preload_models
+        preload_models()
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
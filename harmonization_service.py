@@ -1,39 +1,445 @@
+import codecs
 import logging
 import json
-from fhir.resources.bundle import Bundle
-from fhir.resources.patient import Patient
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from serialization import dumps
+    from metrics import observe_stage, stage_timer
+    from unit_normalization import normalize_observation_units
+except ImportError:
+    from harmon_service.serialization import dumps
+    from harmon_service.metrics import observe_stage, stage_timer
+    from harmon_service.unit_normalization import normalize_observation_units
 
 logger = logging.getLogger(__name__)
 
+HARMONIZE_MODE_VALIDATE = 'validate'
+HARMONIZE_MODE_FAST = 'fast'
+HARMONIZE_MODES = (HARMONIZE_MODE_VALIDATE, HARMONIZE_MODE_FAST)
+
+HARMONIZED_TAG = {
+    "system": "http://example.org/tags",
+    "code": "harmonized",
+    "display": "Data has been harmonized"
+}
+
+# Parallel harmonization: bundles with at least `threshold` entries are split
+# into chunks of `chunk_size` entries, validated and harmonized on a pool of
+# `workers` processes (0 = disabled). See configure_harmonization
+DEFAULT_PARALLEL_THRESHOLD = 5000
+DEFAULT_PARALLEL_CHUNK_SIZE = 1000
+
+_parallel = {'workers': 0, 'threshold': DEFAULT_PARALLEL_THRESHOLD, 'chunk_size': DEFAULT_PARALLEL_CHUNK_SIZE}
+# Optional stages run on every Bundle (HARMONIZE_NORMALIZE_UNITS)
+_stages = {'normalize_units': False}
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Placeholder entry marking where the harmonized entries go in the Bundle JSON
+_ENTRY_PLACEHOLDER = 'urn:uuid:00000000-0000-0000-0000-00000000e17e'
+
+
+def configure_harmonization(config):
+    """Applies the HARMONIZE_* settings. The process pool starts on first use."""
+    global _pool
+    _stages['normalize_units'] = config.get('HARMONIZE_NORMALIZE_UNITS', False)
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+        _parallel['workers'] = config.get('HARMONIZE_PARALLEL_WORKERS', 0)
+        _parallel['threshold'] = config.get('HARMONIZE_PARALLEL_THRESHOLD', DEFAULT_PARALLEL_THRESHOLD)
+        _parallel['chunk_size'] = config.get('HARMONIZE_PARALLEL_CHUNK_SIZE', DEFAULT_PARALLEL_CHUNK_SIZE)
+
+
+def _process_pool():
+    """This process's harmonization pool (a pool inherited over fork is not reused)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Fresh interpreters: forking a threaded server worker is unsafe
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=_parallel['workers'], mp_context=multiprocessing.get_context(method))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _use_parallel(entries):
+    return (_parallel['workers'] > 0 and isinstance(entries, list)
+            and len(entries) >= max(_parallel['threshold'], 1))
+
+
+def _harmonize_entry_chunk(entries, harmonize=True, offset=0):
+    """
+    Process pool task: validates a chunk of Bundle entries and, if harmonize,
+    harmonizes their Patients and returns each entry's JSON.
+    """
+    from fhir.resources.bundle import BundleEntry
+    from fhir.resources.patient import Patient
+    
+    results = []
+    for index, entry in enumerate(entries, start=offset):
+        try:
+            model = BundleEntry.model_validate(entry)
+        except ValueError as e:
+            # Plain ValueError: validation errors do not survive the trip back from the pool
+            raise ValueError(f"Bundle.entry[{index}]: {e}") from None
+        if harmonize:
+            if isinstance(model.resource, Patient):
+                HarmonizationService._harmonize_patient(model.resource)
+            results.append(model.model_dump_json(exclude_none=True))
+    return results
+
+
+def _map_entry_chunks(entries, harmonize):
+    """Runs _harmonize_entry_chunk over the entries on the pool; results in entry order."""
+    size = _parallel['chunk_size']
+    offsets = range(0, len(entries), size)
+    chunks = [entries[i:i + size] for i in offsets]
+    results = []
+    pool = _process_pool()
+    try:
+        for chunk_results in pool.map(_harmonize_entry_chunk, chunks, [harmonize] * len(chunks), offsets):
+            results.extend(chunk_results)
+    except BrokenProcessPool:
+        # A pool process died (e.g. killed for memory); start a new pool next time
+        global _pool
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+    return results
+
+
+def _bundle_header(data):
+    """The Bundle without its entries (validated), with a placeholder entry."""
+    from fhir.resources.bundle import Bundle
+    header = {key: value for key, value in data.items() if key != 'entry'}
+    header['entry'] = [{'fullUrl': _ENTRY_PLACEHOLDER}]
+    return Bundle.model_validate(header)
+
+
+def _harmonize_bundle_parallel(data):
+    """
+    Validate mode on the process pool: same JSON as validating and harmonizing
+    the whole Bundle model, with the entries handled in chunks.
+    """
+    header_json = _bundle_header(data).model_dump_json(exclude_none=True)
+    entries_json = _map_entry_chunks(data['entry'], harmonize=True)
+    placeholder = f'[{{"fullUrl":"{_ENTRY_PLACEHOLDER}"}}]'
+    return header_json.replace(placeholder, '[' + ','.join(entries_json) + ']', 1)
+
+
+def _validate_bundle_parallel(data):
+    """Validates the Bundle with its entries checked in chunks on the process pool."""
+    _bundle_header(data)
+    _map_entry_chunks(data['entry'], harmonize=False)
+
+# The streaming path reads its input, and writes its output, in pieces of about this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_NON_WHITESPACE = re.compile(r'[^ \t\n\r]')
+# Characters that may continue a number ("1" of "1.5"), and the longest
+# incomplete token (e.g. "fals", "\u00e") that fails to decode before its end
+_NUMBER_CONTINUATION = frozenset('0123456789.eE+-')
+_MAX_PARTIAL_TOKEN = 6
+
+
+class _JSONStreamReader:
+    """
+    Reads a JSON document from a binary stream one value at a time, keeping
+    only the unread part in memory. Each value is decoded by the standard
+    library's decoder; a value cut off by the end of the buffer is retried
+    once more input has been read.
+    """
+
+    def __init__(self, stream, read_size=STREAM_CHUNK_SIZE):
+        self._stream = stream
+        self._read_size = read_size
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Appends more input (at least as much as is buffered, so retries stay linear)."""
+        if self._eof:
+            raise ValueError("Truncated Bundle JSON")
+        pending = self._buffer[self._pos:]
+        data = self._stream.read(max(self._read_size, len(pending)))
+        if not data:
+            self._eof = True
+        self._buffer = pending + self._utf8.decode(data or b'', final=self._eof)
+        self._pos = 0
+
+    def peek(self):
+        """The next non-whitespace character, not consumed."""
+        while True:
+            match = _NON_WHITESPACE.search(self._buffer, self._pos)
+            if match:
+                self._pos = match.start()
+                return self._buffer[self._pos]
+            self._pos = len(self._buffer)
+            self._fill()
+
+    def expect(self, characters):
+        """Consumes and returns the next non-whitespace character, which must be one of characters."""
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(f"Invalid JSON: expected one of {characters!r}, found {character!r}")
+        self._pos += 1
+        return character
+
+    def members(self, closing):
+        """
+        Iterates over the members of the object or array just opened, consuming
+        the separators and the closing bracket; the caller reads each member.
+        """
+        if self.peek() == closing:
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',' + closing) == closing:
+                return
+
+    def value(self):
+        """Decodes and consumes the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number that reaches the end of the buffer may continue in the next read
+                if self._eof or (end < len(self._buffer) and self._buffer[end] not in _NUMBER_CONTINUATION):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                cut_off = e.pos >= len(self._buffer) - _MAX_PARTIAL_TOKEN or e.msg.startswith('Unterminated string')
+                if self._eof or not cut_off:
+                    raise ValueError(f"Invalid JSON: {e.msg}")
+            self._fill()
+
 class HarmonizationService:
     @staticmethod
-    def harmonize_bundle(fhir_bundle_json):
+    def harmonize_bundle(fhir_bundle_json, mode=HARMONIZE_MODE_VALIDATE, validate=False, validation_sample_rate=0.0):
         """
         Harmonizes a FHIR Bundle:
         1. Normalizes names to Title Case.
         2. Ensures standard date format (basic check).
+        3. Converts Observation quantities to the canonical unit of their
+           LOINC code (see unit_normalization), if HARMONIZE_NORMALIZE_UNITS is on.
+        
+        Patients already tagged as harmonized are left untouched.
+        
+        Args:
+            fhir_bundle_json: Bundle as a JSON string or parsed dict
+            mode: "validate" builds and validates the whole Bundle model;
+                  "fast" edits the parsed dict in place, visiting only Patient entries
+            validate: In fast mode, validate the whole Bundle anyway
+            validation_sample_rate: In fast mode, fraction of bundles (0.0-1.0) validated
+        
+        Bundles with at least HARMONIZE_PARALLEL_THRESHOLD entries are validated
+        (and in validate mode harmonized) in chunks on a process pool, when
+        HARMONIZE_PARALLEL_WORKERS > 0; the output is the same.
         """
+        from fhir.resources.bundle import Bundle
+        from fhir.resources.patient import Patient
+        
         try:
             # Parse JSON to FHIR object
             if isinstance(fhir_bundle_json, str):
                 data = json.loads(fhir_bundle_json)
             else:
                 data = fhir_bundle_json
-                
-            bundle = Bundle.model_validate(data)
             
-            for entry in bundle.entry:
-                if isinstance(entry.resource, Patient):
-                    HarmonizationService._harmonize_patient(entry.resource)
+            parallel = isinstance(data, dict) and _use_parallel(data.get('entry'))
             
-            return bundle.model_dump_json()
+            # All quantities of the Bundle in one vectorized pass, before validation
+            if _stages['normalize_units'] and isinstance(data, dict):
+                with stage_timer('harmonize', 'units'):
+                    normalize_observation_units(data.get('entry'))
+            
+            if mode == HARMONIZE_MODE_FAST:
+                with stage_timer('harmonize', 'build'):
+                    if validate or (validation_sample_rate and random.random() < validation_sample_rate):
+                        if parallel:
+                            _validate_bundle_parallel(data)
+                        else:
+                            Bundle.model_validate(data)
+                    HarmonizationService._harmonize_bundle_dict(data)
+                with stage_timer('harmonize', 'serialize'):
+                    return dumps(data)
+            
+            if parallel:
+                # Entries are validated, harmonized and encoded together in the pool
+                with stage_timer('harmonize', 'build'):
+                    return _harmonize_bundle_parallel(data)
+            
+            with stage_timer('harmonize', 'build'):
+                bundle = Bundle.model_validate(data)
+                
+                for entry in bundle.entry or []:
+                    if isinstance(entry.resource, Patient):
+                        HarmonizationService._harmonize_patient(entry.resource)
+            
+            # Encoded once, compact and without null fields; routes send it as-is
+            with stage_timer('harmonize', 'serialize'):
+                return bundle.model_dump_json(exclude_none=True)
             
         except Exception as e:
             logger.error(f"Harmonization error: {e}")
             raise ValueError(f"Harmonization failed: {str(e)}")
 
     @staticmethod
-    def _harmonize_patient(patient: Patient):
+    def harmonize_bundle_stream(stream, validate=False, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Harmonizes a Bundle read incrementally from a binary stream, yielding
+        the output JSON in chunks. Bundle.entry is parsed, harmonized and
+        written one entry at a time, so memory is bounded by the largest entry
+        rather than the whole Bundle. Output is identical to the fast mode's.
+        
+        Args:
+            stream: File-like object with the Bundle JSON (e.g. request.stream)
+            validate: Validate each entry (BundleEntry) as it arrives, and the
+                      other Bundle fields once read
+            chunk_size: Approximate size of each yielded chunk
+        
+        Raises:
+            ValueError: If the input is not a JSON Bundle or fails validation.
+                        Raised by the first next() for malformed leading input;
+                        later errors end the stream early.
+        """
+        if validate:
+            from fhir.resources.bundle import Bundle, BundleEntry
+        
+        start = time.perf_counter()
+        reader = _JSONStreamReader(stream, chunk_size)
+        fields = {}
+        entries = 0
+        try:
+            reader.expect('{')
+            pieces = ['{']
+            pending = 0
+            separator = ''
+            for _ in reader.members('}'):
+                key = reader.value()
+                if not isinstance(key, str):
+                    raise ValueError("Invalid JSON: object keys must be strings")
+                reader.expect(':')
+                pieces.append(f"{separator}{dumps(key)}:")
+                separator = ','
+                
+                if key != 'entry' or reader.peek() != '[':
+                    fields[key] = reader.value()
+                    if key == 'resourceType' and fields[key] != 'Bundle':
+                        raise ValueError("Expected a FHIR Bundle")
+                    if key == 'entry' and fields[key] is not None:
+                        raise ValueError("Bundle.entry must be a list")
+                    pieces.append(dumps(fields[key]))
+                    continue
+                
+                reader.expect('[')
+                pieces.append('[')
+                entry_separator = ''
+                for _ in reader.members(']'):
+                    entry = reader.value()
+                    if _stages['normalize_units']:
+                        normalize_observation_units([entry])
+                    resource = entry.get('resource') if isinstance(entry, dict) else None
+                    if isinstance(resource, dict) and resource.get('resourceType') == 'Patient':
+                        HarmonizationService._harmonize_patient_dict(resource)
+                    if validate:
+                        BundleEntry.model_validate(entry)
+                    piece = dumps(entry)
+                    pieces.append(entry_separator + piece)
+                    entry_separator = ','
+                    entries += 1
+                    pending += len(piece)
+                    if pending >= chunk_size:
+                        yield ''.join(pieces)
+                        pieces = []
+                        pending = 0
+                pieces.append(']')
+            
+            if fields.get('resourceType') != 'Bundle':
+                raise ValueError("Expected a FHIR Bundle")
+            if validate:
+                Bundle.model_validate(fields)
+            pieces.append('}')
+            yield ''.join(pieces)
+        except ValueError as e:
+            logger.error(f"Streaming harmonization error after {entries} entries: {e}")
+            raise ValueError(f"Harmonization failed: {str(e)}")
+        finally:
+            observe_stage('harmonize_stream', 'build', time.perf_counter() - start)
+
+    @staticmethod
+    def _harmonize_bundle_dict(data):
+        """Fast path: harmonizes the Patient entries of the parsed Bundle in place."""
+        if not isinstance(data, dict) or data.get('resourceType') != 'Bundle':
+            raise ValueError("Expected a FHIR Bundle")
+        entries = data.get('entry') or []
+        if not isinstance(entries, list):
+            raise ValueError("Bundle.entry must be a list")
+        
+        for entry in entries:
+            resource = entry.get('resource') if isinstance(entry, dict) else None
+            if isinstance(resource, dict) and resource.get('resourceType') == 'Patient':
+                HarmonizationService._harmonize_patient_dict(resource)
+
+    @staticmethod
+    def _is_harmonized(tags):
+        return any(
+            (tag.get('system'), tag.get('code')) == (HARMONIZED_TAG['system'], HARMONIZED_TAG['code'])
+            if isinstance(tag, dict) else
+            (tag.system, tag.code) == (HARMONIZED_TAG['system'], HARMONIZED_TAG['code'])
+            for tag in tags or []
+        )
+
+    @staticmethod
+    def _harmonize_patient_dict(patient):
+        meta = patient.get('meta')
+        if isinstance(meta, dict) and HarmonizationService._is_harmonized(meta.get('tag')):
+            return
+        
+        # 1. Normalize Names to Title Case
+        for name in patient.get('name') or []:
+            if not isinstance(name, dict):
+                continue
+            if isinstance(name.get('family'), str):
+                name['family'] = name['family'].title()
+            if isinstance(name.get('given'), list):
+                name['given'] = [g.title() if isinstance(g, str) else g for g in name['given']]
+        
+        # 2. Add 'harmonized' tag
+        if not isinstance(meta, dict):
+            meta = {}
+            # Where validate mode serializes it: after resourceType and id
+            items = [(key, value) for key, value in patient.items() if key != 'meta']
+            position = next((i for i, (key, _) in enumerate(items) if key not in ('resourceType', 'id')), len(items))
+            patient.clear()
+            patient.update(items[:position])
+            patient['meta'] = meta
+            patient.update(items[position:])
+        if not isinstance(meta.get('tag'), list):
+            meta['tag'] = []
+        meta['tag'].append(dict(HARMONIZED_TAG))
+
+    @staticmethod
+    def _harmonize_patient(patient):
+        if patient.meta and HarmonizationService._is_harmonized(patient.meta.tag):
+            return
+        
         # 1. Normalize Names to Title Case
         if patient.name:
             for name in patient.name:
@@ -50,8 +456,4 @@ class HarmonizationService:
         if not patient.meta.tag:
             patient.meta.tag = []
             
-        patient.meta.tag.append({
-            "system": "http://example.org/tags",
-            "code": "harmonized",
-            "display": "Data has been harmonized"
-        })
+        patient.meta.tag.append(dict(HARMONIZED_TAG))
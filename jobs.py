@@ -0,0 +1,358 @@
+"""
+Asynchronous mapping and harmonization jobs.
+
+A request submitted with "Prefer: respond-async" (or ?async=true) is queued
+and answered at once with 202 and a job ID, so slow documents no longer hold
+an HTTP worker. A bounded thread pool in each worker runs the jobs; callers
+poll /api/v1/jobs/<id> for the status and /api/v1/jobs/<id>/result for the
+Bundle, or pass a callback URL that receives the finished job as a POST.
+Callbacks are disabled until JOB_CALLBACK_ALLOWED_HOSTS lists the hosts they
+may go to, and hosts resolving to loopback, link-local, private or other
+non-public addresses are refused unless JOB_CALLBACK_ALLOW_PRIVATE_NETWORKS is set.
+
+Jobs are recorded in a job store: 'memory' (per worker process) or 'sqlite'
+(a file shared by all workers on the host). With more than one gunicorn worker
+use 'sqlite', since the poll may reach a different worker than the submission.
+Jobs still queued when a worker exits are lost. Finished jobs are kept for
+JOB_RESULT_TTL seconds.
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+try:
+    from metrics import observe_job, observe_job_queue_depth
+    from serialization import dumps
+except ImportError:
+    from harmon_service.metrics import observe_job, observe_job_queue_depth
+    from harmon_service.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+DEFAULT_JOB_WORKERS = 4
+DEFAULT_JOB_QUEUE_SIZE = 100
+DEFAULT_JOB_RESULT_TTL = 3600
+DEFAULT_JOB_CALLBACK_TIMEOUT = 10
+DEFAULT_JOB_STORE_PATH = os.path.join(tempfile.gettempdir(), 'fhir_jobs.sqlite3')
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while JOB_QUEUE_SIZE jobs are already waiting or running."""
+
+
+class MemoryJobStore:
+    """Jobs of this worker process, in a dict."""
+
+    # Seconds between sweeps of expired jobs
+    PURGE_INTERVAL = 60
+
+    def __init__(self, ttl=DEFAULT_JOB_RESULT_TTL):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+
+    def save(self, job):
+        now = time.time()
+        with self._lock:
+            self._jobs[job['id']] = (dict(job), now + self.ttl)
+            if now - self._last_purge > self.PURGE_INTERVAL:
+                self._jobs = {k: v for k, v in self._jobs.items() if v[1] > now}
+                self._last_purge = now
+
+    def load(self, job_id):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return dict(entry[0])
+
+
+class SQLiteJobStore:
+    """
+    Jobs stored in a SQLite file shared by all workers on the host, with
+    per-thread, per-process connections (as for the terminology L2 cache).
+    Expired jobs are deleted every PURGE_INTERVAL seconds by whichever worker
+    saves a job next.
+    """
+
+    # Seconds between sweeps of expired jobs
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path=DEFAULT_JOB_STORE_PATH, ttl=DEFAULT_JOB_RESULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._last_purge = 0
+        self.purge()
+
+    def purge(self):
+        """Deletes the expired jobs."""
+        now = time.time()
+        self._last_purge = now
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, record TEXT NOT NULL, expires_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def save(self, job):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, record, expires_at) VALUES (?, ?, ?)",
+                (job['id'], json.dumps(job), now + self.ttl)
+            )
+        if now - self._last_purge > self.PURGE_INTERVAL:
+            self.purge()
+
+    def load(self, job_id):
+        row = self._connect().execute(
+            "SELECT record FROM jobs WHERE id = ? AND expires_at > ?", (job_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+def create_job_store(name, path=None, ttl=DEFAULT_JOB_RESULT_TTL):
+    """
+    Builds the job store selected in config.
+
+    Args:
+        name (str): "memory" or "sqlite".
+        path (str): SQLite file path, shared by all workers on the host.
+        ttl (int): Seconds a job is kept after its last update.
+
+    Raises:
+        ValueError: If the store name is unknown.
+    """
+    if not name or name == 'memory':
+        return MemoryJobStore(ttl=ttl)
+    if name == 'sqlite':
+        return SQLiteJobStore(path or DEFAULT_JOB_STORE_PATH, ttl=ttl)
+    raise ValueError(f"Unsupported job store: {name}. Supported stores: memory, sqlite")
+
+
+def job_status(job):
+    """The job as reported to pollers and callbacks, without its result."""
+    return {key: value for key, value in job.items() if key != 'result'}
+
+
+class JobQueue:
+    """
+    Bounded in-process job runner. At most `workers` jobs run at once and at
+    most `max_pending` are queued or running; further submissions raise
+    QueueFullError. The pool is created on first use, i.e. in each forked worker.
+    """
+
+    def __init__(self, store=None, workers=DEFAULT_JOB_WORKERS, max_pending=DEFAULT_JOB_QUEUE_SIZE,
+                 callback_timeout=DEFAULT_JOB_CALLBACK_TIMEOUT, callback_hosts=(), private_callbacks=False):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self.configure(store, workers, max_pending, callback_timeout, callback_hosts, private_callbacks)
+
+    def configure(self, store=None, workers=DEFAULT_JOB_WORKERS, max_pending=DEFAULT_JOB_QUEUE_SIZE,
+                  callback_timeout=DEFAULT_JOB_CALLBACK_TIMEOUT, callback_hosts=(), private_callbacks=False):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self.store = store or MemoryJobStore()
+            self.workers = workers
+            self.max_pending = max_pending
+            self.callback_timeout = callback_timeout
+            # Hosts callback URLs may point at (empty: callbacks disabled)
+            self.callback_hosts = frozenset(host.lower() for host in callback_hosts)
+            # Whether those hosts may resolve to loopback, link-local or private addresses
+            self.private_callbacks = private_callbacks
+
+    @property
+    def depth(self):
+        """Jobs queued or running in this worker."""
+        return self._pending
+
+    def check_callback_url(self, url):
+        """
+        Raises ValueError unless url is an http(s) URL on an allowed host whose
+        addresses are all public (any address with private_callbacks).
+        """
+        if not self.callback_hosts:
+            raise ValueError('Callbacks are disabled: no callback hosts are allowed')
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError('callback_url must be an http or https URL')
+        host = parts.hostname.lower()
+        if host not in self.callback_hosts:
+            raise ValueError(f"callback_url host '{parts.hostname}' is not allowed")
+        if self.private_callbacks:
+            return
+        try:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+        except (OSError, ValueError) as e:
+            raise ValueError(f"callback_url host '{parts.hostname}' cannot be resolved: {e}")
+        for address in addresses:
+            # Scope IDs ("fe80::1%eth0") are not part of the address
+            if not ipaddress.ip_address(address.split('%', 1)[0]).is_global:
+                raise ValueError(f"callback_url host '{parts.hostname}' resolves to a non-public address")
+
+    def submit(self, kind, func, callback_url=None):
+        """
+        Queues func (returning the result JSON string) as a job.
+
+        Args:
+            kind (str): Job type, e.g. "map_document" or "harmonize".
+            func: Zero-argument callable run on the pool. ValueError messages
+                  are reported to the caller; other exceptions as internal errors.
+            callback_url (str): Optional URL that receives the finished job.
+
+        Returns:
+            dict: The queued job's status.
+
+        Raises:
+            QueueFullError: If max_pending jobs are already queued or running.
+            ValueError: If callback_url is not allowed.
+        """
+        if callback_url:
+            self.check_callback_url(callback_url)
+        job = {
+            'id': str(uuid.uuid4()),
+            'kind': kind,
+            'status': JOB_QUEUED,
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'callback_url': callback_url,
+            'error': None,
+            'http_status': None,
+        }
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({self.max_pending} jobs pending)")
+            self._pending += 1
+            depth = self._pending
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+            executor = self._executor
+        observe_job_queue_depth(depth)
+        # Taken before the pool thread starts updating the job
+        status = job_status(job)
+        try:
+            self.store.save(job)
+            executor.submit(self._run, job, func)
+        except BaseException:
+            # The job never reached the pool: give its slot back
+            self._release()
+            raise
+        return status
+
+    def get(self, job_id):
+        """The stored job (with its result once succeeded), or None if unknown or expired."""
+        return self.store.load(job_id)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+            depth = self._pending
+        observe_job_queue_depth(depth)
+
+    def _run(self, job, func):
+        job['status'] = JOB_RUNNING
+        job['started_at'] = time.time()
+        try:
+            self.store.save(job)
+            job['result'] = func()
+            job['status'] = JOB_SUCCEEDED
+            job['http_status'] = 200
+        except ValueError as e:
+            job['status'] = JOB_FAILED
+            job['error'] = str(e)
+            job['http_status'] = 400
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            job['status'] = JOB_FAILED
+            job['error'] = 'Internal server error'
+            job['http_status'] = 500
+        finally:
+            job['finished_at'] = time.time()
+            self._release()
+            observe_job(
+                job['kind'], job['status'],
+                job['started_at'] - job['submitted_at'], job['finished_at'] - job['started_at']
+            )
+        try:
+            self.store.save(job)
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) finished but could not be saved: {e}")
+        if job['callback_url']:
+            self._notify(job)
+
+    def _notify(self, job):
+        """POSTs the finished job, with the result JSON embedded, to its callback URL."""
+        try:
+            # Again: the name may resolve differently than at submission
+            self.check_callback_url(job['callback_url'])
+        except ValueError as e:
+            logger.warning(f"Callback for job {job['id']} not sent: {e}")
+            return
+        body = dumps(job_status(job))
+        if job.get('result') is not None:
+            # The result is already JSON: splice it in rather than decode and re-encode it
+            body = f'{body[:-1]},"result":{job["result"]}}}'
+        try:
+            response = requests.post(
+                job['callback_url'], data=body.encode('utf-8'),
+                headers={'Content-Type': 'application/json'}, timeout=self.callback_timeout,
+                allow_redirects=False
+            )
+            if response.status_code >= 400:
+                logger.warning(f"Callback for job {job['id']} returned HTTP {response.status_code}")
+        except requests.RequestException as e:
+            logger.warning(f"Callback for job {job['id']} to {job['callback_url']} failed: {e}")
+
+
+job_queue = JobQueue()
+
+
+def configure_jobs(config):
+    """Applies the JOB_* settings to the job queue."""
+    job_queue.configure(
+        store=create_job_store(
+            config.get('JOB_STORE', 'memory'),
+            config.get('JOB_STORE_PATH'),
+            config.get('JOB_RESULT_TTL', DEFAULT_JOB_RESULT_TTL)
+        ),
+        workers=config.get('JOB_WORKERS', DEFAULT_JOB_WORKERS),
+        max_pending=config.get('JOB_QUEUE_SIZE', DEFAULT_JOB_QUEUE_SIZE),
+        callback_timeout=config.get('JOB_CALLBACK_TIMEOUT', DEFAULT_JOB_CALLBACK_TIMEOUT),
+        callback_hosts=config.get('JOB_CALLBACK_ALLOWED_HOSTS', ()),
+        private_callbacks=config.get('JOB_CALLBACK_ALLOW_PRIVATE_NETWORKS', False)
+    )
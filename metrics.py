@@ -0,0 +1,229 @@
+"""
+Prometheus metrics for the mapping and harmonization endpoints.
+
+Exposes per-stage latency histograms (request parse, terminology, resource
+construction, serialization), per-lookup terminology latency by code system
+and outcome, per-mapper document/resource counters, mapping result cache
+lookups, async job queue depth and latency, admission control and outbound
+terminology call limits, and terminology cache gauges, served at /api/v1/metrics.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory writable by
+every worker before the service starts (gunicorn.conf.py clears it and marks
+exited workers dead); each scrape then aggregates all workers. Without it the
+metrics of the answering process are served. If prometheus_client is not
+installed, recording is a no-op and the endpoint reports it as unavailable.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+    )
+except ImportError:
+    prometheus_client_available = False
+else:
+    prometheus_client_available = True
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+if prometheus_client_available:
+    STAGE_SECONDS = Histogram(
+        'fhir_stage_duration_seconds', 'Time spent in each request processing stage',
+        ['endpoint', 'stage'], buckets=STAGE_BUCKETS
+    )
+    TERMINOLOGY_LOOKUP_SECONDS = Histogram(
+        'fhir_terminology_lookup_duration_seconds', 'Terminology lookup latency by outcome (hit, miss, error)',
+        ['code_system', 'outcome'], buckets=STAGE_BUCKETS
+    )
+    DOCUMENTS_TOTAL = Counter(
+        'fhir_documents_mapped_total', 'Documents mapped to FHIR Bundles', ['mapper']
+    )
+    RESOURCES_TOTAL = Counter(
+        'fhir_resources_built_total', 'FHIR resources built by the mappers', ['mapper', 'resource_type']
+    )
+    RESULT_CACHE_TOTAL = Counter(
+        'fhir_mapping_result_cache_total', 'Mapping result cache lookups by outcome (hit, miss)',
+        ['endpoint', 'outcome']
+    )
+    JOB_QUEUE_DEPTH = Gauge(
+        'fhir_job_queue_depth', 'Async jobs queued or running (summed over live workers)',
+        multiprocess_mode='livesum'
+    )
+    JOB_SECONDS = Histogram(
+        'fhir_job_duration_seconds', 'Async job time waiting in the queue and running',
+        ['kind', 'stage'], buckets=JOB_BUCKETS
+    )
+    JOBS_TOTAL = Counter(
+        'fhir_jobs_total', 'Async jobs finished by outcome (succeeded, failed)', ['kind', 'status']
+    )
+    ADMISSION_IN_FLIGHT = Gauge(
+        'fhir_admission_in_flight', 'Mapping requests admitted and running (summed over live workers)',
+        multiprocess_mode='livesum'
+    )
+    ADMISSION_WAITING = Gauge(
+        'fhir_admission_waiting', 'Mapping requests waiting for admission (summed over live workers)',
+        multiprocess_mode='livesum'
+    )
+    ADMISSION_REJECTED_TOTAL = Counter(
+        'fhir_admission_rejected_total', 'Mapping requests answered 429 by the admission limiter', ['endpoint']
+    )
+    ADMISSION_WAIT_SECONDS = Histogram(
+        'fhir_admission_wait_seconds', 'Time mapping requests waited for admission', ['endpoint'],
+        buckets=STAGE_BUCKETS
+    )
+    OUTBOUND_IN_FLIGHT = Gauge(
+        'fhir_terminology_outbound_in_flight', 'Upstream terminology calls in flight (summed over live workers)',
+        multiprocess_mode='livesum'
+    )
+    OUTBOUND_REJECTED_TOTAL = Counter(
+        'fhir_terminology_outbound_rejected_total', 'Upstream terminology calls refused for lack of an outbound slot',
+        ['endpoint']
+    )
+    CACHE_SIZE = Gauge(
+        'fhir_terminology_cache_entries', 'Entries in the terminology L1 cache (summed over live workers)',
+        ['code_system'], multiprocess_mode='livesum'
+    )
+    CACHE_HIT_RATIO = Gauge(
+        'fhir_terminology_cache_hit_ratio', 'Terminology cache hit ratio of each live worker',
+        ['code_system'], multiprocess_mode='liveall'
+    )
+
+
+def _multiprocess_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def observe_stage(endpoint, stage, seconds):
+    if prometheus_client_available:
+        STAGE_SECONDS.labels(endpoint, stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(endpoint, stage):
+    """Times the enclosed block as one stage of an endpoint."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(endpoint, stage, time.perf_counter() - start)
+
+
+def observe_terminology_lookup(cache, outcome, seconds):
+    """
+    Records one cached terminology lookup.
+
+    Args:
+        cache: The code system's TieredCache.
+        outcome (str): "hit", "miss" or "error".
+        seconds (float): Lookup latency.
+    """
+    if prometheus_client_available:
+        TERMINOLOGY_LOOKUP_SECONDS.labels(cache.namespace, outcome).observe(seconds)
+
+
+def observe_terminology_caches(stats):
+    """
+    Sets the terminology cache gauges from the caches' counters, when the
+    metrics are scraped rather than on every lookup. In multiprocess mode a
+    worker's gauges are as of the last scrape it answered.
+
+    Args:
+        stats (dict): {code_system: TieredCache.stats()} of this worker.
+    """
+    if not prometheus_client_available:
+        return
+    for code_system, cache_stats in stats.items():
+        CACHE_SIZE.labels(code_system).set(cache_stats['size'])
+        if cache_stats['hit_ratio'] is not None:
+            CACHE_HIT_RATIO.labels(code_system).set(cache_stats['hit_ratio'])
+
+
+def observe_mapping(endpoint, document_type, context, total_seconds):
+    """
+    Records a completed map_to_fhir call from its MappingContext: the
+    terminology and serialization stages, resource construction (the
+    remainder), and the document and resource counters.
+    """
+    if not prometheus_client_available:
+        return
+    terminology = context.timings.get('terminology', 0.0)
+    serialize = context.timings.get('serialize', 0.0)
+    observe_stage(endpoint, 'terminology', terminology)
+    observe_stage(endpoint, 'serialize', serialize)
+    observe_stage(endpoint, 'build', max(total_seconds - terminology - serialize, 0.0))
+    DOCUMENTS_TOTAL.labels(document_type).inc()
+    for resource_type, count in context.resource_counts.items():
+        RESOURCES_TOTAL.labels(document_type, resource_type).inc(count)
+
+
+def observe_result_cache(endpoint, outcome):
+    if prometheus_client_available:
+        RESULT_CACHE_TOTAL.labels(endpoint, outcome).inc()
+
+
+def observe_job_queue_depth(depth):
+    if prometheus_client_available:
+        JOB_QUEUE_DEPTH.set(depth)
+
+
+def observe_job(kind, status, wait_seconds, run_seconds):
+    """Records a finished async job: time queued, time running and its outcome."""
+    if not prometheus_client_available:
+        return
+    JOB_SECONDS.labels(kind, 'queued').observe(wait_seconds)
+    JOB_SECONDS.labels(kind, 'running').observe(run_seconds)
+    JOBS_TOTAL.labels(kind, status).inc()
+
+
+def observe_admission(in_flight, waiting):
+    if prometheus_client_available:
+        ADMISSION_IN_FLIGHT.set(in_flight)
+        ADMISSION_WAITING.set(waiting)
+
+
+def observe_admission_wait(endpoint, seconds):
+    if prometheus_client_available:
+        ADMISSION_WAIT_SECONDS.labels(endpoint).observe(seconds)
+
+
+def observe_admission_rejected(endpoint):
+    if prometheus_client_available:
+        ADMISSION_REJECTED_TOTAL.labels(endpoint).inc()
+
+
+def observe_outbound_in_flight(in_flight):
+    if prometheus_client_available:
+        OUTBOUND_IN_FLIGHT.set(in_flight)
+
+
+def observe_outbound_rejected(endpoint):
+    if prometheus_client_available:
+        OUTBOUND_REJECTED_TOTAL.labels(endpoint).inc()
+
+
+def render_metrics():
+    """
+    Returns (body, content_type) for a scrape, or None if prometheus_client is
+    not installed. Aggregates every worker in multiprocess mode.
+    """
+    if not prometheus_client_available:
+        return None
+    if _multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    from prometheus_client import REGISTRY
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """gunicorn child_exit hook: drops an exited worker's live gauges."""
+    if prometheus_client_available and _multiprocess_dir():
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,263 @@
+"""
+Per-request profiling of /map/document and /harmonize.
+
+With PROFILING_ENABLED, a request sent with the header "X-Profile: 1" is run
+under cProfile and tracemalloc. The report splits the request's time between
+fhir.resources model construction, date normalization, terminology lookups,
+serialization, module imports (models are imported lazily on first use) and
+everything else, and lists the top functions and allocation
+sites. It is written to PROFILE_DIR as <id>.json next to the raw <id>.prof
+(for pstats or snakeviz), and the response carries X-Profile-Id; with
+"X-Profile: inline" the response body is {"profile": <report>, "result": <Bundle>}.
+
+Profiled requests run one at a time per worker (tracemalloc traces the whole
+process) and are noticeably slower. Only the request's own thread is profiled:
+terminology lookups prefetched on the pool show up as the time spent waiting
+for them.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_INLINE = 'inline'
+PROFILE_FILE = 'file'
+
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'fhir_profiles')
+DEFAULT_PROFILE_TOP = 25
+
+# Stack frames kept per allocation site
+_TRACE_FRAMES = 1
+
+_TERMINOLOGY_MODULES = ('terminology.py', 'terminology_cache.py', 'terminology_http.py', 'terminology_index.py')
+_SERIALIZATION_FUNCTIONS = ('model_dump', 'to_json', 'dumps')
+
+
+def _category(function):
+    """
+    Category of a profiled function (filename, line, name), or None. Checked
+    in order, so e.g. pydantic's model_dump_json counts as serialization.
+    """
+    filename, _, name = function
+    if filename.startswith('<frozen importlib'):
+        return 'import'
+    basename = os.path.basename(filename)
+    if basename in _TERMINOLOGY_MODULES or name in ('_prefetch_terminology', '_lookup_code'):
+        return 'terminology'
+    if basename == 'date_normalizer.py' or name == '_normalize_date':
+        return 'normalize_date'
+    if basename == 'serialization.py' or any(part in name for part in _SERIALIZATION_FUNCTIONS):
+        return 'serialization'
+    path = filename.replace(os.sep, '/')
+    if 'fhir/resources' in path or 'fhir_core' in path or 'pydantic' in path or 'pydantic_core' in name:
+        return 'fhir_resources'
+    return None
+
+
+# Passes over the call graph when propagating categories from callers to callees
+_CONTEXT_PASSES = 10
+CATEGORIES = ('fhir_resources', 'normalize_date', 'terminology', 'serialization', 'import')
+
+
+def _within(context, category):
+    """A caller's category weights as seen from a callee of the given category: the outer category wins."""
+    if category is None or context.get(None, 0.0) == 0.0:
+        return context
+    lifted = {key: weight for key, weight in context.items() if key is not None}
+    lifted[category] = lifted.get(category, 0.0) + context[None]
+    return lifted
+
+
+def _breakdown(stats, total):
+    """
+    Seconds per category. Each function's own time is split between its
+    callers and charged to the outermost category on the call path (e.g. model
+    serializers called while serializing count as serialization, helpers called
+    by pydantic as fhir_resources); the remainder is "other". cProfile keeps
+    caller edges, not stacks, so a helper shared by several categories is split
+    in proportion to the time spent calling it from each.
+    """
+    functions = stats.stats
+    contexts = {function: {_category(function): 1.0} for function in functions}
+    order = sorted(functions, key=lambda function: functions[function][3], reverse=True)
+    for _ in range(_CONTEXT_PASSES):
+        changed = False
+        for function in order:
+            callers = functions[function][4]
+            weights = sum(edge[3] for edge in callers.values())
+            if not weights:
+                continue
+            context = {}
+            for caller, edge in callers.items():
+                for key, weight in _within(contexts.get(caller, {None: 1.0}), _category(function)).items():
+                    context[key] = context.get(key, 0.0) + weight * edge[3] / weights
+            if any(abs(context.get(key, 0.0) - weight) > 1e-6 for key, weight in contexts[function].items()):
+                changed = True
+            contexts[function] = context
+        if not changed:
+            break
+
+    breakdown = dict.fromkeys(CATEGORIES, 0.0)
+    for function, (_, _, own, _, callers) in functions.items():
+        shares = [(contexts[function], own)] if not callers else [
+            (_within(contexts.get(caller, {None: 1.0}), _category(function)), edge[2])
+            for caller, edge in callers.items()
+        ]
+        for context, seconds in shares:
+            for key, weight in context.items():
+                if key is not None:
+                    breakdown[key] += weight * seconds
+    breakdown['other'] = max(total - sum(breakdown.values()), 0.0)
+    return breakdown
+
+
+def _location(filename, lineno):
+    """Path shortened to the package (site-packages) or module name."""
+    if 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    elif os.path.isabs(filename):
+        filename = os.path.basename(filename)
+    return f"{filename}:{lineno}"
+
+
+def _top_functions(stats, top):
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [
+        {
+            'function': f"{_location(filename, lineno)}({name})",
+            'calls': calls,
+            'self_ms': round(own * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+        }
+        for (filename, lineno, name), (_, calls, own, cumulative, _) in rows
+    ]
+
+
+def _top_allocations(snapshot, top):
+    return [
+        {
+            'location': _location(stat.traceback[0].filename, stat.traceback[0].lineno),
+            'size_kib': round(stat.size / 1024, 1),
+            'count': stat.count,
+        }
+        for stat in snapshot.statistics('lineno')[:top]
+    ]
+
+
+class RequestProfiler:
+    """Runs a request's work under cProfile and tracemalloc and reports where its time and memory went."""
+
+    def __init__(self, enabled=False, directory=None, top=DEFAULT_PROFILE_TOP):
+        self._lock = threading.Lock()
+        self.configure(enabled, directory, top)
+
+    def configure(self, enabled=False, directory=None, top=DEFAULT_PROFILE_TOP):
+        self.enabled = enabled
+        self.directory = directory or DEFAULT_PROFILE_DIR
+        self.top = top
+
+    def requested(self, header_value):
+        """PROFILE_INLINE or PROFILE_FILE for an X-Profile header value, None if not profiling."""
+        if not self.enabled or not header_value:
+            return None
+        value = header_value.strip().lower()
+        if value == PROFILE_INLINE:
+            return PROFILE_INLINE
+        if value in ('1', 'true', 'yes', PROFILE_FILE):
+            return PROFILE_FILE
+        return None
+
+    def run(self, func, endpoint, label=None, output=PROFILE_FILE):
+        """
+        Calls func under the profiler.
+
+        Args:
+            func: Zero-argument callable doing the request's work
+            endpoint (str): e.g. "map_document"
+            label (str): What was profiled, e.g. the document type or harmonization mode
+            output: PROFILE_FILE also writes the report and raw profile to the
+                    profile directory (even if func raises)
+
+        Returns:
+            tuple: (func's result, the report dict)
+        """
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}"
+        profiler = cProfile.Profile()
+        with self._lock:
+            tracing = tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start(_TRACE_FRAMES)
+            start = time.perf_counter()
+            error = None
+            try:
+                profiler.enable()
+                try:
+                    result = func()
+                finally:
+                    profiler.disable()
+            except Exception as e:
+                error, result = e, None
+            wall = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+
+        stats = pstats.Stats(profiler)
+        report = {
+            'id': profile_id,
+            'endpoint': endpoint,
+            'label': label,
+            'wall_ms': round(wall * 1000, 3),
+            'error': str(error) if error is not None else None,
+            'breakdown_ms': {
+                category: round(seconds * 1000, 3) for category, seconds in _breakdown(stats, wall).items()
+            },
+            'top_functions': _top_functions(stats, self.top),
+            'allocations': {
+                'peak_kib': round(peak / 1024, 1),
+                'top': _top_allocations(snapshot, self.top),
+            },
+        }
+        if output == PROFILE_FILE:
+            self._write(profiler, report)
+        if error is not None:
+            raise error
+        return result, report
+
+    def _write(self, profiler, report):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, report['id'])
+            profiler.dump_stats(f"{path}.prof")
+            with open(f"{path}.json", 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            logger.info(f"Profile {report['id']} written to {path}.json ({report['wall_ms']} ms)")
+        except OSError as e:
+            logger.error(f"Could not write profile {report['id']} to {self.directory}: {e}")
+
+
+request_profiler = RequestProfiler()
+
+
+def configure_profiling(config):
+    """Applies the PROFILING_ENABLED / PROFILE_DIR / PROFILE_TOP settings."""
+    request_profiler.configure(
+        config.get('PROFILING_ENABLED', False),
+        config.get('PROFILE_DIR'),
+        config.get('PROFILE_TOP', DEFAULT_PROFILE_TOP),
+    )
+    if request_profiler.enabled:
+        logger.warning(f"Per-request profiling is enabled ({PROFILE_HEADER} header); profiles go to {request_profiler.directory}")
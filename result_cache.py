@@ -0,0 +1,110 @@
+"""
+Result cache for whole document mappings.
+
+Upstream retries and re-extraction resubmit byte-identical documents. The
+mapping routes key each document on a canonical digest of its type and data
+(plus the mapper options that change the output) and, while the entry lives,
+answer a resubmission with the Bundle JSON mapped the first time, skipping
+every terminology lookup and resource build.
+
+The cache is per worker, bounded (LRU) with a TTL, and disabled unless
+MAPPING_RESULT_CACHE_SIZE > 0. Bundles in which a terminology lookup fell back
+to text because the upstream failed are not cached. Combine it with
+MAPPER_DETERMINISTIC_IDS so that a resubmission mapped again after eviction,
+or by another worker, still carries the same resource IDs.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULT_CACHE_SIZE = 0
+DEFAULT_RESULT_CACHE_TTL = 3600
+
+
+def document_digest(*parts):
+    """
+    SHA-256 hex digest of the canonical JSON of parts (keys sorted, compact),
+    so documents differing only in key order or whitespace share a digest.
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class MappingResultCache:
+    """Thread-safe bounded cache of Bundle JSON by document digest."""
+
+    def __init__(self, maxsize=DEFAULT_RESULT_CACHE_SIZE, ttl=DEFAULT_RESULT_CACHE_TTL):
+        self._lock = threading.Lock()
+        self.configure(maxsize, ttl)
+
+    def configure(self, maxsize=DEFAULT_RESULT_CACHE_SIZE, ttl=DEFAULT_RESULT_CACHE_TTL):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries = TTLCache(maxsize=maxsize, ttl=ttl) if maxsize > 0 else None
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def enabled(self):
+        return self._entries is not None
+
+    def key(self, document_type, data, *options):
+        """Cache key of a document, or None when the cache is disabled."""
+        if self._entries is None:
+            return None
+        return document_digest(document_type, data, *options)
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            bundle_json = self._entries.get(key)
+            if bundle_json is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return bundle_json
+
+    def set(self, key, bundle_json):
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = bundle_json
+
+    def clear(self):
+        with self._lock:
+            if self._entries is not None:
+                self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self._entries is not None,
+                'size': len(self._entries) if self._entries is not None else 0,
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+result_cache = MappingResultCache()
+
+
+def configure_result_cache(config):
+    """Sizes the result cache from MAPPING_RESULT_CACHE_SIZE / MAPPING_RESULT_CACHE_TTL."""
+    result_cache.configure(
+        config.get('MAPPING_RESULT_CACHE_SIZE', DEFAULT_RESULT_CACHE_SIZE),
+        config.get('MAPPING_RESULT_CACHE_TTL', DEFAULT_RESULT_CACHE_TTL),
+    )
+    if result_cache.enabled:
+        logger.info(f"Mapping result cache: {result_cache.maxsize} entries, {result_cache.ttl}s TTL")
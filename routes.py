@@ -1,28 +1,295 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, g, request, jsonify, stream_with_context, url_for
 from harmonization_service import HarmonizationService
-from document_mapper import get_document_mapper
+from document_mapper import MappingContext, get_document_mapper
+from terminology import (
+    cache_stats, export_snapshot, http_client, import_snapshot, warmup_state
+)
+from serialization import dumps, loads
+from result_cache import result_cache
+from jobs import FINISHED_STATUSES, JOB_SUCCEEDED, QueueFullError, job_queue, job_status
+from profiling import PROFILE_HEADER, PROFILE_INLINE, request_profiler
+from tracing import current_span, tracer
+from admission import ADMISSION_ENDPOINTS, OverloadedError, admission_limiter
+import metrics
+import hmac
 import logging
-import json
+import time
 
 main_bp = Blueprint('main', __name__, url_prefix='/api/v1')
 logger = logging.getLogger(__name__)
 
+SUPPORTED_DOCUMENT_TYPES = [
+    'Medical Report',
+    'Lab Report',
+    'Discharge Summary',
+    'Admission Slip'
+]
+
+def _mapper_for(document_type):
+    """Document mapper configured from the app config (build mode, the source's date format hint, ID mode)."""
+    return get_document_mapper(
+        document_type,
+        current_app.config.get('MAPPER_BUILD_MODE', 'model'),
+        current_app.config.get('DATE_FORMAT_HINTS', {}).get(document_type),
+        current_app.config.get('MAPPER_DETERMINISTIC_IDS', False)
+    )
+
+def _result_cache_key(document_type, document_data):
+    """Result cache key of a document under the options that change its Bundle (None if disabled)."""
+    return result_cache.key(
+        document_type,
+        document_data,
+        current_app.config.get('DATE_FORMAT_HINTS', {}).get(document_type),
+        current_app.config.get('MAPPER_DETERMINISTIC_IDS', False)
+    )
+
+def _cached_result(endpoint, cache_key):
+    fhir_bundle_json = result_cache.get(cache_key)
+    if cache_key is not None:
+        metrics.observe_result_cache(endpoint, 'miss' if fhir_bundle_json is None else 'hit')
+    return fhir_bundle_json
+
+def _store_result(cache_key, fhir_bundle_json, context):
+    # Text fallbacks for failed lookups are not pinned for the cache TTL
+    if not context.degraded:
+        result_cache.set(cache_key, fhir_bundle_json)
+
+def _map_with_cache(endpoint, mapper, document_type, document_data, cache_key):
+    """Returns the cached Bundle of an identical earlier document, or maps and caches it."""
+    fhir_bundle_json = _cached_result(endpoint, cache_key)
+    if fhir_bundle_json is None:
+        context = MappingContext()
+        start = time.perf_counter()
+        fhir_bundle_json = mapper.map_to_fhir(document_data, context)
+        metrics.observe_mapping(endpoint, document_type, context, time.perf_counter() - start)
+        _store_result(cache_key, fhir_bundle_json, context)
+    return fhir_bundle_json
+
+def _json_body_response(body, status=200):
+    """Sends an already-encoded JSON body without parsing and re-encoding it."""
+    return Response(body, status=status, mimetype='application/json')
+
+def _profile_mode():
+    """How this request asked to be profiled (X-Profile header), or None."""
+    return request_profiler.requested(request.headers.get(PROFILE_HEADER))
+
+def _profiled_response(endpoint, label, func, output):
+    """Runs func under the profiler and sends its JSON with the profile ID, or inline with the profile."""
+    body, report = request_profiler.run(func, endpoint, label, output)
+    if output == PROFILE_INLINE:
+        return _json_body_response(f'{{"profile":{dumps(report)},"result":{body}}}')
+    response = _json_body_response(body)
+    response.headers['X-Profile-Id'] = report['id']
+    return response
+
+def _wants_async():
+    """True if the client asked for an async job ("Prefer: respond-async" or ?async=true)."""
+    return ('respond-async' in request.headers.get('Prefer', '').lower()
+            or request.args.get('async', '').lower() in ('1', 'true', 'yes'))
+
+def _job_response(job, status=200):
+    body = dict(job)
+    body['status_url'] = url_for('main.get_job', job_id=job['id'])
+    body['result_url'] = url_for('main.get_job_result', job_id=job['id'])
+    return jsonify(body), status
+
+def _submit_job(kind, func, callback_url=None):
+    """Queues func as a job and returns 202 with its status URL, or 503 if the queue is full."""
+    try:
+        job = job_queue.submit(kind, func, callback_url)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    response, status = _job_response(job, 202)
+    response.headers['Location'] = url_for('main.get_job', job_id=job['id'])
+    return response, status
+
+@main_bp.before_request
+def _start_request_span():
+    # Root span of the request's trace, continuing the caller's traceparent if sent
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g.request_span = tracer.start_request_span(
+        f"{request.method} {rule}", request.headers.get('traceparent'),
+        **{'http.method': request.method, 'http.route': rule}
+    )
+
+@main_bp.before_request
+def _admit_request():
+    # Mapping requests past the worker's admission limit are shed with 429
+    if request.endpoint not in ADMISSION_ENDPOINTS:
+        return None
+    try:
+        g.admitted = admission_limiter.acquire(request.endpoint)
+    except OverloadedError as e:
+        current_span().set_attribute('admission', 'rejected')
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(admission_limiter.retry_after)}
+    return None
+
+@main_bp.after_request
+def _tag_request_span(response):
+    span = g.get('request_span')
+    if span is not None and span.trace_id:
+        span.set_attribute('http.status_code', response.status_code)
+        response.headers['X-Trace-Id'] = span.trace_id
+    return response
+
+@main_bp.teardown_request
+def _end_request_span(error):
+    # After a streamed response has been sent in full
+    if g.pop('admitted', False):
+        admission_limiter.release()
+    span = g.pop('request_span', None)
+    if span is not None:
+        if error is not None:
+            span.record_error(error)
+        span.end()
+
 @main_bp.route('/health', methods=['GET'])
 def health_check():
+    if warmup_state['status'] == 'warming':
+        return jsonify({
+            'status': 'warming',
+            'service': 'fhir-harmonization-service',
+            'warmup': dict(warmup_state)
+        }), 503
     return jsonify({'status': 'healthy', 'service': 'fhir-harmonization-service'}), 200
 
+def _admin_error():
+    """Returns an error response unless the request carries the configured admin token."""
+    token = current_app.config.get('ADMIN_TOKEN')
+    if not token:
+        return jsonify({'error': 'Admin endpoints are disabled (ADMIN_TOKEN not set)'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return None
+
+def _snapshot_path():
+    path = current_app.config.get('TERMINOLOGY_SNAPSHOT_PATH')
+    if not path:
+        raise ValueError('TERMINOLOGY_SNAPSHOT_PATH is not configured')
+    return path
+
+@main_bp.route('/admin/terminology/snapshot', methods=['POST'])
+def export_terminology_snapshot():
+    """Writes this worker's resolved terminology concepts to TERMINOLOGY_SNAPSHOT_PATH."""
+    error = _admin_error()
+    if error:
+        return error
+    try:
+        counts = export_snapshot(_snapshot_path())
+        return jsonify({'status': 'exported', 'entries': counts}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Terminology snapshot export failed: {e}")
+        return jsonify({'error': 'Snapshot export failed'}), 500
+
+@main_bp.route('/admin/terminology/snapshot/reload', methods=['POST'])
+def reload_terminology_snapshot():
+    """Loads TERMINOLOGY_SNAPSHOT_PATH into this worker's terminology caches."""
+    error = _admin_error()
+    if error:
+        return error
+    try:
+        counts = import_snapshot(_snapshot_path())
+        return jsonify({'status': 'reloaded', 'entries': counts}), 200
+    except FileNotFoundError:
+        return jsonify({'error': 'Snapshot file not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Terminology snapshot reload failed: {e}")
+        return jsonify({'error': 'Snapshot reload failed'}), 500
+
+@main_bp.route('/terminology/status', methods=['GET'])
+def terminology_status():
+    """
+    Reports the circuit breaker state of each NLM endpoint ("closed", "open"
+    or "half_open"), for alerting, and this worker's per-code-system cache,
+    mapping result cache, outbound call limit and admission counters.
+    """
+    breakers = http_client.breaker_states()
+    degraded = any(b['state'] != 'closed' for b in breakers.values())
+    return jsonify({
+        'status': 'degraded' if degraded else 'ok',
+        'breakers': breakers,
+        'caches': cache_stats(),
+        'result_cache': result_cache.stats(),
+        'outbound': http_client.limiter.snapshot(),
+        'admission': admission_limiter.snapshot()
+    }), 200
+
+@main_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of an async job: queued, running, succeeded or failed (with its error)."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return _job_response(job_status(job))
+
+@main_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    Result of an async job: the Bundle once succeeded, the error (with the
+    status code the synchronous request would have had) once failed, and 202
+    with the job status while it is still queued or running.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job['status'] not in FINISHED_STATUSES:
+        response, status = _job_response(job_status(job), 202)
+        response.headers['Retry-After'] = '1'
+        return response, status
+    if job['status'] == JOB_SUCCEEDED:
+        return _json_body_response(job['result'])
+    return jsonify({'error': job['error'], 'job_id': job_id}), job['http_status']
+
+@main_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (aggregated over all workers in multiprocess mode)."""
+    metrics.observe_terminology_caches(cache_stats())
+    rendered = metrics.render_metrics()
+    if rendered is None:
+        return jsonify({'error': 'Metrics unavailable: prometheus_client is not installed'}), 503
+    body, content_type = rendered
+    return Response(body, content_type=content_type)
+
 @main_bp.route('/harmonize', methods=['POST'])
 def harmonize_data():
     """
     Accepts FHIR Bundle, returns Harmonized FHIR Bundle.
+    
+    With HARMONIZE_MODE = 'fast', ?validate=true still validates the whole Bundle.
+    With "Prefer: respond-async" (or ?async=true) returns 202 and a job instead
+    (see /jobs); ?callback_url= receives the finished job. With PROFILING_ENABLED,
+    "X-Profile: 1" (or "inline") profiles the request (see profiling.py).
     """
     try:
-        data = request.get_json()
+        with metrics.stage_timer('harmonize', 'parse'):
+            data = request.get_json()
         if not data:
             return jsonify({'error': 'No data provided'}), 400
             
-        harmonized_bundle = HarmonizationService.harmonize_bundle(data)
-        return jsonify(json.loads(harmonized_bundle)), 200
+        options = {
+            'mode': current_app.config.get('HARMONIZE_MODE', 'validate'),
+            'validate': request.args.get('validate', '').lower() in ('1', 'true', 'yes'),
+            'validation_sample_rate': current_app.config.get('HARMONIZE_VALIDATION_SAMPLE_RATE', 0.0)
+        }
+        current_span().set_attribute('mode', options['mode'])
+        if _wants_async():
+            return _submit_job(
+                'harmonize',
+                lambda: HarmonizationService.harmonize_bundle(data, **options),
+                request.args.get('callback_url')
+            )
+        profile_mode = _profile_mode()
+        if profile_mode:
+            return _profiled_response(
+                'harmonize', options['mode'],
+                lambda: HarmonizationService.harmonize_bundle(data, **options), profile_mode
+            )
+        harmonized_bundle = HarmonizationService.harmonize_bundle(data, **options)
+        return _json_body_response(harmonized_bundle)
         
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
@@ -30,6 +297,43 @@ def harmonize_data():
         logger.error(f"Unexpected error in /harmonize: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@main_bp.route('/harmonize/stream', methods=['POST'])
+def harmonize_stream():
+    """
+    Harmonizes a Bundle of any size: the request body is parsed one entry at
+    a time and the harmonized Bundle is streamed back as it is produced, so
+    memory does not grow with the Bundle. ?validate=true validates each entry.
+    
+    Errors in the leading part of the body return 400. Later ones are logged
+    and abort the connection before the response's final chunk, since its 200
+    has already been sent: clients must treat a truncated response as a failure.
+    """
+    try:
+        chunks = HarmonizationService.harmonize_bundle_stream(
+            request.stream,
+            validate=request.args.get('validate', '').lower() in ('1', 'true', 'yes')
+        )
+        first_chunk = next(chunks)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        logger.error(f"Unexpected error in /harmonize/stream: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+    def generate():
+        yield first_chunk
+        try:
+            yield from chunks
+        except Exception as e:
+            # Re-raised so the server drops the connection without the
+            # terminating chunk, rather than ending a truncated Bundle cleanly
+            logger.error(f"/harmonize/stream failed after the response started, aborting it: {e}")
+            raise
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 @main_bp.route('/map/document', methods=['POST'])
 def map_document():
     """
@@ -38,13 +342,19 @@ def map_document():
     Request body:
     {
         "document_type": "Medical Report" | "Lab Report" | "Discharge Summary" | "Admission Slip",
-        "data": { ... document-specific JSON ... }
+        "data": { ... document-specific JSON ... },
+        "callback_url": "https://..."   (optional, async only)
     }
     
-    Returns: FHIR R4 transaction Bundle
+    Returns: FHIR R4 transaction Bundle, or with "Prefer: respond-async" (or
+    ?async=true) 202 and a job to poll at /jobs/<job_id>
+    
+    With PROFILING_ENABLED, "X-Profile: 1" (or "inline") profiles the mapping,
+    bypassing the result cache (see profiling.py).
     """
     try:
-        payload = request.get_json()
+        with metrics.stage_timer('map_document', 'parse'):
+            payload = request.get_json()
         if not payload:
             return jsonify({'error': 'No data provided'}), 400
         
@@ -52,32 +362,142 @@ def map_document():
         if not document_type:
             return jsonify({
                 'error': 'Missing document_type field',
-                'supported_types': [
-                    'Medical Report',
-                    'Lab Report',
-                    'Discharge Summary',
-                    'Admission Slip'
-                ]
+                'supported_types': SUPPORTED_DOCUMENT_TYPES
             }), 400
         
+        current_span().set_attribute('document_type', document_type)
         document_data = payload.get('data')
         if not document_data:
             return jsonify({'error': 'Missing data field'}), 400
         
         # Get appropriate mapper
         try:
-            mapper = get_document_mapper(document_type)
+            mapper = _mapper_for(document_type)
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
         
-        # Map to FHIR
-        fhir_bundle_json = mapper.map_to_fhir(document_data)
+        # Map to FHIR (or reuse the Bundle of an identical resubmission)
+        cache_key = _result_cache_key(document_type, document_data)
+        if _wants_async():
+            return _submit_job(
+                'map_document',
+                lambda: _map_with_cache('map_document', mapper, document_type, document_data, cache_key),
+                payload.get('callback_url') or request.args.get('callback_url')
+            )
+        profile_mode = _profile_mode()
+        if profile_mode:
+            return _profiled_response(
+                'map_document', document_type,
+                lambda: _map_with_cache('map_document', mapper, document_type, document_data, None), profile_mode
+            )
+        fhir_bundle_json = _map_with_cache('map_document', mapper, document_type, document_data, cache_key)
         
-        # Return as JSON
-        return jsonify(json.loads(fhir_bundle_json)), 200
+        # Return the encoded Bundle as-is
+        return _json_body_response(fhir_bundle_json)
         
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Unexpected error in /map/document: {e}")
         return jsonify({'error': 'Internal server error'}), 500
+
+@main_bp.route('/map/document/async', methods=['POST'])
+async def map_document_async():
+    """
+    Same as /map/document, but the document's terminology lookups are awaited
+    together on an event loop instead of occupying prefetch pool threads.
+    Requires Flask's async extra (asgiref) and httpx.
+    """
+    try:
+        with metrics.stage_timer('map_document', 'parse'):
+            payload = request.get_json()
+        if not payload:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        document_type = payload.get('document_type')
+        if not document_type:
+            return jsonify({
+                'error': 'Missing document_type field',
+                'supported_types': SUPPORTED_DOCUMENT_TYPES
+            }), 400
+        
+        current_span().set_attribute('document_type', document_type)
+        document_data = payload.get('data')
+        if not document_data:
+            return jsonify({'error': 'Missing data field'}), 400
+        
+        try:
+            mapper = _mapper_for(document_type)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        cache_key = _result_cache_key(document_type, document_data)
+        fhir_bundle_json = _cached_result('map_document', cache_key)
+        if fhir_bundle_json is None:
+            context = MappingContext()
+            start = time.perf_counter()
+            fhir_bundle_json = await mapper.map_to_fhir_async(document_data, context)
+            metrics.observe_mapping('map_document', document_type, context, time.perf_counter() - start)
+            _store_result(cache_key, fhir_bundle_json, context)
+        return _json_body_response(fhir_bundle_json)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Unexpected error in /map/document/async: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@main_bp.route('/map/documents', methods=['POST'])
+def map_documents():
+    """
+    Maps a batch of clinical documents to FHIR R4 Bundles.
+
+    Request body (application/x-ndjson), one document per line:
+    {"document_type": "Medical Report", "data": { ... }}
+    {"document_type": "Lab Report", "data": { ... }}
+
+    Returns: NDJSON stream with one line per non-empty input line, in input
+    order, written as soon as each document is mapped. A line that cannot be
+    mapped yields {"line": <line number>, "error": "..."} instead of a Bundle,
+    so one bad document does not fail the rest of the batch.
+    """
+    def generate(lines):
+        for line_number, raw_line in enumerate(lines, start=1):
+            if not raw_line.strip():
+                continue
+            with tracer.span('map_documents.line', line=line_number):
+                mapped = _map_ndjson_line(line_number, raw_line)
+            yield mapped + '\n'
+
+    return Response(stream_with_context(generate(request.stream)), mimetype='application/x-ndjson')
+
+def _map_ndjson_line(line_number, raw_line):
+    """Maps one NDJSON line and returns the Bundle JSON or an inline error line."""
+    try:
+        try:
+            with metrics.stage_timer('map_documents', 'parse'):
+                payload = loads(raw_line)
+        except ValueError:
+            raise ValueError('Invalid JSON')
+
+        if not isinstance(payload, dict):
+            raise ValueError('Each line must be a JSON object')
+
+        document_type = payload.get('document_type')
+        if not document_type:
+            raise ValueError('Missing document_type field')
+        current_span().set_attribute('document_type', document_type)
+
+        document_data = payload.get('data')
+        if not document_data:
+            raise ValueError('Missing data field')
+
+        mapper = _mapper_for(document_type)
+        cache_key = _result_cache_key(document_type, document_data)
+        return _map_with_cache('map_documents', mapper, document_type, document_data, cache_key)
+
+    except ValueError as e:
+        return dumps({'line': line_number, 'error': str(e)})
+    except Exception as e:
+        logger.error(f"Unexpected error in /map/documents line {line_number}: {e}")
+        return dumps({'line': line_number, 'error': 'Internal server error'})
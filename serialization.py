@@ -0,0 +1,67 @@
+"""
+JSON encoding shared by the mappers, the harmonizer and the routes.
+
+Mapped and harmonized Bundles are encoded exactly once and sent as-is. Plain
+dicts are encoded with the standard library by default, or with orjson when
+JSON_ENCODER = 'orjson' and the package is installed. Output is compact
+UTF-8 either way, matching pydantic's model_dump_json.
+"""
+
+import json
+import logging
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_ENCODERS = ('json', 'orjson')
+
+_encoder = 'json'
+
+
+def configure_serialization(app):
+    """
+    Selects the JSON encoder from app.config['JSON_ENCODER'] and, for orjson,
+    installs it as the app's JSON provider so request.get_json and jsonify use it too.
+    """
+    global _encoder
+    name = app.config.get('JSON_ENCODER', 'json')
+    if name not in SUPPORTED_ENCODERS:
+        raise ValueError(f"Unsupported JSON_ENCODER: {name}. Supported encoders: {', '.join(SUPPORTED_ENCODERS)}")
+    if name == 'orjson' and orjson is None:
+        logger.warning("JSON_ENCODER is 'orjson' but orjson is not installed, using json")
+        name = 'json'
+    _encoder = name
+    if name == 'orjson':
+        app.json = OrjsonProvider(app)
+
+
+def dumps(obj):
+    """Encodes obj as compact JSON (str)."""
+    if _encoder == 'orjson':
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(data):
+    """Decodes JSON from str or bytes."""
+    if _encoder == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson."""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_INDENT_2 if kwargs.get('indent') else 0
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
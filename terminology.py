@@ -1,14 +1,123 @@
 
+import asyncio
+import csv
+import json
 import logging
-import requests
-from cachetools import TTLCache, cached
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cachetools.keys import hashkey
+
+try:
+    from terminology_cache import FailedLookup, TieredCache, TransientFailedLookup, async_cached_lookup, cached_lookup, create_cache_backend
+    from terminology_index import CODE_SYSTEMS, load_indexes
+    from terminology_http import AsyncTerminologyHTTPClient, CircuitOpenError, OutboundLimitError, TerminologyHTTPClient
+    from metrics import observe_terminology_lookup, prometheus_client_available
+    from tracing import bind, tracer
+except ImportError:
+    from harmon_service.terminology_cache import FailedLookup, TieredCache, TransientFailedLookup, async_cached_lookup, cached_lookup, create_cache_backend
+    from harmon_service.terminology_index import CODE_SYSTEMS, load_indexes
+    from harmon_service.terminology_http import AsyncTerminologyHTTPClient, CircuitOpenError, OutboundLimitError, TerminologyHTTPClient
+    from harmon_service.metrics import observe_terminology_lookup, prometheus_client_available
+    from harmon_service.tracing import bind, tracer
 
 logger = logging.getLogger(__name__)
 
-# Cache configuration: Max 2000 items, expires in 24 hours (86400 seconds)
-terminology_cache = TTLCache(maxsize=2000, ttl=86400)
+# One cache per code system, so the same text looked up as a diagnosis and as a lab
+# test never collide. Defaults: max 2000 items each; codings expire in 24 hours
+# (86400 seconds), "no match" results in 1 hour and fallbacks caused by upstream
+# failures in 60 seconds. In-memory only until configure_terminology selects a
+# persistent backend, which the three caches then share.
+terminology_caches = {
+    code_system: TieredCache(code_system, maxsize=2000, ttl=86400, negative_ttl=3600, failure_ttl=60)
+    for code_system in CODE_SYSTEMS
+}
+
+# Upper bound on concurrent lookups issued by prefetch_codes (shared by all requests in a worker)
+PREFETCH_MAX_WORKERS = 8
+
+_prefetch_executor = None
+_prefetch_executor_pid = None
+_prefetch_lock = threading.Lock()
+
+# Code system name -> TerminologyIndex, populated when TERMINOLOGY_MODE is "local"
+_local_indexes = {}
+
+# Upstream endpoints, one circuit breaker each
+ENDPOINT_URLS = {
+    "icd10": "https://clinicaltables.nlm.nih.gov/api/icd10cm/v3/search",
+    "loinc": "https://clinicaltables.nlm.nih.gov/api/loinc_items/v3/search",
+    "rxnorm": "https://rxnav.nlm.nih.gov/REST/drugs.json",
+}
+
+# Lookups are timed only if there are metrics to record them in
+_on_lookup = observe_terminology_lookup if prometheus_client_available else None
+
+# Keep-alive connection pool and circuit breakers shared by all lookups in a worker
+http_client = TerminologyHTTPClient()
+
+# Client for the async lookups (a connection pool per session); shares http_client's breakers
+async_http_client = AsyncTerminologyHTTPClient(http_client)
+
+def configure_terminology(config):
+    """
+    Applies terminology settings from a Flask config (or any mapping).
+
+    Args:
+        config: Mapping with optional TERMINOLOGY_PREFETCH_WORKERS, TERMINOLOGY_MODE,
+                TERMINOLOGY_INDEX_DIR, TERMINOLOGY_CACHE_*, TERMINOLOGY_<SYSTEM>_CACHE_*,
+                TERMINOLOGY_HTTP_*, TERMINOLOGY_BREAKER_*, TERMINOLOGY_MAX_CONCURRENT_CALLS,
+                TERMINOLOGY_CALL_WAIT_TIMEOUT and TERMINOLOGY_*_URL settings.
+    """
+    global PREFETCH_MAX_WORKERS, _prefetch_executor, _local_indexes
+    backend = create_cache_backend(
+        config.get('TERMINOLOGY_CACHE_BACKEND', 'memory'),
+        path=config.get('TERMINOLOGY_CACHE_PATH'),
+        max_entries=config.get('TERMINOLOGY_CACHE_MAX_ENTRIES', 100000)
+    )
+    for code_system, cache in terminology_caches.items():
+        prefix = f'TERMINOLOGY_{code_system.upper()}_CACHE'
+        cache.configure(
+            maxsize=config.get(f'{prefix}_SIZE', 2000),
+            ttl=config.get(f'{prefix}_TTL', 86400),
+            negative_ttl=config.get('TERMINOLOGY_CACHE_NEGATIVE_TTL', 3600),
+            failure_ttl=config.get('TERMINOLOGY_CACHE_FAILURE_TTL', 60),
+            backend=backend
+        )
+
+    http_client.configure(
+        pool_size=config.get('TERMINOLOGY_HTTP_POOL_SIZE', 10),
+        timeout=config.get('TERMINOLOGY_HTTP_TIMEOUT', 5),
+        failure_threshold=config.get('TERMINOLOGY_BREAKER_FAILURE_THRESHOLD', 5),
+        reset_timeout=config.get('TERMINOLOGY_BREAKER_RESET_TIMEOUT', 30),
+        max_concurrent=config.get('TERMINOLOGY_MAX_CONCURRENT_CALLS', 32),
+        wait_timeout=config.get('TERMINOLOGY_CALL_WAIT_TIMEOUT', 2)
+    )
+    for code_system in ENDPOINT_URLS:
+        url = config.get(f'TERMINOLOGY_{code_system.upper()}_URL')
+        if url:
+            ENDPOINT_URLS[code_system] = url
+
+    mode = config.get('TERMINOLOGY_MODE', 'remote')
+    if mode == 'local':
+        # Code systems without an index file keep using the NLM APIs
+        _local_indexes = load_indexes(config.get('TERMINOLOGY_INDEX_DIR') or '.')
+    elif mode == 'remote':
+        _local_indexes = {}
+    else:
+        raise ValueError(f"Unsupported TERMINOLOGY_MODE: {mode}. Supported modes: remote, local")
 
-@cached(cache=terminology_cache)
+    workers = config.get('TERMINOLOGY_PREFETCH_WORKERS')
+    if workers and workers != PREFETCH_MAX_WORKERS:
+        with _prefetch_lock:
+            PREFETCH_MAX_WORKERS = workers
+            if _prefetch_executor is not None:
+                _prefetch_executor.shutdown(wait=False)
+                _prefetch_executor = None
+
+@cached_lookup(terminology_caches["icd10"], on_lookup=_on_lookup)
 def get_condition_code(text):
     """
     Searches for ICD-10 codes using the US NLM API.
@@ -28,11 +137,28 @@ def get_condition_code(text):
                   "text": "Hypertension"
               }
     """
-    # Strategy 1: Exact search
     clean_text = text.strip()
-    result = _search_icd10(clean_text)
-    if result:
-        return result
+    upstream_failed = shed = False
+    for strategy, term in enumerate(_condition_search_terms(clean_text), 1):
+        with tracer.span('terminology.icd10_search', strategy=strategy) as span:
+            try:
+                result = _search_icd10(term)
+            except _UpstreamLookupError as e:
+                span.record_error(e)
+                upstream_failed = True
+                shed = shed or isinstance(e, _LookupShedError)
+                continue
+            span.set_attribute('matched', bool(result))
+        if result:
+            return result
+
+    # Fallback: Just return text (cached only briefly if the API could not be reached)
+    return _text_fallback(clean_text, upstream_failed, shed)
+
+def _condition_search_terms(clean_text):
+    """Yields the ICD-10 search term of each strategy, in order"""
+    # Strategy 1: Exact search
+    yield clean_text
 
     # Strategy 2: Last word (often the noun, e.g. "High Fever" -> "Fever")
     words = clean_text.split()
@@ -40,51 +166,93 @@ def get_condition_code(text):
         last_word = words[-1]
         # Ignore short words to avoid noise
         if len(last_word) > 2:
-            result = _search_icd10(last_word)
-            if result:
-                return result
+            yield last_word
 
     # Strategy 3: Longest word (e.g. "Acute Bronchitis" -> "Bronchitis")
     if len(words) > 1:
         longest_word = max(words, key=len)
         if len(longest_word) > 2 and longest_word != words[-1]: # Don't repeat Strategy 2
-            result = _search_icd10(longest_word)
-            if result:
-                return result
+            yield longest_word
+
+class _UpstreamLookupError(Exception):
+    """The terminology API could not be reached or returned an error"""
+
+class _LookupShedError(_UpstreamLookupError):
+    """No outbound call slot was free for the terminology API"""
+
+def _text_fallback(clean_text, upstream_failed=False, shed=False):
+    """
+    Text-only concept; marked as a failed lookup when the API could not answer,
+    and as a transient one (never cached) when the call found no free outbound slot
+    """
+    if shed:
+        return TransientFailedLookup(text=clean_text)
+    if upstream_failed:
+        return FailedLookup(text=clean_text)
+    return {"text": clean_text}
 
-    # Fallback: Just return text
+def _search_local(code_system, term):
+    """Helper to query the offline index; returns a CodeableConcept dict or None"""
+    match = _local_indexes[code_system].search(term)
+    if not match:
+        return None
+    code, display = match
     return {
-        "text": clean_text
+        "coding": [{
+            "system": CODE_SYSTEMS[code_system],
+            "code": code,
+            "display": display
+        }],
+        "text": term
     }
 
 def _search_icd10(term):
-    """Helper to query ICD-10 API"""
-    base_url = "https://clinicaltables.nlm.nih.gov/api/icd10cm/v3/search"
+    """
+    Helper to query ICD-10 API.
+    Returns a concept dict, or None if nothing matched.
+    Raises _UpstreamLookupError if the API could not be queried.
+    """
+    if "icd10" in _local_indexes:
+        return _search_local("icd10", term)
+
     try:
-        response = requests.get(
-            base_url,
-            params={"terms": term, "sf": "code,name", "df": "code,name", "maxList": 1},
-            timeout=5
+        response = http_client.get(
+            "icd10",
+            ENDPOINT_URLS["icd10"],
+            params=_icd10_params(term)
         )
-        if response.status_code == 200:
-            data = response.json()
-            if len(data) > 3 and data[3]:
-                first_match = data[3][0]
-                return {
-                    "coding": [{
-                        "system": "http://hl7.org/fhir/sid/icd-10-cm",
-                        "code": first_match[0],
-                        "display": first_match[1]
-                    }],
-                    "text": term # Use the successful search term or keep original? Keeping original context is hard here, using matched term desc is safer.
-                    # Actually, we should return the mapped code but maybe imply the text is related.
-                    # Let's simple return the coding.
-                }
+        if response.status_code != 200:
+            raise _UpstreamLookupError(f"HTTP {response.status_code}")
+
+        return _parse_icd10_response(response.json(), term)
+    except OutboundLimitError as e:
+        raise _LookupShedError(str(e))
+    except CircuitOpenError as e:
+        raise _UpstreamLookupError(str(e))
     except Exception as e:
         logger.warning(f"ICD-10 search failed for '{term}': {e}")
+        raise _UpstreamLookupError(str(e))
+
+def _icd10_params(term):
+    return {"terms": term, "sf": "code,name", "df": "code,name", "maxList": 1}
+
+def _parse_icd10_response(data, term):
+    """Concept dict for the first ICD-10 match of a search response, or None"""
+    if len(data) > 3 and data[3]:
+        first_match = data[3][0]
+        return {
+            "coding": [{
+                "system": "http://hl7.org/fhir/sid/icd-10-cm",
+                "code": first_match[0],
+                "display": first_match[1]
+            }],
+            "text": term # Use the successful search term or keep original? Keeping original context is hard here, using matched term desc is safer.
+            # Actually, we should return the mapped code but maybe imply the text is related.
+            # Let's simple return the coding.
+        }
     return None
 
-@cached(cache=terminology_cache)
+@cached_lookup(terminology_caches["loinc"], on_lookup=_on_lookup)
 def get_loinc_code(text):
     """
     Searches for LOINC codes using the US NLM API.
@@ -99,59 +267,67 @@ def get_loinc_code(text):
     if not text:
         return {"text": ""}
 
-    # Use loinc_items endpoint
-    base_url = "https://clinicaltables.nlm.nih.gov/api/loinc_items/v3/search"
     clean_text = text.strip()
 
+    if "loinc" in _local_indexes:
+        return _search_local("loinc", clean_text) or {"text": clean_text}
+
     try:
-        # Params: terms=text, sf=text,LOINC_NUM (search fields), 
-        # df=LOINC_NUM,text (display fields to ensure we get code and name in response)
-        # maxList=1
-        response = requests.get(
-            base_url,
-            params={
-                "terms": clean_text, 
-                "sf": "text,LOINC_NUM", 
-                "df": "LOINC_NUM,text", 
-                "maxList": 1
-            },
-            timeout=5
-        )
+        # Use loinc_items endpoint
+        response = http_client.get("loinc", ENDPOINT_URLS["loinc"], params=_loinc_params(clean_text))
         response.raise_for_status()
-        data = response.json()
-        
-        # API response format: [total_count, codes, extra_info, display_strings]
-        if len(data) > 3 and data[3]:
-            # Check if display strings are list of lists or flattened
-            first_item = data[3][0]
-            
-            # Case 1: List of lists (e.g. [[code, name], ...])
-            if isinstance(first_item, list) and len(first_item) >= 2:
-                code = first_item[0]
-                display = first_item[1]
-            # Case 2: Parallel lists (codes in data[1], names in data[3])
-            elif len(data) > 1 and data[1]:
-                 code = data[1][0]
-                 display = first_item if isinstance(first_item, str) else str(first_item)
-            else:
-                 # Fallback if structure is unexpected
-                 return {"text": clean_text}
-
-            return {
-                "coding": [{
-                    "system": "http://loinc.org",
-                    "code": code,
-                    "display": display
-                }],
-                "text": clean_text
-            }
+        return _parse_loinc_response(response.json(), clean_text)
 
+    except OutboundLimitError:
+        return _text_fallback(clean_text, shed=True)
+    except CircuitOpenError:
+        return _text_fallback(clean_text, upstream_failed=True)
     except Exception as e:
         logger.warning(f"LOINC lookup failed for '{clean_text}': {e}")
+        return _text_fallback(clean_text, upstream_failed=True)
+
+def _loinc_params(clean_text):
+    # Params: terms=text, sf=text,LOINC_NUM (search fields), 
+    # df=LOINC_NUM,text (display fields to ensure we get code and name in response)
+    # maxList=1
+    return {
+        "terms": clean_text, 
+        "sf": "text,LOINC_NUM", 
+        "df": "LOINC_NUM,text", 
+        "maxList": 1
+    }
+
+def _parse_loinc_response(data, clean_text):
+    """Concept dict for the first LOINC match of a search response, or a text-only concept"""
+    # API response format: [total_count, codes, extra_info, display_strings]
+    if len(data) > 3 and data[3]:
+        # Check if display strings are list of lists or flattened
+        first_item = data[3][0]
+        
+        # Case 1: List of lists (e.g. [[code, name], ...])
+        if isinstance(first_item, list) and len(first_item) >= 2:
+            code = first_item[0]
+            display = first_item[1]
+        # Case 2: Parallel lists (codes in data[1], names in data[3])
+        elif len(data) > 1 and data[1]:
+             code = data[1][0]
+             display = first_item if isinstance(first_item, str) else str(first_item)
+        else:
+             # Fallback if structure is unexpected
+             return {"text": clean_text}
+
+        return {
+            "coding": [{
+                "system": "http://loinc.org",
+                "code": code,
+                "display": display
+            }],
+            "text": clean_text
+        }
 
     return {"text": clean_text}
 
-@cached(cache=terminology_cache)
+@cached_lookup(terminology_caches["rxnorm"], on_lookup=_on_lookup)
 def get_rxnorm_code(text):
     """
     Searches for RxNorm codes using the NLM RxNav API.
@@ -166,48 +342,337 @@ def get_rxnorm_code(text):
     if not text:
         return {"text": ""}
 
-    # Use drugs.json endpoint
-    base_url = "https://rxnav.nlm.nih.gov/REST/drugs.json"
     clean_text = text.strip()
 
+    if "rxnorm" in _local_indexes:
+        return _search_local("rxnorm", clean_text) or {"text": clean_text}
+
     try:
-        # Params: name=text
-        response = requests.get(
-            base_url,
-            params={"name": clean_text},
-            timeout=5
-        )
+        # Use drugs.json endpoint. Params: name=text
+        response = http_client.get("rxnorm", ENDPOINT_URLS["rxnorm"], params={"name": clean_text})
         response.raise_for_status()
-        data = response.json()
-        
-        # Response structure: drugGroup -> conceptGroup -> [list of concepts]
-        drug_group = data.get("drugGroup", {})
-        concept_groups = drug_group.get("conceptGroup", [])
-        
-        if concept_groups:
-             # Look for the first ConceptGroup that has properties (SBD (Brand) or SCD (Clinical Drug) preferred, 
-             # but often we just want any valid concept)
-             # The API returns different TTY (Term Types). We'll take the first available Concept.
-             for group in concept_groups:
-                 if "conceptProperties" in group:
-                     concepts = group["conceptProperties"]
-                     if concepts:
-                         # Take the first concept found
-                         first_concept = concepts[0]
-                         rxcui = first_concept.get("rxcui")
-                         name = first_concept.get("name")
-                         
-                         return {
-                            "coding": [{
-                                "system": "http://www.nlm.nih.gov/research/umls/rxnorm",
-                                "code": rxcui,
-                                "display": name
-                            }],
-                            "text": clean_text
-                        }
+        return _parse_rxnorm_response(response.json(), clean_text)
 
+    except OutboundLimitError:
+        return _text_fallback(clean_text, shed=True)
+    except CircuitOpenError:
+        return _text_fallback(clean_text, upstream_failed=True)
     except Exception as e:
         logger.warning(f"RxNorm lookup failed for '{clean_text}': {e}")
-        
+        return _text_fallback(clean_text, upstream_failed=True)
+
+def _parse_rxnorm_response(data, clean_text):
+    """Concept dict for the first RxNorm concept of a drugs.json response, or a text-only concept"""
+    # Response structure: drugGroup -> conceptGroup -> [list of concepts]
+    drug_group = data.get("drugGroup", {})
+    concept_groups = drug_group.get("conceptGroup", [])
+    
+    if concept_groups:
+         # Look for the first ConceptGroup that has properties (SBD (Brand) or SCD (Clinical Drug) preferred, 
+         # but often we just want any valid concept)
+         # The API returns different TTY (Term Types). We'll take the first available Concept.
+         for group in concept_groups:
+             if "conceptProperties" in group:
+                 concepts = group["conceptProperties"]
+                 if concepts:
+                     # Take the first concept found
+                     first_concept = concepts[0]
+                     rxcui = first_concept.get("rxcui")
+                     name = first_concept.get("name")
+                     
+                     return {
+                        "coding": [{
+                            "system": "http://www.nlm.nih.gov/research/umls/rxnorm",
+                            "code": rxcui,
+                            "display": name
+                        }],
+                        "text": clean_text
+                    }
+    
     return {"text": clean_text}
 
+# Code system name -> lookup function, used to resolve prefetched terms
+CODE_SYSTEM_LOOKUPS = {
+    "icd10": get_condition_code,
+    "loinc": get_loinc_code,
+    "rxnorm": get_rxnorm_code,
+}
+
+# Snapshot file format version written by export_snapshot
+SNAPSHOT_VERSION = 1
+
+def export_snapshot(path):
+    """
+    Writes every resolved concept in this worker's caches (failed lookups
+    excluded) to a JSON snapshot file, atomically.
+
+    Returns:
+        dict: code system -> number of entries written.
+    """
+    caches = {
+        code_system: [[list(key), concept] for key, concept in cache.export_entries()]
+        for code_system, cache in terminology_caches.items()
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.terminology-snapshot-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'created_at': time.time(), 'caches': caches}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    counts = {code_system: len(entries) for code_system, entries in caches.items()}
+    logger.info(f"Exported terminology snapshot to '{path}': {counts}")
+    return counts
+
+def import_snapshot(path):
+    """
+    Loads a snapshot written by export_snapshot into this worker's caches.
+    Entries get the full TTL of their result class from now.
+
+    Returns:
+        dict: code system -> number of entries loaded.
+
+    Raises:
+        ValueError: If the file is not a supported snapshot.
+    """
+    with open(path, encoding='utf-8') as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported terminology snapshot: {path}")
+    counts = {}
+    for code_system, entries in snapshot.get('caches', {}).items():
+        cache = terminology_caches.get(code_system)
+        if cache is None:
+            logger.warning(f"Skipping unknown code system '{code_system}' in snapshot")
+            continue
+        counts[code_system] = cache.load_entries((hashkey(*key), concept) for key, concept in entries)
+    logger.info(f"Imported terminology snapshot from '{path}': {counts}")
+    return counts
+
+# Progress of the background warm-up started by start_warmup
+warmup_state = {'status': 'idle', 'terms': 0, 'resolved': 0, 'error': None}
+
+def read_term_frequencies(path, top_n):
+    """
+    Reads a term-frequency list: CSV rows of code_system,term,count (a header
+    row is allowed). Returns the top_n (code_system, term) pairs by count.
+    """
+    rows = []
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or row[0] not in CODE_SYSTEM_LOOKUPS or not row[1]:
+                continue
+            try:
+                rows.append((int(row[2]), row[0], row[1]))
+            except ValueError:
+                continue
+    rows.sort(key=lambda row: -row[0])
+    return [(code_system, term) for _, code_system, term in rows[:top_n]]
+
+def warm_up(terms, batch_size=100):
+    """Resolves (code_system, term) pairs through the caches, updating warmup_state."""
+    warmup_state.update(status='warming', terms=len(terms), resolved=0, error=None)
+    try:
+        for i in range(0, len(terms), batch_size):
+            resolved = prefetch_codes(terms[i:i + batch_size])
+            warmup_state['resolved'] += sum(1 for concept in resolved.values() if not isinstance(concept, FailedLookup))
+        warmup_state['status'] = 'ready'
+        logger.info(f"Terminology warm-up resolved {warmup_state['resolved']} of {len(terms)} terms")
+    except Exception as e:
+        warmup_state.update(status='failed', error=str(e))
+        logger.error(f"Terminology warm-up failed: {e}")
+
+def start_warmup(path, top_n):
+    """Starts warming the caches from a term-frequency list in a background thread."""
+    terms = read_term_frequencies(path, top_n)
+    warmup_state.update(status='warming', terms=len(terms), resolved=0, error=None)
+    thread = threading.Thread(target=warm_up, args=(terms,), name='terminology-warmup', daemon=True)
+    thread.start()
+    return thread
+
+def cache_stats():
+    """Returns {code_system: size, hit, miss and eviction counters} for this worker."""
+    return {code_system: cache.stats() for code_system, cache in terminology_caches.items()}
+
+def _get_prefetch_executor():
+    """Returns the worker's shared lookup pool, recreating it after a fork."""
+    global _prefetch_executor, _prefetch_executor_pid
+    with _prefetch_lock:
+        if _prefetch_executor is None or _prefetch_executor_pid != os.getpid():
+            _prefetch_executor = ThreadPoolExecutor(
+                max_workers=PREFETCH_MAX_WORKERS,
+                thread_name_prefix="terminology-prefetch"
+            )
+            _prefetch_executor_pid = os.getpid()
+        return _prefetch_executor
+
+def _unique_terms(terms):
+    # Documents may carry dicts or lists where a term belongs, which are not hashable
+    return {(system, text) for system, text in terms if text and isinstance(text, str)}
+
+def prefetch_codes(terms):
+    """
+    Resolves many terminology lookups concurrently on a bounded thread pool.
+
+    Args:
+        terms (iterable): (code_system, text) pairs, where code_system is one of
+                          "icd10", "loinc" or "rxnorm". Duplicates are looked up once;
+                          empty and non-string texts are skipped (the caller's own
+                          lookup then handles them).
+
+    Returns:
+        dict: (code_system, text) -> CodeableConcept dict. Lookups that raised are
+              left out so the caller can retry them and apply its own fallback.
+    """
+    unique_terms = _unique_terms(terms)
+    if not unique_terms:
+        return {}
+
+    if len(unique_terms) == 1:
+        system, text = next(iter(unique_terms))
+        try:
+            return {(system, text): CODE_SYSTEM_LOOKUPS[system](text)}
+        except Exception as e:
+            logger.warning(f"Prefetch failed for {system} '{text}': {e}")
+            return {}
+
+    executor = _get_prefetch_executor()
+    # Lookups on the pool are traced as children of the caller's span
+    futures = {
+        term: executor.submit(bind(CODE_SYSTEM_LOOKUPS[term[0]]), term[1])
+        for term in unique_terms
+    }
+
+    resolved = {}
+    for (system, text), future in futures.items():
+        try:
+            resolved[(system, text)] = future.result()
+        except Exception as e:
+            logger.warning(f"Prefetch failed for {system} '{text}': {e}")
+    return resolved
+
+
+# ---------------------------------------------------------------------------
+# Async lookups: same signatures, results, caches and breakers as the sync
+# functions above, for callers running on an event loop.
+# ---------------------------------------------------------------------------
+
+@async_cached_lookup(terminology_caches["icd10"], on_lookup=_on_lookup)
+async def get_condition_code_async(text):
+    """Async get_condition_code."""
+    clean_text = text.strip()
+    upstream_failed = shed = False
+    for strategy, term in enumerate(_condition_search_terms(clean_text), 1):
+        with tracer.span('terminology.icd10_search', strategy=strategy) as span:
+            try:
+                result = await _search_icd10_async(term)
+            except _UpstreamLookupError as e:
+                span.record_error(e)
+                upstream_failed = True
+                shed = shed or isinstance(e, _LookupShedError)
+                continue
+            span.set_attribute('matched', bool(result))
+        if result:
+            return result
+
+    return _text_fallback(clean_text, upstream_failed, shed)
+
+async def _search_icd10_async(term):
+    """Async _search_icd10."""
+    if "icd10" in _local_indexes:
+        return _search_local("icd10", term)
+
+    try:
+        response = await async_http_client.get("icd10", ENDPOINT_URLS["icd10"], params=_icd10_params(term))
+        if response.status_code != 200:
+            raise _UpstreamLookupError(f"HTTP {response.status_code}")
+
+        return _parse_icd10_response(response.json(), term)
+    except OutboundLimitError as e:
+        raise _LookupShedError(str(e))
+    except CircuitOpenError as e:
+        raise _UpstreamLookupError(str(e))
+    except Exception as e:
+        logger.warning(f"ICD-10 search failed for '{term}': {e}")
+        raise _UpstreamLookupError(str(e))
+
+@async_cached_lookup(terminology_caches["loinc"], on_lookup=_on_lookup)
+async def get_loinc_code_async(text):
+    """Async get_loinc_code."""
+    if not text:
+        return {"text": ""}
+
+    clean_text = text.strip()
+
+    if "loinc" in _local_indexes:
+        return _search_local("loinc", clean_text) or {"text": clean_text}
+
+    try:
+        response = await async_http_client.get("loinc", ENDPOINT_URLS["loinc"], params=_loinc_params(clean_text))
+        response.raise_for_status()
+        return _parse_loinc_response(response.json(), clean_text)
+    except OutboundLimitError:
+        return _text_fallback(clean_text, shed=True)
+    except CircuitOpenError:
+        return _text_fallback(clean_text, upstream_failed=True)
+    except Exception as e:
+        logger.warning(f"LOINC lookup failed for '{clean_text}': {e}")
+        return _text_fallback(clean_text, upstream_failed=True)
+
+@async_cached_lookup(terminology_caches["rxnorm"], on_lookup=_on_lookup)
+async def get_rxnorm_code_async(text):
+    """Async get_rxnorm_code."""
+    if not text:
+        return {"text": ""}
+
+    clean_text = text.strip()
+
+    if "rxnorm" in _local_indexes:
+        return _search_local("rxnorm", clean_text) or {"text": clean_text}
+
+    try:
+        response = await async_http_client.get("rxnorm", ENDPOINT_URLS["rxnorm"], params={"name": clean_text})
+        response.raise_for_status()
+        return _parse_rxnorm_response(response.json(), clean_text)
+    except OutboundLimitError:
+        return _text_fallback(clean_text, shed=True)
+    except CircuitOpenError:
+        return _text_fallback(clean_text, upstream_failed=True)
+    except Exception as e:
+        logger.warning(f"RxNorm lookup failed for '{clean_text}': {e}")
+        return _text_fallback(clean_text, upstream_failed=True)
+
+ASYNC_CODE_SYSTEM_LOOKUPS = {
+    "icd10": get_condition_code_async,
+    "loinc": get_loinc_code_async,
+    "rxnorm": get_rxnorm_code_async,
+}
+
+async def prefetch_codes_async(terms):
+    """
+    Async prefetch_codes: awaits every lookup of the terms together, over
+    one connection pool.
+
+    Returns:
+        dict: (code_system, text) -> CodeableConcept dict. Lookups that raised are left out.
+    """
+    unique_terms = list(_unique_terms(terms))
+    if not unique_terms:
+        return {}
+
+    async with async_http_client.session():
+        results = await asyncio.gather(
+            *(ASYNC_CODE_SYSTEM_LOOKUPS[system](text) for system, text in unique_terms),
+            return_exceptions=True
+        )
+
+    resolved = {}
+    for (system, text), result in zip(unique_terms, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Prefetch failed for {system} '{text}': {result!r}")
+        else:
+            resolved[(system, text)] = result
+    return resolved
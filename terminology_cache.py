@@ -0,0 +1,611 @@
+"""
+Terminology cache backends.
+
+The terminology functions cache resolved CodeableConcepts in a two-level cache:
+an in-process TLRUCache (L1) in front of an optional persistent backend (L2)
+that every worker on the host shares and that survives restarts. Each code
+system has its own TieredCache, with its own size, TTL and counters.
+
+Each result gets a TTL by outcome: a real coding keeps the full TTL, a
+"no match" text-only concept a shorter negative TTL, and a text-only fallback
+caused by an upstream failure (FailedLookup) a very short one. Failures are
+kept out of the persistent backend. Concurrent misses on the same key share a
+single in-flight lookup, both across threads and across the tasks of one
+event loop.
+"""
+
+import asyncio
+import copy
+import functools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import MutableMapping
+from cachetools import TLRUCache
+from cachetools.keys import hashkey
+
+try:
+    from tracing import tracer
+except ImportError:
+    from harmon_service.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 2000
+DEFAULT_CACHE_TTL = 86400
+DEFAULT_NEGATIVE_TTL = 3600
+DEFAULT_FAILURE_TTL = 60
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), 'fhir-terminology-cache.sqlite3')
+DEFAULT_SQLITE_MAX_ENTRIES = 100000
+# Writes per process between purges of the SQLite file
+SQLITE_PURGE_INTERVAL = 1000
+
+
+RESULT_FOUND = 'found'
+RESULT_NOT_FOUND = 'not_found'
+RESULT_FAILED = 'failed'
+
+
+class FailedLookup(dict):
+    """Text-only CodeableConcept returned because the upstream lookup failed."""
+
+
+class TransientFailedLookup(FailedLookup):
+    """FailedLookup returned because no outbound call slot was free; never cached."""
+
+
+def classify_result(value):
+    """Returns RESULT_FOUND, RESULT_NOT_FOUND or RESULT_FAILED for a cached concept."""
+    if isinstance(value, FailedLookup):
+        return RESULT_FAILED
+    if value.get('coding'):
+        return RESULT_FOUND
+    return RESULT_NOT_FOUND
+
+
+def _encode_key(key):
+    """Cache keys are cachetools hash keys (tuples of arguments)."""
+    return json.dumps(list(key), separators=(',', ':'))
+
+
+class SQLiteCache(MutableMapping):
+    """
+    Terminology cache stored in a SQLite file.
+
+    All gunicorn workers on a host can point at the same file. WAL mode lets
+    them read concurrently while one writes. Connections are opened per thread
+    and per process, so the cache is safe to use after a fork.
+    Storage errors are logged and treated as cache misses, never raised.
+
+    Expired rows are purged when the cache is created and then every
+    SQLITE_PURGE_INTERVAL writes; if more than max_entries rows remain (0 = no
+    limit), those closest to expiry are deleted too, so the file stays bounded.
+    """
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_SQLITE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self.purge()
+
+    def purge(self):
+        """Deletes expired rows, then the rows closest to expiry beyond max_entries. Returns the count."""
+        conn = self._connect()
+        if conn is None:
+            return 0
+        try:
+            with conn:
+                deleted = conn.execute("DELETE FROM terminology_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+                if self.max_entries > 0:
+                    excess = conn.execute("SELECT COUNT(*) FROM terminology_cache").fetchone()[0] - self.max_entries
+                    if excess > 0:
+                        deleted += conn.execute(
+                            "DELETE FROM terminology_cache WHERE key IN ("
+                            "SELECT key FROM terminology_cache ORDER BY expires_at LIMIT ?)", (excess,)
+                        ).rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"Could not purge terminology cache entries: {e}")
+            return 0
+        if deleted:
+            logger.info(f"Purged {deleted} entries from the terminology cache at '{self.path}'")
+        return deleted
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        try:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS terminology_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS terminology_cache_expires_at ON terminology_cache (expires_at)")
+        except sqlite3.Error as e:
+            logger.warning(f"Terminology cache at '{self.path}' unavailable: {e}")
+            return None
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def __getitem__(self, key):
+        conn = self._connect()
+        if conn is None:
+            raise KeyError(key)
+        try:
+            row = conn.execute(
+                "SELECT value FROM terminology_cache WHERE key = ? AND expires_at > ?",
+                (_encode_key(key), time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Terminology cache read failed: {e}")
+            row = None
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        """Stores a value, expiring after ttl seconds (default: the backend's TTL)."""
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO terminology_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (_encode_key(key), json.dumps(value), time.time() + (self.ttl if ttl is None else ttl))
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Terminology cache write failed: {e}")
+            return
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % SQLITE_PURGE_INTERVAL == 0
+        if due:
+            self.purge()
+
+    def __delitem__(self, key):
+        conn = self._connect()
+        if conn is None:
+            raise KeyError(key)
+        try:
+            deleted = conn.execute(
+                "DELETE FROM terminology_cache WHERE key = ?", (_encode_key(key),)
+            ).rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"Terminology cache delete failed: {e}")
+            deleted = 0
+        if not deleted:
+            raise KeyError(key)
+
+    def __iter__(self):
+        conn = self._connect()
+        if conn is None:
+            return iter(())
+        try:
+            rows = conn.execute(
+                "SELECT key FROM terminology_cache WHERE expires_at > ?", (time.time(),)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Terminology cache scan failed: {e}")
+            rows = []
+        return iter(tuple(json.loads(row[0])) for row in rows)
+
+    def __len__(self):
+        conn = self._connect()
+        if conn is None:
+            return 0
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM terminology_cache WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Terminology cache count failed: {e}")
+            return 0
+
+    def clear(self, namespace=None):
+        """Deletes every entry, or only those whose key starts with namespace."""
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            if namespace is None:
+                conn.execute("DELETE FROM terminology_cache")
+            else:
+                prefix = _encode_key((namespace,))[:-1] + ','
+                conn.execute(
+                    "DELETE FROM terminology_cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Terminology cache clear failed: {e}")
+
+
+class _InFlight:
+    """A lookup being resolved by one thread that other threads wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def encode_concept(concept):
+    """
+    Packs a CodeableConcept dict into a compact tuple with interned strings:
+    (result, text) for text-only concepts, (result, text, system, code, display)
+    for a single coding. Other shapes are stored unchanged.
+    """
+    result = classify_result(concept)
+    text = concept.get('text')
+    coding = concept.get('coding')
+    if not coding and set(concept) <= {'text'}:
+        return (result, _intern(text))
+    if (coding and len(coding) == 1 and set(concept) <= {'text', 'coding'}
+            and set(coding[0]) == {'system', 'code', 'display'}):
+        c = coding[0]
+        return (result, _intern(text), _intern(c['system']), _intern(c['code']), _intern(c['display']))
+    return concept
+
+
+def decode_concept(value):
+    """Inverse of encode_concept; always returns a new dict."""
+    if not isinstance(value, tuple):
+        return FailedLookup(copy.deepcopy(value)) if isinstance(value, FailedLookup) else copy.deepcopy(value)
+    result, text = value[0], value[1]
+    if len(value) == 2:
+        concept = {} if text is None else {"text": text}
+    else:
+        concept = {"coding": [{"system": value[2], "code": value[3], "display": value[4]}]}
+        if text is not None:
+            concept["text"] = text
+    return FailedLookup(concept) if result == RESULT_FAILED else concept
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _result_of(value):
+    return value[0] if isinstance(value, tuple) else classify_result(value)
+
+
+class _CountingTLRUCache(TLRUCache):
+    """TLRUCache that counts entries evicted to make room (not expirations)."""
+
+    def __init__(self, maxsize, ttu):
+        super().__init__(maxsize=maxsize, ttu=ttu)
+        self.evictions = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+
+class TieredCache(MutableMapping):
+    """
+    Thread-safe TLRUCache (L1) in front of an optional persistent backend (L2),
+    for one code system (namespace).
+
+    L1 holds compact tuples (see encode_concept); reads always return fresh
+    dicts. Reads fall through to L2 on an L1 miss and promote the value into
+    L1. Writes go to L1 and, except for failed lookups, to L2, where keys are
+    prefixed with the namespace so code systems sharing one backend never see
+    each other's entries; transient failures are not written at all. Entry lifetimes depend on the result class (see
+    classify_result). Hits, misses and evictions are counted.
+    """
+
+    def __init__(self, namespace, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, backend=None,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, failure_ttl=DEFAULT_FAILURE_TTL):
+        self.namespace = namespace
+        self._lock = threading.RLock()
+        self._in_flight = {}
+        self._async_in_flight = {}
+        self.configure(maxsize, ttl, backend, negative_ttl, failure_ttl)
+
+    def configure(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, backend=None,
+                  negative_ttl=DEFAULT_NEGATIVE_TTL, failure_ttl=DEFAULT_FAILURE_TTL):
+        """Replaces both cache levels; existing L1 entries and counters are dropped."""
+        with self._lock:
+            self.ttls = {
+                RESULT_FOUND: ttl,
+                RESULT_NOT_FOUND: min(negative_ttl, ttl),
+                RESULT_FAILED: min(failure_ttl, ttl),
+            }
+            self.l1 = _CountingTLRUCache(maxsize=maxsize, ttu=self._ttu)
+            self.l2 = backend
+            self.hits = 0
+            self.l2_hits = 0
+            self.misses = 0
+
+    def _ttu(self, key, value, now):
+        return now + self.ttls[_result_of(value)]
+
+    def _l2_key(self, key):
+        return (self.namespace,) + tuple(key)
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                return decode_concept(self.l1[key])
+            except KeyError:
+                if self.l2 is None:
+                    raise
+        value = self.l2[self._l2_key(key)]
+        with self._lock:
+            self.l1[key] = encode_concept(value)
+        return value
+
+    def __setitem__(self, key, value):
+        if isinstance(value, TransientFailedLookup):
+            return
+        with self._lock:
+            self.l1[key] = encode_concept(value)
+        result = classify_result(value)
+        if self.l2 is not None and result != RESULT_FAILED:
+            self.l2.set(self._l2_key(key), dict(value), ttl=self.ttls[result])
+
+    def __delitem__(self, key):
+        found = False
+        for level, level_key in ((self.l1, key), (self.l2, self._l2_key(key))):
+            if level is None:
+                continue
+            try:
+                with self._lock:
+                    del level[level_key]
+                found = True
+            except KeyError:
+                pass
+        if not found:
+            raise KeyError(key)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self.l1))
+
+    def __len__(self):
+        with self._lock:
+            return len(self.l1)
+
+    def export_entries(self):
+        """
+        Returns [(key, concept)] for every live L1 entry except failed lookups,
+        for a snapshot.
+        """
+        with self._lock:
+            items = list(self.l1.items())
+        return [
+            (key, decode_concept(value))
+            for key, value in items
+            if _result_of(value) != RESULT_FAILED
+        ]
+
+    def load_entries(self, entries):
+        """
+        Loads (key, concept) pairs into L1 only (L2, if any, persists on its
+        own), each with the full TTL of its result class. Returns the count.
+        """
+        count = 0
+        with self._lock:
+            for key, concept in entries:
+                if classify_result(concept) == RESULT_FAILED:
+                    continue
+                self.l1[key] = encode_concept(concept)
+                count += 1
+        return count
+
+    def clear(self):
+        """Empties both levels for this namespace."""
+        with self._lock:
+            self.l1.clear()
+        if self.l2 is not None:
+            self.l2.clear(namespace=self.namespace)
+
+    def _lookup(self, key):
+        """__getitem__ that updates the hit/miss counters."""
+        with self._lock:
+            try:
+                value = decode_concept(self.l1[key])
+                self.hits += 1
+                return value
+            except KeyError:
+                if self.l2 is None:
+                    self.misses += 1
+                    raise
+        try:
+            value = self.l2[self._l2_key(key)]
+        except KeyError:
+            with self._lock:
+                self.misses += 1
+            raise
+        with self._lock:
+            self.l1[key] = encode_concept(value)
+            self.l2_hits += 1
+        return value
+
+    def stats(self):
+        """Returns size, hit, miss and eviction counters for this namespace."""
+        with self._lock:
+            lookups = self.hits + self.l2_hits + self.misses
+            return {
+                'size': len(self.l1),
+                'maxsize': self.l1.maxsize,
+                'hits': self.hits,
+                'l2_hits': self.l2_hits,
+                'misses': self.misses,
+                'evictions': self.l1.evictions,
+                'hit_ratio': round((self.hits + self.l2_hits) / lookups, 4) if lookups else None,
+            }
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key, or loads and caches it.
+
+        Concurrent callers missing on the same key share one call to loader:
+        the first one runs it, the others wait for its result (or its exception).
+        """
+        try:
+            return self._lookup(key)
+        except KeyError:
+            pass
+
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                try:
+                    # Another thread may have finished this key since the miss above
+                    return decode_concept(self.l1[key])
+                except KeyError:
+                    pass
+                call = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return decode_concept(encode_concept(call.value))
+
+        try:
+            call.value = loader()
+            self[key] = call.value
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    async def get_or_load_async(self, key, loader):
+        """
+        get_or_load for coroutine loaders.
+
+        Concurrent tasks of the same event loop missing on the same key await
+        one shared call to loader.
+        """
+        try:
+            return self._lookup(key)
+        except KeyError:
+            pass
+
+        in_flight_key = (asyncio.get_running_loop(), key)
+        future = self._async_in_flight.get(in_flight_key)
+        if future is not None:
+            value = await asyncio.shield(future)
+            return decode_concept(encode_concept(value))
+
+        future = asyncio.ensure_future(loader())
+        self._async_in_flight[in_flight_key] = future
+        try:
+            value = await asyncio.shield(future)
+            self[key] = value
+            return value
+        finally:
+            del self._async_in_flight[in_flight_key]
+
+
+def _lookup_outcome(value, loaded):
+    if isinstance(value, FailedLookup):
+        return 'error'
+    return 'miss' if loaded else 'hit'
+
+
+def cached_lookup(cache, on_lookup=None):
+    """
+    Decorator caching a terminology function in a TieredCache, keyed on its
+    arguments, with single-flight de-duplication of concurrent misses.
+
+    on_lookup(cache, outcome, seconds), if given, is called after every call
+    with outcome "hit", "miss" (the function ran) or "error" (it raised or
+    returned a FailedLookup). While tracing, each call is a "terminology.lookup"
+    span with the outcome as its cache.outcome attribute.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            if on_lookup is None and not tracer.enabled:
+                return cache.get_or_load(hashkey(*args), lambda: func(*args))
+            loaded = []
+
+            def loader():
+                loaded.append(True)
+                return func(*args)
+
+            start = time.perf_counter()
+            outcome = 'error'
+            with tracer.span('terminology.lookup', code_system=cache.namespace) as span:
+                try:
+                    value = cache.get_or_load(hashkey(*args), loader)
+                    outcome = _lookup_outcome(value, loaded)
+                    return value
+                finally:
+                    span.set_attribute('cache.outcome', outcome)
+                    if on_lookup is not None:
+                        on_lookup(cache, outcome, time.perf_counter() - start)
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def async_cached_lookup(cache, on_lookup=None):
+    """cached_lookup for coroutine functions, sharing the cache with the sync lookups."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args):
+            loaded = []
+
+            def loader():
+                loaded.append(True)
+                return func(*args)
+
+            start = time.perf_counter()
+            outcome = 'error'
+            with tracer.span('terminology.lookup', code_system=cache.namespace) as span:
+                try:
+                    value = await cache.get_or_load_async(hashkey(*args), loader)
+                    outcome = _lookup_outcome(value, loaded)
+                    return value
+                finally:
+                    span.set_attribute('cache.outcome', outcome)
+                    if on_lookup is not None:
+                        on_lookup(cache, outcome, time.perf_counter() - start)
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def create_cache_backend(name, path=None, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_SQLITE_MAX_ENTRIES):
+    """
+    Builds the persistent (L2) cache backend selected in config.
+
+    Args:
+        name (str): "memory" (no persistent backend) or "sqlite".
+        path (str): SQLite file path, shared by all workers on the host.
+        ttl (int): Default seconds before a persisted entry expires.
+        max_entries (int): Rows kept in the SQLite file (0 = no limit).
+
+    Returns:
+        A MutableMapping backend, or None for "memory".
+
+    Raises:
+        ValueError: If the backend name is unknown.
+    """
+    if not name or name == 'memory':
+        return None
+    if name == 'sqlite':
+        return SQLiteCache(path or DEFAULT_SQLITE_PATH, ttl=ttl, max_entries=max_entries)
+    raise ValueError(f"Unsupported terminology cache backend: {name}. Supported backends: memory, sqlite")
@@ -0,0 +1,445 @@
+"""
+Shared HTTP client for the NLM terminology APIs.
+
+Keeps one keep-alive connection pool per worker process and a circuit breaker
+per endpoint. While a breaker is open, calls fail immediately with
+CircuitOpenError instead of waiting out the request timeout, so lookups fall
+back to text-only concepts straight away. After the reset timeout a single
+half-open probe is let through; if it succeeds the breaker closes again.
+
+Outbound calls are also bounded per worker: at most
+TERMINOLOGY_MAX_CONCURRENT_CALLS are in flight, and a call that finds no free
+slot within TERMINOLOGY_CALL_WAIT_TIMEOUT seconds fails with OutboundLimitError
+instead of queueing behind a slow upstream. The breaker is checked first, so
+calls to an endpoint whose breaker is open never wait for a slot.
+
+AsyncTerminologyHTTPClient is the asyncio counterpart (requires httpx). It
+shares the breakers and outbound limit of a TerminologyHTTPClient, so sync
+and async lookups see the same endpoint health. Its connections are pooled
+per session (e.g. one document's prefetch), not kept alive across requests:
+Flask runs every async view on a new event loop, which an httpx pool cannot
+outlive.
+"""
+
+import asyncio
+import collections
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from metrics import observe_outbound_in_flight, observe_outbound_rejected
+    from tracing import tracer
+except ImportError:
+    from harmon_service.metrics import observe_outbound_in_flight, observe_outbound_rejected
+    from harmon_service.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+DEFAULT_MAX_CONCURRENT_CALLS = 32
+DEFAULT_CALL_WAIT_TIMEOUT = 2.0
+
+# httpx.AsyncClient of the current AsyncTerminologyHTTPClient.session
+_async_session = contextvars.ContextVar('terminology_async_session', default=None)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the endpoint's breaker is open."""
+
+
+class OutboundLimitError(Exception):
+    """
+    Raised when no outbound call slot frees up in time. Lookups fall back to
+    text straight away, but the fallback is not cached: a momentary shortage
+    of slots says nothing about the upstream's health.
+    """
+
+
+class OutboundLimiter:
+    """
+    Bounds the upstream calls in flight in this worker (0 = unbounded), shared
+    by the sync and async clients. Callers wait up to wait_timeout seconds for
+    a slot: threads on a condition, coroutines on a future that a released
+    slot is handed to, so the event loop is never blocked.
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT_CALLS, wait_timeout=DEFAULT_CALL_WAIT_TIMEOUT):
+        self._condition = threading.Condition()
+        # (loop, future) of each coroutine waiting for a slot, in arrival order
+        self._waiters = collections.deque()
+        self.in_flight = 0
+        self.configure(max_concurrent, wait_timeout)
+
+    def configure(self, max_concurrent=DEFAULT_MAX_CONCURRENT_CALLS, wait_timeout=DEFAULT_CALL_WAIT_TIMEOUT):
+        """Calls already in flight keep their slots and count against the new limit."""
+        with self._condition:
+            self.max_concurrent = max_concurrent
+            self.wait_timeout = wait_timeout
+            self.rejected = 0
+            self._hand_off()
+            self._condition.notify_all()
+
+    def _has_slot(self):
+        return self.max_concurrent <= 0 or self.in_flight < self.max_concurrent
+
+    def _hand_off(self):
+        # Called holding the condition: gives free slots to waiting coroutines first
+        while self._waiters and self._has_slot():
+            loop, future = self._waiters.popleft()
+            if future.done():
+                continue
+            try:
+                loop.call_soon_threadsafe(self._grant, future)
+            except RuntimeError:
+                # The waiter's loop is closed
+                continue
+            self.in_flight += 1
+
+    def _grant(self, future):
+        # On the waiter's loop; a waiter that timed out or was cancelled meanwhile passes the slot on
+        if future.done():
+            self._release()
+        else:
+            future.set_result(None)
+
+    def _release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._hand_off()
+            if self._has_slot():
+                self._condition.notify()
+            in_flight = self.in_flight
+        observe_outbound_in_flight(in_flight)
+
+    def _reject(self, endpoint):
+        with self._condition:
+            self.rejected += 1
+        observe_outbound_rejected(endpoint)
+        raise OutboundLimitError(
+            f"No outbound slot for {endpoint} within {self.wait_timeout}s ({self.max_concurrent} calls in flight)"
+        )
+
+    @contextmanager
+    def slot(self, endpoint):
+        """
+        Holds one slot for the enclosed call.
+
+        Raises:
+            OutboundLimitError: If no slot frees up within wait_timeout.
+        """
+        with self._condition:
+            admitted = self._condition.wait_for(self._has_slot, self.wait_timeout)
+            if admitted:
+                self.in_flight += 1
+                in_flight = self.in_flight
+        if not admitted:
+            self._reject(endpoint)
+        observe_outbound_in_flight(in_flight)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def slot_async(self, endpoint):
+        """slot for coroutines."""
+        future = None
+        with self._condition:
+            if self._has_slot() and not self._waiters:
+                self.in_flight += 1
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._waiters.append((asyncio.get_running_loop(), future))
+            in_flight = self.in_flight
+        if future is not None:
+            try:
+                await asyncio.wait_for(future, self.wait_timeout)
+            except asyncio.TimeoutError:
+                self._reject(endpoint)
+            except asyncio.CancelledError:
+                # Cancelled after the slot was handed over but before it was taken
+                if future.done() and not future.cancelled():
+                    self._release()
+                raise
+            with self._condition:
+                in_flight = self.in_flight
+        observe_outbound_in_flight(in_flight)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'in_flight': self.in_flight,
+                'rejected': self.rejected,
+            }
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one upstream endpoint."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Admits or rejects a call.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or half-open with a probe already running.
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return
+            if self.state == STATE_OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"Circuit open for {self.name}")
+                self.state = STATE_HALF_OPEN
+                logger.info(f"Circuit half-open for {self.name}, probing")
+            if self._probe_in_flight:
+                raise CircuitOpenError(f"Circuit half-open for {self.name}, probe in flight")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                logger.info(f"Circuit closed for {self.name}")
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self._probe_in_flight = False
+            if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    logger.warning(f"Circuit opened for {self.name} after {self.failures} failures: {error}")
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Ends an admitted call that was abandoned (e.g. cancelled) without an outcome."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self):
+        """Returns the breaker state as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'open_for_seconds': round(time.monotonic() - self.opened_at, 3) if self.opened_at else None,
+                'last_error': self.last_error,
+            }
+
+
+class TerminologyHTTPClient:
+    """Pooled requests.Session plus a circuit breaker per endpoint name."""
+
+    def __init__(self, pool_size=10, timeout=5, failure_threshold=5, reset_timeout=30,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT_CALLS, wait_timeout=DEFAULT_CALL_WAIT_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.limiter = OutboundLimiter(max_concurrent, wait_timeout)
+        self._breakers = {}
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, pool_size=10, timeout=5, failure_threshold=5, reset_timeout=30,
+                  max_concurrent=DEFAULT_MAX_CONCURRENT_CALLS, wait_timeout=DEFAULT_CALL_WAIT_TIMEOUT):
+        """Applies new settings; the connection pool, breakers and outbound limit are rebuilt."""
+        with self._lock:
+            self.pool_size = pool_size
+            self.timeout = timeout
+            self.failure_threshold = failure_threshold
+            self.reset_timeout = reset_timeout
+            self.limiter.configure(max_concurrent, wait_timeout)
+            self._breakers = {}
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        """Returns the worker's session, recreating it after a fork."""
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+                self._session_pid = os.getpid()
+            return self._session
+
+    def breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout)
+                self._breakers[endpoint] = breaker
+            return breaker
+
+    def get(self, endpoint, url, params=None):
+        """
+        GET through the shared pool, guarded by the endpoint's breaker and
+        holding one of the worker's outbound slots.
+
+        Connection errors, timeouts, 429 and 5xx responses count as failures.
+
+        Args:
+            endpoint (str): Breaker name, e.g. "icd10", "loinc", "rxnorm".
+            url (str): Request URL.
+            params (dict): Query parameters.
+
+        Returns:
+            requests.Response
+
+        Raises:
+            CircuitOpenError: If the breaker rejects the call.
+            OutboundLimitError: If no outbound slot frees up in time.
+            requests.RequestException: If the request itself fails.
+        """
+        with tracer.span('terminology.http', endpoint=endpoint) as span:
+            breaker = self.breaker(endpoint)
+            breaker.before_call()
+            try:
+                with self.limiter.slot(endpoint):
+                    response = self._get_session().get(url, params=params, timeout=self.timeout)
+            except OutboundLimitError:
+                breaker.release()
+                raise
+            except Exception as e:
+                breaker.record_failure(e)
+                raise
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code == 429 or response.status_code >= 500:
+                breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                breaker.record_success()
+            return response
+
+    def breaker_states(self):
+        """Returns {endpoint: breaker snapshot} for every endpoint called so far."""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+class _AsyncSession:
+    """A session's httpx.AsyncClient, created by the first call that needs it."""
+
+    # Loading the CA bundle into a new SSL context costs tens of milliseconds; share one
+    _ssl_context = None
+
+    def __init__(self, limits, timeout):
+        self._limits = limits
+        self._timeout = timeout
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            if _AsyncSession._ssl_context is None:
+                _AsyncSession._ssl_context = httpx.create_ssl_context()
+            self._client = httpx.AsyncClient(limits=self._limits, timeout=self._timeout,
+                                             verify=_AsyncSession._ssl_context)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class AsyncTerminologyHTTPClient:
+    """httpx.AsyncClient per session, guarded by a TerminologyHTTPClient's breakers."""
+
+    def __init__(self, sync_client):
+        self.sync_client = sync_client
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        Shares one connection pool between the calls made inside the block,
+        including tasks it starts, and closes it on exit. Nested sessions use
+        the outermost one's pool. The pool is only opened once a call needs
+        it, so a block whose lookups all hit the caches costs nothing.
+        """
+        session = _async_session.get()
+        if session is not None:
+            yield session
+            return
+        if httpx is None:
+            raise RuntimeError("Async terminology lookups require the httpx package")
+        limits = httpx.Limits(
+            max_connections=self.sync_client.pool_size,
+            max_keepalive_connections=self.sync_client.pool_size
+        )
+        session = _AsyncSession(limits, self.sync_client.timeout)
+        token = _async_session.set(session)
+        try:
+            yield session
+        finally:
+            _async_session.reset(token)
+            await session.aclose()
+
+    async def get(self, endpoint, url, params=None):
+        """
+        Async TerminologyHTTPClient.get, on the current session's pool (or a
+        pool of its own outside a session).
+
+        Returns:
+            httpx.Response
+
+        Raises:
+            CircuitOpenError: If the breaker rejects the call.
+            OutboundLimitError: If no outbound slot frees up in time.
+            httpx.HTTPError: If the request itself fails.
+        """
+        with tracer.span('terminology.http', endpoint=endpoint) as span:
+            breaker = self.sync_client.breaker(endpoint)
+            breaker.before_call()
+            try:
+                async with self.sync_client.limiter.slot_async(endpoint), self.session() as session:
+                    response = await session.client().get(url, params=params)
+            except (asyncio.CancelledError, OutboundLimitError):
+                breaker.release()
+                raise
+            except Exception as e:
+                breaker.record_failure(e)
+                raise
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code == 429 or response.status_code >= 500:
+                breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                breaker.record_success()
+            return response
@@ -0,0 +1,403 @@
+"""
+Offline ICD-10-CM / LOINC / RxNorm lookup index.
+
+Builds compact, memory-mapped token/prefix indexes from the public release
+files so terminology lookups can be answered locally, without calling the NLM
+APIs. Building is a separate step:
+
+    python terminology_index.py build --out /var/lib/terminology \
+        --icd10 icd10cm_codes_2025.txt --loinc Loinc.csv --rxnorm RXNCONSO.RRF
+
+At runtime every gunicorn worker maps the same read-only files, so the OS
+page cache holds one shared copy of each index.
+
+Index file layout (little-endian):
+    header:   magic, record_count, token_count, section offsets
+    records:  "code\\x1fdisplay" UTF-8 strings + uint32 offset table,
+              ordered by rank (most general match first, see RANK_KEYS)
+    tokens:   sorted lowercase tokens + uint32 offset table
+    postings: uint32 record ids per token (ascending) + uint32 offset table
+"""
+
+import argparse
+import bisect
+import csv
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+
+logger = logging.getLogger(__name__)
+
+CODE_SYSTEMS = {
+    "icd10": "http://hl7.org/fhir/sid/icd-10-cm",
+    "loinc": "http://loinc.org",
+    "rxnorm": "http://www.nlm.nih.gov/research/umls/rxnorm",
+}
+
+# RxNorm term types that drugs.json returns concepts for
+RXNORM_TERM_TYPES = {"SCD", "SBD", "GPCK", "BPCK"}
+
+# Query tokens expanding to more index tokens than this are too generic to narrow the search
+MAX_PREFIX_EXPANSION = 512
+
+_MAGIC = b"FHIRTIX1"
+_HEADER = struct.Struct("<8sII6Q")
+_SEPARATOR = "\x1f"
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase alphanumeric tokens of a term."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def index_path(index_dir, code_system):
+    return os.path.join(index_dir, f"{code_system}.idx")
+
+
+# ---------------------------------------------------------------------------
+# Release file readers: each yields (code, display) pairs
+# ---------------------------------------------------------------------------
+
+def read_icd10cm(path):
+    """icd10cm_codes_YYYY.txt: code (no dot), whitespace, description."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split(None, 1)
+            if len(parts) != 2:
+                continue
+            code, display = parts
+            if len(code) > 3:
+                code = f"{code[:3]}.{code[3:]}"
+            yield code, display.strip()
+
+
+def read_loinc(path):
+    """Loinc.csv from the LOINC table release; deprecated terms are skipped."""
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            if row.get("STATUS") == "DEPRECATED":
+                continue
+            display = row.get("LONG_COMMON_NAME") or row.get("COMPONENT")
+            if row.get("LOINC_NUM") and display:
+                yield row["LOINC_NUM"], display
+
+
+def read_rxnorm(path):
+    """RXNCONSO.RRF from the RxNorm full release (pipe-delimited)."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.split("|")
+            if len(fields) < 17:
+                continue
+            # RXCUI|LAT|TS|LUI|STT|SUI|ISPREF|RXAUI|SAUI|SCUI|SDUI|SAB|TTY|CODE|STR|SRL|SUPPRESS|CVF
+            if fields[11] != "RXNORM" or fields[12] not in RXNORM_TERM_TYPES or fields[16] not in ("", "N"):
+                continue
+            yield fields[0], fields[14]
+
+
+READERS = {
+    "icd10": read_icd10cm,
+    "loinc": read_loinc,
+    "rxnorm": read_rxnorm,
+}
+
+# Record ordering; the lowest-ranked record matching a query wins.
+# ICD-10 codes are ranked by specificity (I10 before I15.0), the others by display length.
+RANK_KEYS = {
+    "icd10": lambda code, display: (len(code), code),
+    "loinc": lambda code, display: (len(display), code),
+    "rxnorm": lambda code, display: (len(display), code),
+}
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def _pack_strings(strings):
+    blob = bytearray()
+    offsets = [0]
+    for s in strings:
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+    return bytes(blob), struct.pack(f"<{len(offsets)}I", *offsets)
+
+
+def build_index(records, out_path, rank_key=None):
+    """
+    Writes an index file for one code system.
+
+    Args:
+        records (iterable): (code, display) pairs.
+        out_path (str): Destination file; written atomically.
+        rank_key (callable): (code, display) -> sort key; defaults to display length.
+
+    Returns:
+        int: Number of records indexed.
+    """
+    rank_key = rank_key or RANK_KEYS["loinc"]
+    unique = {}
+    for code, display in records:
+        unique.setdefault(code, display)
+    ranked = sorted(unique.items(), key=lambda item: rank_key(*item))
+
+    postings = {}
+    for record_id, (_, display) in enumerate(ranked):
+        for token in set(tokenize(display)):
+            postings.setdefault(token, []).append(record_id)
+    tokens = sorted(postings)
+
+    record_blob, record_offsets = _pack_strings(f"{code}{_SEPARATOR}{display}" for code, display in ranked)
+    token_blob, token_offsets = _pack_strings(tokens)
+    posting_ids = []
+    posting_offsets = [0]
+    for token in tokens:
+        posting_ids.extend(postings[token])
+        posting_offsets.append(len(posting_ids))
+    posting_blob = struct.pack(f"<{len(posting_ids)}I", *posting_ids)
+    posting_offset_blob = struct.pack(f"<{len(posting_offsets)}I", *posting_offsets)
+
+    sections = [record_blob, record_offsets, token_blob, token_offsets, posting_blob, posting_offset_blob]
+    # Keep the uint32 tables 4-byte aligned so they can be cast in place
+    padded = []
+    position = _HEADER.size
+    starts = []
+    for section in sections:
+        padding = -position % 4
+        padded.append(b"\0" * padding + section)
+        position += padding
+        starts.append(position)
+        position += len(section)
+
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(ranked), len(tokens), *starts))
+        for section in padded:
+            f.write(section)
+    os.replace(tmp_path, out_path)
+    return len(ranked)
+
+
+# ---------------------------------------------------------------------------
+# Lookup
+# ---------------------------------------------------------------------------
+
+class TerminologyIndex:
+    """Read-only, memory-mapped index for one code system."""
+
+    def __init__(self, path):
+        """
+        Raises:
+            ValueError: If the file is not an index, or is truncated or corrupt.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                raise ValueError(f"Truncated terminology index: {path}")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        try:
+            self._map_sections()
+        except ValueError:
+            self.close()
+            raise
+
+    def _map_sections(self):
+        magic, self.record_count, self.token_count, *starts = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"Not a terminology index: {self.path}")
+        rec_blob, rec_off, tok_blob, tok_off, post_blob, post_off = starts
+        size = len(self._mm)
+        # Each section must fit between its start and the next section's
+        if not (_HEADER.size <= rec_blob <= rec_off <= tok_blob <= tok_off <= post_blob <= post_off <= size
+                and 4 * (self.record_count + 1) <= tok_blob - rec_off
+                and 4 * (self.token_count + 1) <= post_blob - tok_off
+                and (post_off - post_blob) % 4 == 0
+                and 4 * (self.token_count + 1) <= size - post_off):
+            raise ValueError(f"Truncated or corrupt terminology index: {self.path}")
+
+        self._records = self._view(rec_blob, rec_off)
+        self._record_offsets = self._uint32s(rec_off, rec_off + 4 * (self.record_count + 1))
+        self._tokens = self._view(tok_blob, tok_off)
+        self._token_offsets = self._uint32s(tok_off, tok_off + 4 * (self.token_count + 1))
+        self._token_keys = _TokenSequence(self._tokens, self._token_offsets)
+        self._postings = self._uint32s(post_blob, post_off)
+        self._posting_offsets = self._uint32s(post_off, post_off + 4 * (self.token_count + 1))
+
+        if (self._record_offsets[-1] > len(self._records) or self._token_offsets[-1] > len(self._tokens)
+                or self._posting_offsets[-1] > len(self._postings)):
+            raise ValueError(f"Truncated or corrupt terminology index: {self.path}")
+
+    def _view(self, start, end):
+        view = memoryview(self._mm)[start:end]
+        self._views.append(view)
+        return view
+
+    def _uint32s(self, start, end):
+        """The little-endian uint32 table between start and end, cast in place on little-endian hosts."""
+        view = self._view(start, end)
+        if sys.byteorder != "little":
+            return _LittleEndianUInt32s(view)
+        table = view.cast("I")
+        self._views.append(table)
+        return table
+
+    def __len__(self):
+        return self.record_count
+
+    def record(self, record_id):
+        """Returns (code, display) for a record id."""
+        raw = bytes(self._records[self._record_offsets[record_id]:self._record_offsets[record_id + 1]])
+        code, display = raw.decode("utf-8").split(_SEPARATOR, 1)
+        return code, display
+
+    def _prefix_range(self, prefix):
+        encoded = prefix.encode("utf-8")
+        start = bisect.bisect_left(self._token_keys, encoded)
+        end = bisect.bisect_left(self._token_keys, encoded + b"\xff", lo=start)
+        return start, end
+
+    def _postings_for(self, start, end):
+        ids = set()
+        for token_id in range(start, end):
+            ids.update(self._postings[self._posting_offsets[token_id]:self._posting_offsets[token_id + 1]])
+        return ids
+
+    def search(self, text):
+        """
+        Finds the best record whose display words start with every query word.
+
+        Returns:
+            tuple: (code, display) of the highest-ranked match, or None.
+        """
+        query_tokens = set(tokenize(text))
+        if not query_tokens:
+            return None
+
+        ranges = []
+        for token in query_tokens:
+            start, end = self._prefix_range(token)
+            if start == end:
+                return None
+            size = self._posting_offsets[end] - self._posting_offsets[start]
+            ranges.append((size, end - start, start, end))
+        ranges.sort()
+
+        candidates = None
+        for _, width, start, end in ranges:
+            if width > MAX_PREFIX_EXPANSION and candidates is not None:
+                continue
+            ids = self._postings_for(start, end)
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return None
+        return self.record(min(candidates))
+
+    def close(self):
+        # Casts first: a view cannot be released while views derived from it exist
+        for view in reversed(self._views):
+            view.release()
+        self._mm.close()
+
+
+class _LittleEndianUInt32s:
+    """Read-only little-endian uint32 table over a buffer, for big-endian hosts."""
+
+    _ITEM = struct.Struct("<I")
+
+    def __init__(self, view):
+        self._view = view
+        self._length = len(view) // 4
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._length)
+            if step != 1:
+                raise ValueError("Only contiguous slices are supported")
+            return struct.unpack_from(f"<{max(stop - start, 0)}I", self._view, 4 * start)
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("uint32 table index out of range")
+        return self._ITEM.unpack_from(self._view, 4 * i)[0]
+
+
+class _TokenSequence:
+    """Sequence view over the sorted token table, for bisect."""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]])
+
+
+def load_indexes(index_dir):
+    """
+    Opens every available index in a directory.
+
+    Returns:
+        dict: code system name -> TerminologyIndex (missing and corrupt files are skipped).
+    """
+    indexes = {}
+    for code_system in CODE_SYSTEMS:
+        path = index_path(index_dir, code_system)
+        if os.path.exists(path):
+            try:
+                indexes[code_system] = TerminologyIndex(path)
+            except ValueError as e:
+                logger.error(f"Could not load local {code_system} index: {e}")
+        else:
+            logger.warning(f"No local {code_system} index at '{path}'")
+    return indexes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build offline terminology lookup indexes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build indexes from release files")
+    build.add_argument("--out", required=True, help="Directory to write <system>.idx files to")
+    build.add_argument("--icd10", help="ICD-10-CM icd10cm_codes_YYYY.txt")
+    build.add_argument("--loinc", help="LOINC Loinc.csv")
+    build.add_argument("--rxnorm", help="RxNorm RXNCONSO.RRF")
+
+    search = subparsers.add_parser("search", help="Query a built index")
+    search.add_argument("--dir", required=True, help="Index directory")
+    search.add_argument("code_system", choices=sorted(CODE_SYSTEMS))
+    search.add_argument("text")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        os.makedirs(args.out, exist_ok=True)
+        sources = {name: getattr(args, name) for name in READERS if getattr(args, name)}
+        if not sources:
+            parser.error("at least one of --icd10, --loinc, --rxnorm is required")
+        for code_system, source in sources.items():
+            count = build_index(
+                READERS[code_system](source),
+                index_path(args.out, code_system),
+                rank_key=RANK_KEYS[code_system]
+            )
+            print(f"{code_system}: indexed {count} concepts -> {index_path(args.out, code_system)}")
+        return 0
+
+    index = TerminologyIndex(index_path(args.dir, args.code_system))
+    print(index.search(args.text))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
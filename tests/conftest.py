@@ -0,0 +1,27 @@
+import pytest
+
+import terminology
+from benchmarks.stub_nlm_server import StubNLMServer
+from terminology import configure_terminology, terminology_caches
+
+
+def _clear_caches():
+    for cache in terminology_caches.values():
+        cache.clear()
+
+
+@pytest.fixture
+def stub_nlm():
+    """
+    Stub NLM server the terminology lookups are pointed at, with empty caches
+    and fresh breakers; the default endpoints and settings are restored afterwards.
+    """
+    urls = dict(terminology.ENDPOINT_URLS)
+    with StubNLMServer() as server:
+        configure_terminology(server.endpoint_config())
+        _clear_caches()
+        yield server
+    terminology.ENDPOINT_URLS.update(urls)
+    configure_terminology({})
+    _clear_caches()
+
@@ -0,0 +1,116 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from admission import admission_limiter, configure_admission
+from app import create_app
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+from terminology import configure_terminology, http_client, terminology_caches
+from terminology_http import CircuitOpenError
+
+MAX_IN_FLIGHT = 2
+MAX_WAITING = 2
+RETRY_AFTER = 3
+LATENCY = 0.2
+
+
+@pytest.fixture
+def app(stub_nlm):
+    app = create_app("testing")
+    yield app
+    configure_admission({})
+
+
+def _bodies(count):
+    return [
+        {"document_type": "Medical Report", "data": DOCUMENT_GENERATORS["Medical Report"](size=5, seed=i)}
+        for i in range(count)
+    ]
+
+
+def _burst(app, bodies):
+    """Posts every body at once, one test client per thread; returns (status, Retry-After) pairs."""
+    def post(body):
+        response = app.test_client().post("/api/v1/map/document", json=body)
+        return response.status_code, response.headers.get("Retry-After")
+
+    with ThreadPoolExecutor(max_workers=len(bodies)) as pool:
+        return list(pool.map(post, bodies))
+
+
+def test_burst_beyond_the_limit_is_shed_with_429(app, stub_nlm):
+    stub_nlm.latency = LATENCY
+    configure_admission({
+        "ADMISSION_MAX_IN_FLIGHT": MAX_IN_FLIGHT, "ADMISSION_MAX_WAITING": MAX_WAITING,
+        "ADMISSION_WAIT_TIMEOUT": LATENCY / 2, "ADMISSION_RETRY_AFTER": RETRY_AFTER,
+    })
+
+    results = _burst(app, _bodies(12))
+
+    codes = collections.Counter(status for status, _ in results)
+    assert codes[200] and codes[429] and codes[200] + codes[429] == 12
+    assert {retry_after for status, retry_after in results if status == 429} == {str(RETRY_AFTER)}
+    stats = app.test_client().get("/api/v1/terminology/status").get_json()["admission"]
+    assert stats["rejected"] == codes[429]
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+def test_only_mapping_endpoints_are_limited(app):
+    configure_admission({"ADMISSION_MAX_IN_FLIGHT": 1, "ADMISSION_WAIT_TIMEOUT": 0.01})
+    client = app.test_client()
+    body = _bodies(1)[0]
+
+    assert admission_limiter.acquire("main.map_document")
+    try:
+        assert client.post("/api/v1/map/document", json=body).status_code == 429
+        assert client.post("/api/v1/map/document/async", json=body).status_code == 429
+        assert client.get("/api/v1/health").status_code == 200
+        assert client.get("/api/v1/terminology/status").status_code == 200
+    finally:
+        admission_limiter.release()
+    assert client.post("/api/v1/map/document", json=body).status_code == 200
+
+
+def test_lookups_without_an_outbound_slot_fall_back_to_text(app, stub_nlm):
+    stub_nlm.latency = LATENCY
+    http_client.limiter.configure(1, LATENCY / 4)
+    for cache in terminology_caches.values():
+        cache.clear()
+
+    results = _burst(app, _bodies(8))
+
+    assert all(status == 200 for status, _ in results)
+    status = app.test_client().get("/api/v1/terminology/status").get_json()
+    assert status["outbound"]["rejected"] and status["outbound"]["in_flight"] == 0
+    assert all(breaker["state"] == "closed" for breaker in status["breakers"].values())
+
+
+def test_shedding_is_exported_as_metrics(app):
+    scrape = app.test_client().get("/api/v1/metrics")
+    if scrape.status_code != 200:
+        pytest.skip("prometheus_client is not installed")
+    text = scrape.get_data(as_text=True)
+    for name in ("fhir_admission_rejected_total", "fhir_admission_in_flight",
+                 "fhir_terminology_outbound_rejected_total", "fhir_terminology_outbound_in_flight"):
+        assert name in text
+
+
+def test_open_breaker_rejects_without_taking_an_outbound_slot(stub_nlm):
+    configure_terminology({
+        **stub_nlm.endpoint_config(),
+        "TERMINOLOGY_BREAKER_FAILURE_THRESHOLD": 1,
+        "TERMINOLOGY_MAX_CONCURRENT_CALLS": 1,
+    })
+    url = stub_nlm.endpoint_config()["TERMINOLOGY_RXNORM_URL"]
+    http_client.breaker("rxnorm").record_failure("down")
+    requests_made = stub_nlm.requests
+
+    with pytest.raises(CircuitOpenError):
+        http_client.get("rxnorm", url, params={"name": "metformin"})
+
+    assert http_client.limiter.snapshot()["in_flight"] == 0
+    assert stub_nlm.requests == requests_made
+    # The one slot is still free for another endpoint
+    assert http_client.get("icd10", stub_nlm.endpoint_config()["TERMINOLOGY_ICD10_URL"],
+                           params={"terms": "fever"}).status_code == 200
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import re
+import time
+
+import pytest
+
+from document_mapper import get_document_mapper
+from terminology import configure_terminology, http_client, prefetch_codes_async, terminology_caches
+from terminology_cache import FailedLookup, TransientFailedLookup
+
+ICD10_SYSTEM = "http://hl7.org/fhir/sid/icd-10-cm"
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+
+DOCUMENTS = {
+    "Medical Report": {
+        "PII": {"Name": "John Doe", "DOB": "1980-05-15", "ID": "PAT_001", "Date": "2025-03-03"},
+        "Disease_disorder": ["Hypertension", "High Fever", "Unknown syndrome"],
+        "Medication": ["Metformin", "Lisinopril", "Unknown drug"],
+        "Dosage": ["500mg"],
+        "Procedure": ["ECG"],
+    },
+    "Lab Report": {
+        "PII": {"Name": "Jane Roe", "ID": "PAT_002", "Date": "2025-01-12"},
+        "Lab_Tests": [
+            {"Name": "Hemoglobin", "Value": "13.5", "Unit": "g/dL"},
+            {"Name": "Glucose", "Value": 110, "Unit": "mg/dL"},
+            {"Name": "Culture", "Value": "No growth"},
+        ],
+    },
+    "Discharge Summary": {
+        "PII": {"Name": "Sam Poe", "ID": "PAT_003", "Admission_Date": "2025-01-02", "Discharge_Date": "2025-01-09"},
+        "Diagnosis": ["Pneumonia", "Asthma"],
+        "Outcome": "Recovered",
+    },
+    "Admission Slip": {
+        "PII": {"Name": "Ann Lee", "ID": "PAT_004", "Date": "2025-02-14"},
+        "Admission_Reason": "Chest pain, Hypertension",
+        "Department": "Cardiology",
+    },
+}
+
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def _normalized(bundle_json):
+    return _UUID.sub("<uuid>", bundle_json)
+
+
+def _clear_caches():
+    for cache in terminology_caches.values():
+        cache.clear()
+
+
+@pytest.mark.parametrize("document_type", list(DOCUMENTS))
+def test_map_to_fhir_async_matches_sync(stub_nlm, document_type):
+    mapper = get_document_mapper(document_type)
+    expected = mapper.map_to_fhir(json.loads(json.dumps(DOCUMENTS[document_type])))
+    _clear_caches()
+
+    actual = asyncio.run(mapper.map_to_fhir_async(json.loads(json.dumps(DOCUMENTS[document_type]))))
+
+    assert _normalized(actual) == _normalized(expected)
+
+
+def test_prefetch_codes_async_resolves_each_term_once(stub_nlm):
+    terms = [("icd10", "Hypertension"), ("rxnorm", "Metformin"), ("rxnorm", "Metformin"), ("loinc", "Unlisted panel")]
+
+    resolved = asyncio.run(prefetch_codes_async(terms))
+
+    assert set(resolved) == {("icd10", "Hypertension"), ("rxnorm", "Metformin"), ("loinc", "Unlisted panel")}
+    assert resolved[("icd10", "Hypertension")]["coding"][0]["code"] == "I10"
+    assert resolved[("rxnorm", "Metformin")]["coding"][0] == {
+        "system": RXNORM_SYSTEM, "code": "860975", "display": "metformin hydrochloride 500 MG Oral Tablet"
+    }
+    assert resolved[("loinc", "Unlisted panel")] == {"text": "Unlisted panel"}
+    assert stub_nlm.requests == 3
+
+
+def test_prefetch_codes_async_without_terms_makes_no_calls(stub_nlm):
+    assert asyncio.run(prefetch_codes_async([("icd10", ""), ("rxnorm", None)])) == {}
+    assert stub_nlm.requests == 0
+
+
+def test_map_document_async_route(stub_nlm):
+    from app import create_app
+
+    client = create_app("testing").test_client()
+    response = client.post("/api/v1/map/document/async", json={
+        "document_type": "Medical Report", "data": DOCUMENTS["Medical Report"]
+    })
+
+    assert response.status_code == 200
+    entries = response.get_json()["entry"]
+    codings = [
+        coding for entry in entries if entry["resource"]["resourceType"] == "Condition"
+        for coding in entry["resource"]["code"].get("coding", [])
+    ]
+    assert {"system": ICD10_SYSTEM, "code": "I10", "display": "Essential (primary) hypertension"} in codings
+
+
+def test_open_breaker_falls_back_without_waiting_for_a_slot(stub_nlm):
+    configure_terminology({
+        **stub_nlm.endpoint_config(),
+        "TERMINOLOGY_BREAKER_FAILURE_THRESHOLD": 1,
+        "TERMINOLOGY_MAX_CONCURRENT_CALLS": 1,
+        "TERMINOLOGY_CALL_WAIT_TIMEOUT": 5,
+    })
+    stub_nlm.fail_status = 503
+
+    failed = asyncio.run(prefetch_codes_async([("rxnorm", "Metformin")]))
+    assert isinstance(failed[("rxnorm", "Metformin")], FailedLookup)
+    assert http_client.breaker_states()["rxnorm"]["state"] == "open"
+    requests_made = stub_nlm.requests
+
+    # Every outbound slot is taken, but the open breaker rejects the call first
+    with http_client.limiter.slot("test"):
+        start = time.perf_counter()
+        resolved = asyncio.run(prefetch_codes_async([("rxnorm", "Lisinopril")]))
+        elapsed = time.perf_counter() - start
+
+    assert resolved[("rxnorm", "Lisinopril")] == {"text": "Lisinopril"}
+    assert isinstance(resolved[("rxnorm", "Lisinopril")], FailedLookup)
+    assert elapsed < 1
+    assert stub_nlm.requests == requests_made
+
+
+def test_outbound_limit_rejection_falls_back_without_caching(stub_nlm):
+    configure_terminology({
+        **stub_nlm.endpoint_config(),
+        "TERMINOLOGY_MAX_CONCURRENT_CALLS": 1,
+        "TERMINOLOGY_CALL_WAIT_TIMEOUT": 0.05,
+    })
+    stub_nlm.latency = 0.3
+
+    resolved = asyncio.run(prefetch_codes_async([("rxnorm", "Metformin"), ("rxnorm", "Lisinopril")]))
+
+    shed = [term for term, concept in resolved.items() if isinstance(concept, TransientFailedLookup)]
+    assert len(shed) == 1
+    assert http_client.limiter.snapshot()["rejected"] == 1
+    assert http_client.limiter.snapshot()["in_flight"] == 0
+    # A shed call says nothing about the upstream: the breaker stays closed and
+    # the next lookup of the term goes upstream again
+    assert http_client.breaker_states()["rxnorm"]["state"] == "closed"
+    stub_nlm.latency = 0
+    retried = asyncio.run(prefetch_codes_async(shed))
+    assert retried[shed[0]]["coding"][0]["system"] == RXNORM_SYSTEM
@@ -0,0 +1,65 @@
+import copy
+
+import pytest
+
+from app import create_app
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+from document_mapper import BUILD_MODES, get_document_mapper
+
+NON_STRINGS = [{"a": 1}, 42, 4.5, True, ["x"]]
+
+
+def _map_both(document_type, data):
+    """{build_mode: Bundle JSON or the exception raised} for one document."""
+    outputs = {}
+    for build_mode in BUILD_MODES:
+        mapper = get_document_mapper(document_type, build_mode, deterministic_ids=True)
+        try:
+            outputs[build_mode] = mapper.map_to_fhir(copy.deepcopy(data))
+        except Exception as e:
+            outputs[build_mode] = e
+    return outputs
+
+
+def _bad_documents(value):
+    """(document_type, document) with value in place of one term, for each kind of term."""
+    def replaced(document_type, path):
+        data = DOCUMENT_GENERATORS[document_type](size=2, seed=1)
+        target = data
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = value
+        return document_type, data
+
+    return [
+        replaced("Medical Report", ("Disease_disorder", 0)),
+        replaced("Medical Report", ("Medication", 0)),
+        replaced("Medical Report", ("Dosage", 0)),
+        replaced("Medical Report", ("Procedure", 0)),
+        replaced("Lab Report", ("Lab_Tests", 0, "Name")),
+        replaced("Discharge Summary", ("Diagnosis", 0)),
+    ]
+
+
+@pytest.mark.parametrize("document_type", list(DOCUMENT_GENERATORS))
+def test_build_modes_give_byte_identical_bundles(stub_nlm, document_type):
+    for seed in range(5):
+        outputs = _map_both(document_type, DOCUMENT_GENERATORS[document_type](size=1 + seed, seed=seed))
+        assert isinstance(outputs["model"], str)
+        assert outputs["model"] == outputs["dict"]
+
+
+@pytest.mark.parametrize("value", NON_STRINGS, ids=repr)
+def test_build_modes_reject_non_string_terms_alike(stub_nlm, value):
+    for document_type, data in _bad_documents(value):
+        outputs = _map_both(document_type, data)
+        errors = {build_mode: (type(output), str(output)) for build_mode, output in outputs.items()}
+        assert errors["model"] == errors["dict"] == (ValueError, f"Invalid FHIR string: {type(value).__name__} value")
+
+
+def test_non_string_term_is_a_bad_request(stub_nlm):
+    document_type, data = _bad_documents({"a": 1})[0]
+    response = create_app("testing").test_client().post(
+        "/api/v1/map/document", json={"document_type": document_type, "data": data}
+    )
+    assert response.status_code == 400
@@ -0,0 +1,96 @@
+import logging
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from date_normalizer import DATE_FORMATS, configure_date_normalizer, normalize_date
+
+
+def reference_normalize_date(date_str, hint=None):
+    """DocumentMapper._normalize_date before the compiled normalizer (a hint is tried first)."""
+    if not date_str:
+        return None
+    if len(date_str) >= 10 and date_str[4] == "-" and date_str[7] == "-":
+        if "T" in date_str:
+            return date_str.split("T")[0]
+        return date_str[:10]
+    cleaned_date = date_str.strip().replace(" ,", ",").replace(", ", ", ")
+    formats = DATE_FORMATS if hint is None else (hint,) + tuple(fmt for fmt in DATE_FORMATS if fmt != hint)
+    for fmt in formats:
+        try:
+            dt = datetime.strptime(cleaned_date, fmt)
+            return dt.strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+EXTRA_FORMATS = [
+    "%d.%m.%Y", "%Y%m%d", "%d %b %Y", "%b %d %Y", "%A, %B %d, %Y", "%m-%d-%y", "%d/%m/%y",
+    "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%B %Y", "%Y",
+]
+
+ODD_STRINGS = [
+    "", " ", "TKN_DATE_1", "tkn-dob", "not a date", "N/A", "0000-00-00", "2025-13-45", "2025-1-5",
+    "2025/1/5", "1/5/2025", "31/02/2025", "02/31/2025", "13/13/2025", " 5/ 6/2025", "5 /6/2025",
+    "December  27 ,  2025", "december 27, 2025", "DEC 27, 2025", "Dec. 27, 2025", "Sept 3, 2025",
+    "27 dec 2025", "27\tDecember\t2025", "١٢/٠٣/٢٠٢٥",
+    "2025-02-30", "2025-02-3x", "12345678901", "xxxx-xx-xx", "2025-01-01Tfoo", "  2025-01-01",
+    "March 3,2025", "March 3 ,2025", "3 March, 2025", "2025/02/29", "2024/02/29", "1/1/0001",
+    "1/1/0000", "01-01-999", "9999/12/31", "May  5 2025", "May 5  2025",
+]
+
+
+def corpus(size, seed=7):
+    rng = random.Random(seed)
+    start = date(1900, 1, 1)
+    values = list(ODD_STRINGS)
+    formats = list(DATE_FORMATS) + EXTRA_FORMATS
+    for _ in range(size):
+        d = start + timedelta(days=rng.randint(0, 60000))
+        value = datetime(d.year, d.month, d.day, rng.randint(0, 23), rng.randint(0, 59)).strftime(rng.choice(formats))
+        mutation = rng.random()
+        if mutation < 0.05:
+            value = value.upper()
+        elif mutation < 0.1:
+            value = f"  {value} "
+        elif mutation < 0.13:
+            value = value.replace("0", "", 1)
+        elif mutation < 0.15:
+            value = value.replace(",", " ,")
+        values.append(value)
+    return values
+
+
+VALUES = corpus(size=2000)
+
+
+@pytest.mark.parametrize("hint", (None,) + DATE_FORMATS + tuple(EXTRA_FORMATS))
+def test_matches_the_strptime_loop(hint):
+    expected = [reference_normalize_date(value, hint) for value in VALUES]
+    assert [normalize_date(value, hint) for value in VALUES] == expected
+
+
+def test_large_corpus_matches_the_strptime_loop():
+    values = corpus(size=20000, seed=11)
+    mismatches = [value for value in values if normalize_date(value) != reference_normalize_date(value)]
+    assert not mismatches
+
+
+@pytest.mark.parametrize("value", ODD_STRINGS)
+def test_odd_strings_match_the_strptime_loop(value):
+    assert normalize_date(value) == reference_normalize_date(value)
+
+
+def test_hint_with_unsupported_directives_falls_back_to_strptime(caplog):
+    with caplog.at_level(logging.WARNING):
+        configure_date_normalizer({"DATE_FORMAT_HINTS": {"Lab Report": "%d.%m.%y"}})
+    assert "%y" in caplog.text
+    assert normalize_date("27.12.25", "%d.%m.%y") == "2025-12-27"
+
+
+@pytest.mark.parametrize("hints", [["%m/%d/%Y"], {"Lab Report": None}])
+def test_malformed_hints_are_rejected(hints):
+    with pytest.raises(ValueError):
+        configure_date_normalizer({"DATE_FORMAT_HINTS": hints})
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+import harmonization_service
+from benchmarks.bench_parallel_harmonize import roster_bundle
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+from document_mapper import get_document_mapper
+from harmonization_service import HARMONIZE_MODES, HARMONIZED_TAG, HarmonizationService, configure_harmonization
+
+ROSTER_ENTRIES = 250
+# Uneven chunks, so the last one is short
+PARALLEL_SETTINGS = {
+    "HARMONIZE_PARALLEL_WORKERS": 2, "HARMONIZE_PARALLEL_THRESHOLD": 100, "HARMONIZE_PARALLEL_CHUNK_SIZE": 37,
+}
+
+
+def _mapped_bundles():
+    return [
+        get_document_mapper(document_type, deterministic_ids=True).map_to_fhir(generate(size=3, seed=seed))
+        for seed, (document_type, generate) in enumerate(DOCUMENT_GENERATORS.items())
+    ]
+
+
+def _patients(bundle_json):
+    return [
+        entry["resource"] for entry in json.loads(bundle_json)["entry"]
+        if entry["resource"]["resourceType"] == "Patient"
+    ]
+
+
+def test_fast_mode_output_equals_validate_mode_output(stub_nlm):
+    for bundle in _mapped_bundles():
+        fast = HarmonizationService.harmonize_bundle(bundle, mode="fast")
+        assert fast == HarmonizationService.harmonize_bundle(bundle, mode="validate")
+        assert fast == HarmonizationService.harmonize_bundle(bundle, mode="fast", validate=True)
+
+
+def test_modes_agree_on_patients_with_existing_meta():
+    bundle = json.dumps({"resourceType": "Bundle", "type": "collection", "entry": [
+        {"resource": {"resourceType": "Patient", "id": "a", "meta": {"versionId": "2"}, "name": [{"family": "doe"}]}},
+        {"resource": {"resourceType": "Patient", "id": "b", "meta": {"tag": [{"code": "other"}]}}},
+        {"resource": {"resourceType": "Patient", "name": [{"given": ["jane", "q"]}]}},
+    ]})
+    fast, validate = (HarmonizationService.harmonize_bundle(bundle, mode=mode) for mode in ("fast", "validate"))
+    assert fast == validate
+    assert [patient["meta"]["tag"][-1] for patient in _patients(fast)] == [HARMONIZED_TAG] * 3
+
+
+@pytest.mark.parametrize("mode", HARMONIZE_MODES)
+def test_harmonizing_twice_adds_no_second_tag(stub_nlm, mode):
+    for bundle in _mapped_bundles():
+        once = HarmonizationService.harmonize_bundle(bundle, mode=mode)
+        for second_mode in HARMONIZE_MODES:
+            assert HarmonizationService.harmonize_bundle(once, mode=second_mode) == once
+        for patient in _patients(once):
+            assert patient["meta"]["tag"].count(HARMONIZED_TAG) == 1
+
+
+@pytest.mark.parametrize("mode", HARMONIZE_MODES)
+def test_tagged_patients_are_left_untouched(mode):
+    patient = {"resourceType": "Patient", "id": "p", "meta": {"tag": [{"system": HARMONIZED_TAG["system"],
+                                                                       "code": HARMONIZED_TAG["code"]}]},
+               "name": [{"family": "doe"}]}
+    bundle = {"resourceType": "Bundle", "type": "collection", "entry": [{"resource": patient}]}
+    assert _patients(HarmonizationService.harmonize_bundle(json.dumps(bundle), mode=mode)) == [patient]
+
+
+@pytest.fixture
+def parallel():
+    configure_harmonization(PARALLEL_SETTINGS)
+    yield
+    configure_harmonization({})
+
+
+def test_chunked_harmonization_keeps_entry_order_and_matches_the_serial_path():
+    bundle = roster_bundle(ROSTER_ENTRIES)
+    configure_harmonization({})
+    serial = HarmonizationService.harmonize_bundle(bundle, mode="validate")
+    serial_fast = HarmonizationService.harmonize_bundle(bundle, mode="fast")
+
+    configure_harmonization(PARALLEL_SETTINGS)
+    try:
+        chunked = HarmonizationService.harmonize_bundle(bundle, mode="validate")
+        validated_fast = HarmonizationService.harmonize_bundle(bundle, mode="fast", validate=True)
+        assert harmonization_service._pool is not None
+    finally:
+        configure_harmonization({})
+
+    assert chunked == serial
+    assert validated_fast == serial_fast
+    ids = [entry["resource"]["id"] for entry in json.loads(chunked)["entry"]]
+    assert ids == [entry["resource"]["id"] for entry in json.loads(bundle)["entry"]]
+    assert "urn:uuid:" not in chunked
+
+
+def test_chunked_validation_reports_the_failing_entry(parallel):
+    bundle = json.loads(roster_bundle(ROSTER_ENTRIES))
+    bundle["entry"][200]["resource"]["gender"] = 42
+
+    for mode, options in (("validate", {}), ("fast", {"validate": True})):
+        with pytest.raises(ValueError, match=r"Bundle\.entry\[200\]"):
+            HarmonizationService.harmonize_bundle(json.dumps(bundle), mode=mode, **options)
@@ -0,0 +1,80 @@
+import json
+import logging
+import tracemalloc
+
+import pytest
+
+from app import create_app
+from harmonization_service import HarmonizationService
+
+
+def _write_bundle(path, entries):
+    """Writes a transaction Bundle of Patient and Observation entries, one entry at a time."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"resourceType":"Bundle","type":"transaction","entry":[')
+        for i in range(entries):
+            if i % 10 == 0:
+                resource = {"resourceType": "Patient", "id": f"p{i}", "name": [{"family": f"doe{i}", "given": ["jane", "q"]}]}
+            else:
+                resource = {
+                    "resourceType": "Observation", "id": f"o{i}", "status": "final",
+                    "code": {"text": "Hemoglobin"}, "subject": {"reference": f"Patient/p{i - i % 10}"},
+                    "valueQuantity": {"value": 13.5, "unit": "g/dL"},
+                }
+            entry = {"resource": resource, "request": {"method": "POST", "url": resource["resourceType"]}}
+            f.write(("," if i else "") + json.dumps(entry, separators=(",", ":")))
+        f.write("]}")
+
+
+def _peak_memory(op):
+    tracemalloc.start()
+    try:
+        result = op()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _bundle_with_bad_entry_at_the_end(entries):
+    entry = [
+        {"resource": {"resourceType": "Patient", "id": f"p{i}", "name": [{"family": "doe", "given": ["jane"] * 20}]}}
+        for i in range(entries)
+    ]
+    entry.append({"resource": {"resourceType": "Patient", "gender": 42}})
+    return json.dumps({"resourceType": "Bundle", "type": "collection", "entry": entry})
+
+
+def test_error_before_the_first_chunk_returns_400():
+    client = create_app("testing").test_client()
+    response = client.post("/api/v1/harmonize/stream?validate=true", data=_bundle_with_bad_entry_at_the_end(1))
+    assert response.status_code == 400
+
+
+def test_error_after_the_first_chunk_aborts_the_response(caplog):
+    client = create_app("testing").test_client()
+    response = client.post(
+        "/api/v1/harmonize/stream?validate=true", data=_bundle_with_bad_entry_at_the_end(2000), buffered=False
+    )
+    assert response.status_code == 200
+    with caplog.at_level(logging.ERROR), pytest.raises(ValueError):
+        response.get_data()
+    assert "aborting it" in caplog.text
+
+
+def test_large_bundle_streams_like_fast_mode_in_bounded_memory(tmp_path):
+    path = tmp_path / "bundle.json"
+    _write_bundle(path, 5000)
+    size = path.stat().st_size
+
+    def stream():
+        # Written out as a response would be, without keeping the chunks
+        with open(path, "rb") as f, open(tmp_path / "out.json", "w", encoding="utf-8") as out:
+            for chunk in HarmonizationService.harmonize_bundle_stream(f):
+                out.write(chunk)
+
+    _, stream_peak = _peak_memory(stream)
+    fast, fast_peak = _peak_memory(lambda: HarmonizationService.harmonize_bundle(path.read_text("utf-8"), mode="fast"))
+
+    assert (tmp_path / "out.json").read_text("utf-8") == fast
+    assert fast_peak > size
+    assert stream_peak < size / 2
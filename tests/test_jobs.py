@@ -0,0 +1,218 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+
+from app import create_app
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+from jobs import JobQueue, MemoryJobStore, SQLiteJobStore, configure_jobs, job_queue
+
+
+@pytest.mark.parametrize("hosts, private, url", [
+    ((), True, "https://example.com/hook"),
+    (("example.com",), True, "ftp://example.com/hook"),
+    (("example.com",), True, "https://other.example.com/hook"),
+    (("localhost",), False, "http://localhost:8080/hook"),
+    (("127.0.0.1",), False, "http://127.0.0.1/hook"),
+    (("169.254.169.254",), False, "http://169.254.169.254/latest/meta-data"),
+    (("10.0.0.5",), False, "http://10.0.0.5/hook"),
+])
+def test_callback_url_is_refused(hosts, private, url):
+    queue = JobQueue(MemoryJobStore(), workers=1, callback_hosts=hosts, private_callbacks=private)
+    with pytest.raises(ValueError):
+        queue.check_callback_url(url)
+
+
+def test_callback_url_on_private_network_when_allowed():
+    queue = JobQueue(MemoryJobStore(), workers=1, callback_hosts=("127.0.0.1",), private_callbacks=True)
+    queue.check_callback_url("http://127.0.0.1:8080/hook")
+
+
+class _FailingStore(MemoryJobStore):
+    def __init__(self, fail_on):
+        super().__init__()
+        self.fail_on = fail_on
+        self.saves = 0
+
+    def save(self, job):
+        self.saves += 1
+        if self.saves == self.fail_on:
+            raise OSError("disk full")
+        super().save(job)
+
+
+def test_failed_save_on_submit_releases_the_queue_slot():
+    queue = JobQueue(_FailingStore(fail_on=1), workers=1, max_pending=1)
+    with pytest.raises(OSError):
+        queue.submit("map_document", lambda: "{}")
+    assert queue.depth == 0
+    # The slot is free again for the next job
+    queue.submit("map_document", lambda: "{}")
+
+
+def test_failed_save_while_running_fails_the_job_and_releases_the_slot():
+    store = _FailingStore(fail_on=2)
+    queue = JobQueue(store, workers=1, max_pending=1)
+    job = queue.submit("map_document", lambda: "{}")
+    queue._executor.shutdown(wait=True)
+    assert queue.depth == 0
+    assert store.load(job["id"])["status"] == "failed"
+
+
+def test_submit_reports_the_job_as_queued_even_if_it_already_started():
+    started = threading.Event()
+    release = threading.Event()
+
+    def func():
+        started.set()
+        release.wait(5)
+        return "{}"
+
+    queue = JobQueue(MemoryJobStore(), workers=1)
+    original_submit = ThreadPoolExecutor.submit
+
+    def submit_and_wait(executor, fn, *args):
+        future = original_submit(executor, fn, *args)
+        started.wait(5)
+        return future
+
+    with mock.patch.object(ThreadPoolExecutor, "submit", submit_and_wait):
+        status = queue.submit("map_document", func)
+    release.set()
+    assert status["status"] == "queued"
+    assert status["started_at"] is None
+
+
+def test_sqlite_store_purges_expired_jobs_when_saving(tmp_path, monkeypatch):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"), ttl=0.01)
+    store.save({"id": "old", "result": "{}"})
+    time.sleep(0.02)
+    monkeypatch.setattr(SQLiteJobStore, "PURGE_INTERVAL", 0)
+    store.ttl = 100
+    store.save({"id": "new"})
+    ids = [row[0] for row in store._connect().execute("SELECT id FROM jobs")]
+    assert ids == ["new"]
+
+
+class _CallbackListener:
+    """Collects the jobs POSTed to http://127.0.0.1:<port>/."""
+
+    def __init__(self):
+        received = self.received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def wait_for(self, count, timeout=5):
+        """Waits until count callbacks arrived (they are posted after the job is saved)."""
+        deadline = time.monotonic() + timeout
+        while len(self.received) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def listener():
+    listener = _CallbackListener()
+    yield listener
+    listener.close()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def app(request, stub_nlm, tmp_path):
+    app = create_app("testing")
+    app.config.update(
+        MAPPER_DETERMINISTIC_IDS=True, JOB_STORE=request.param, JOB_STORE_PATH=str(tmp_path / "jobs.sqlite3"),
+        JOB_CALLBACK_ALLOWED_HOSTS=["127.0.0.1"], JOB_CALLBACK_ALLOW_PRIVATE_NETWORKS=True,
+    )
+    configure_jobs(app.config)
+    yield app
+    configure_jobs({})
+
+
+def _documents(count):
+    document_types = list(DOCUMENT_GENERATORS)
+    return [
+        (document_types[i % len(document_types)], DOCUMENT_GENERATORS[document_types[i % len(document_types)]](size=3, seed=i))
+        for i in range(count)
+    ]
+
+
+def _poll(client, result_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get(result_url)
+        if response.status_code != 202:
+            return response
+        time.sleep(0.01)
+    raise TimeoutError(result_url)
+
+
+def test_async_documents_match_the_sync_responses_and_call_back(app, listener):
+    client = app.test_client()
+    documents = _documents(6)
+    submissions = []
+    for document_type, data in documents:
+        response = client.post(
+            "/api/v1/map/document", headers={"Prefer": "respond-async"},
+            json={"document_type": document_type, "data": data, "callback_url": listener.url},
+        )
+        assert response.status_code == 202, response.get_data(as_text=True)
+        assert response.headers["Location"] == response.get_json()["status_url"]
+        submissions.append(response.get_json())
+
+    for (document_type, data), job in zip(documents, submissions):
+        sync_body = client.post("/api/v1/map/document", json={"document_type": document_type, "data": data}).get_data()
+        assert _poll(client, job["result_url"]).get_data() == sync_body
+
+    listener.wait_for(len(documents))
+    assert sorted(job["id"] for job in listener.received) == sorted(job["id"] for job in submissions)
+    assert all(job["result"]["resourceType"] == "Bundle" for job in listener.received)
+    for job in submissions:
+        status = client.get(job["status_url"]).get_json()
+        assert status["status"] == "succeeded" and status["finished_at"] >= status["submitted_at"]
+
+
+def test_async_harmonize_succeeds_or_fails_like_the_sync_endpoint(app):
+    client = app.test_client()
+    document_type, data = _documents(1)[0]
+    bundle = client.post("/api/v1/map/document", json={"document_type": document_type, "data": data}).get_json()
+
+    harmonized = client.post("/api/v1/harmonize?async=true", json=bundle).get_json()
+    failed = client.post("/api/v1/harmonize?async=true", json={"resourceType": "Patient"}).get_json()
+
+    assert _poll(client, harmonized["result_url"]).status_code == 200
+    assert _poll(client, failed["result_url"]).status_code == 400
+    assert client.get("/api/v1/jobs/does-not-exist").status_code == 404
+
+
+def test_full_queue_answers_503(app):
+    release = threading.Event()
+    job_queue.configure(store=job_queue.store, workers=1, max_pending=2)
+    try:
+        for _ in range(2):
+            job_queue.submit("wait", lambda: release.wait(5) and "{}")
+        document_type, data = _documents(1)[0]
+        response = app.test_client().post("/api/v1/map/document?async=true",
+                                          json={"document_type": document_type, "data": data})
+    finally:
+        release.set()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from app import create_app
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+
+
+@pytest.fixture
+def client(stub_nlm):
+    app = create_app("testing")
+    app.config["MAPPER_DETERMINISTIC_IDS"] = True
+    return app.test_client()
+
+
+def _document(document_type, seed):
+    return {"document_type": document_type, "data": DOCUMENT_GENERATORS[document_type](size=3, seed=seed)}
+
+
+def test_bad_lines_get_inline_errors_and_the_rest_still_map(client):
+    good = [_document(document_type, seed) for seed, document_type in enumerate(DOCUMENT_GENERATORS)]
+    non_string_term = _document("Medical Report", 9)
+    non_string_term["data"]["Disease_disorder"][0] = {"a": 1}
+    lines = [
+        json.dumps(good[0]),
+        '{"document_type": "Lab Report", "data": ',
+        json.dumps(good[1]),
+        "[1, 2]",
+        "",
+        json.dumps({"data": good[2]["data"]}),
+        json.dumps({"document_type": "Shopping List", "data": {"PII": {}}}),
+        json.dumps(good[2]),
+        json.dumps(non_string_term),
+        json.dumps(good[3]),
+    ]
+
+    response = client.post("/api/v1/map/documents", data="\n".join(lines), content_type="application/x-ndjson")
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    output = response.get_data(as_text=True).splitlines()
+    # One output line per non-empty input line, in order
+    assert len(output) == len(lines) - 1
+    errors = {line["line"]: line["error"] for line in map(json.loads, output) if "error" in line}
+    assert set(errors) == {2, 4, 6, 7, 9}
+    assert errors[2] == "Invalid JSON"
+    assert errors[4] == "Each line must be a JSON object"
+    assert errors[6] == "Missing document_type field"
+    assert "Shopping List" in errors[7]
+    assert errors[9] == "Invalid FHIR string: dict value"
+
+    bundles = [line for line in output if "error" not in json.loads(line)]
+    expected = [client.post("/api/v1/map/document", json=document).get_data(as_text=True) for document in good]
+    assert bundles == expected
@@ -0,0 +1,36 @@
+import re
+
+import pytest
+
+import metrics
+from app import create_app
+from terminology import get_loinc_code, terminology_caches
+from terminology_cache import TieredCache
+
+
+@pytest.fixture
+def client(stub_nlm):
+    if not metrics.prometheus_client_available:
+        pytest.skip("prometheus_client is not installed")
+    return create_app("testing").test_client()
+
+
+def _gauge(text, name, code_system):
+    match = re.search(rf'^{name}\{{code_system="{code_system}"\}} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1))
+
+
+def test_cache_gauges_are_set_when_scraped_not_per_lookup(client, monkeypatch):
+    stats_calls = []
+    stats = TieredCache.stats
+    monkeypatch.setattr(TieredCache, "stats", lambda cache: stats_calls.append(cache.namespace) or stats(cache))
+
+    for term in ("glucose", "glucose", "hemoglobin", "glucose"):
+        get_loinc_code(term)
+    assert stats_calls == []
+
+    text = client.get("/api/v1/metrics").get_data(as_text=True)
+    assert sorted(stats_calls) == sorted(terminology_caches)
+    assert _gauge(text, "fhir_terminology_cache_entries", "loinc") == 2
+    assert _gauge(text, "fhir_terminology_cache_hit_ratio", "loinc") == 0.5
+    assert 'fhir_terminology_lookup_duration_seconds_count{code_system="loinc",outcome="hit"}' in text
@@ -0,0 +1,87 @@
+import json
+import os
+
+import pytest
+
+from app import create_app
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+from profiling import configure_profiling, request_profiler
+
+
+def _body():
+    return {"document_type": "Lab Report", "data": DOCUMENT_GENERATORS["Lab Report"](size=5, seed=1)}
+
+
+@pytest.fixture
+def app(stub_nlm):
+    app = create_app("testing")
+    app.config["MAPPER_DETERMINISTIC_IDS"] = True
+    yield app
+    configure_profiling({})
+
+
+@pytest.fixture
+def profiling(app, tmp_path):
+    configure_profiling({"PROFILING_ENABLED": True, "PROFILE_DIR": str(tmp_path)})
+    return tmp_path
+
+
+def test_profiler_is_off_by_default(app, tmp_path):
+    assert not request_profiler.enabled
+    assert request_profiler.requested("inline") is None
+    client = app.test_client()
+
+    plain = client.post("/api/v1/map/document", json=_body())
+    profiled = client.post("/api/v1/map/document", headers={"X-Profile": "inline"}, json=_body())
+
+    assert profiled.get_data() == plain.get_data()
+    assert "X-Profile-Id" not in profiled.headers
+
+
+def test_header_values_select_the_output(profiling):
+    assert request_profiler.requested(" Inline ") == "inline"
+    for value in ("1", "true", "yes", "file"):
+        assert request_profiler.requested(value) == "file"
+    assert request_profiler.requested("no") is None
+    assert request_profiler.requested(None) is None
+
+
+def test_inline_profile_wraps_the_unprofiled_result(app, profiling):
+    client = app.test_client()
+    plain = client.post("/api/v1/map/document", json=_body()).get_json()
+
+    inline = client.post("/api/v1/map/document", headers={"X-Profile": "inline"}, json=_body()).get_json()
+
+    assert set(inline) == {"profile", "result"}
+    assert inline["result"] == plain
+    profile = inline["profile"]
+    assert profile["endpoint"] == "map_document" and profile["label"] == "Lab Report"
+    assert profile["error"] is None and profile["top_functions"]
+    # The breakdown accounts for the request's wall time
+    assert sum(profile["breakdown_ms"].values()) == pytest.approx(profile["wall_ms"], rel=0.1)
+    # Inline profiles are not written out
+    assert os.listdir(profiling) == []
+
+
+def test_file_profile_is_written_to_the_profile_dir(app, profiling):
+    client = app.test_client()
+    bundle = client.post("/api/v1/map/document", json=_body()).get_json()
+
+    response = client.post("/api/v1/harmonize", headers={"X-Profile": "1"}, json=bundle)
+
+    assert response.status_code == 200
+    assert response.get_json()["resourceType"] == "Bundle"
+    profile_id = response.headers["X-Profile-Id"]
+    assert sorted(os.listdir(profiling)) == [f"{profile_id}.json", f"{profile_id}.prof"]
+    with open(profiling / f"{profile_id}.json", encoding="utf-8") as f:
+        assert json.load(f)["endpoint"] == "harmonize"
+
+
+def test_disabling_again_ignores_the_header(app, profiling):
+    configure_profiling({"PROFILING_ENABLED": False})
+    bundle = app.test_client().post("/api/v1/map/document", json=_body()).get_json()
+
+    response = app.test_client().post("/api/v1/harmonize", headers={"X-Profile": "inline"}, json=bundle)
+
+    assert response.get_json()["resourceType"] == "Bundle"
+    assert "X-Profile-Id" not in response.headers
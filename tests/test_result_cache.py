@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from app import create_app
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+from document_mapper import BUILD_MODES, get_document_mapper
+from result_cache import MappingResultCache, configure_result_cache, document_digest, result_cache
+
+
+def _documents(count):
+    document_types = list(DOCUMENT_GENERATORS)
+    documents = []
+    for i in range(count):
+        data = DOCUMENT_GENERATORS[document_types[i % len(document_types)]](size=1 + i % 3, seed=i)
+        if i % 5 == 0:
+            # No patient ID: the Patient's ID is derived from the document too
+            del data["PII"]["ID"]
+        documents.append((document_types[i % len(document_types)], data))
+    return documents
+
+
+def _reordered(value):
+    """Same document with every object's keys in reverse order."""
+    if isinstance(value, dict):
+        return {key: _reordered(value[key]) for key in reversed(list(value))}
+    if isinstance(value, list):
+        return [_reordered(item) for item in value]
+    return value
+
+
+def _resource_ids(bundle_json):
+    return [entry["resource"]["id"] for entry in json.loads(bundle_json)["entry"]]
+
+
+@pytest.fixture
+def app(stub_nlm):
+    app = create_app("testing")
+    app.config["MAPPER_DETERMINISTIC_IDS"] = True
+    configure_result_cache({"MAPPING_RESULT_CACHE_SIZE": 100})
+    yield app
+    configure_result_cache({})
+
+
+@pytest.mark.parametrize("build_mode", BUILD_MODES)
+def test_deterministic_ids_give_byte_identical_bundles(stub_nlm, build_mode):
+    seen_ids = set()
+    for document_type, data in _documents(12):
+        mapper = get_document_mapper(document_type, build_mode, deterministic_ids=True)
+        outputs = {mapper.map_to_fhir(document) for document in (data, _reordered(data), data)}
+        assert len(outputs) == 1
+        ids = _resource_ids(outputs.pop())
+        # Different documents never share a resource ID
+        assert not seen_ids & set(ids)
+        seen_ids.update(ids)
+
+
+def test_both_build_modes_derive_the_same_ids(stub_nlm):
+    for document_type, data in _documents(4):
+        ids = {
+            tuple(_resource_ids(get_document_mapper(document_type, build_mode, deterministic_ids=True).map_to_fhir(data)))
+            for build_mode in BUILD_MODES
+        }
+        assert len(ids) == 1
+
+
+def test_digest_ignores_key_order_and_tells_documents_apart():
+    (type_a, a), (type_b, b) = _documents(2)
+    assert document_digest(type_a, a) == document_digest(type_a, _reordered(a))
+    assert document_digest(type_a, a) != document_digest(type_b, b)
+    assert document_digest(type_a, a) != document_digest(type_a, a, "%m/%d/%Y")
+    changed = json.loads(json.dumps(a))
+    changed["PII"]["Name"] += "x"
+    assert document_digest(type_a, a) != document_digest(type_a, changed)
+
+
+def test_cache_is_bounded_least_recently_used_first():
+    cache = MappingResultCache(maxsize=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "C")
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"]) == (2, 3, 1)
+
+
+def test_disabled_cache_has_no_keys():
+    cache = MappingResultCache(maxsize=0)
+    assert cache.key("Lab Report", {}) is None
+    assert cache.get(None) is None
+    assert not cache.stats()["enabled"]
+
+
+def test_resubmitted_document_is_answered_from_the_cache(app, stub_nlm):
+    client = app.test_client()
+    document_type, data = _documents(1)[0]
+    body = {"document_type": document_type, "data": data}
+
+    first = client.post("/api/v1/map/document", json=body).get_data()
+    requests_made = stub_nlm.requests
+    second = client.post("/api/v1/map/document", json={"document_type": document_type, "data": _reordered(data)})
+
+    assert second.get_data() == first
+    assert stub_nlm.requests == requests_made
+    assert (result_cache.stats()["hits"], result_cache.stats()["misses"]) == (1, 1)
+
+
+def test_bundles_with_upstream_failures_are_not_cached(app, stub_nlm):
+    stub_nlm.fail_status = 503
+    document_type, data = _documents(1)[0]
+
+    response = app.test_client().post("/api/v1/map/document", json={"document_type": document_type, "data": data})
+
+    assert response.status_code == 200
+    assert stub_nlm.requests
+    assert result_cache.stats()["size"] == 0
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import terminology_cache
+from terminology import (
+    async_http_client, configure_terminology, get_loinc_code, get_loinc_code_async, http_client, terminology_caches,
+)
+from terminology_cache import DEFAULT_FAILURE_TTL, FailedLookup, SQLiteCache, TieredCache, TransientFailedLookup
+
+CONCURRENT_LOOKUPS = 8
+
+
+def test_sqlite_cache_purges_expired_rows_and_caps_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(terminology_cache, "SQLITE_PURGE_INTERVAL", 50)
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), ttl=1000, max_entries=30)
+    for i in range(49):
+        cache.set(("icd10", f"term {i}"), {"text": f"term {i}"}, ttl=0.01 if i < 10 else 100 + i)
+    time.sleep(0.02)
+
+    # The 50th write purges: 10 expired rows, then the 10 closest to expiry beyond the cap
+    cache.set(("icd10", "latest"), {"text": "latest"})
+
+    rows = cache._connect().execute("SELECT COUNT(*) FROM terminology_cache").fetchone()[0]
+    assert rows == 30
+    assert ("icd10", "latest") in cache
+    assert ("icd10", "term 48") in cache
+    assert ("icd10", "term 19") not in cache
+
+
+def test_sqlite_cache_without_cap_only_purges_expired_rows(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path, max_entries=0)
+    cache.set(("loinc", "old"), {"text": "old"}, ttl=0.01)
+    cache.set(("loinc", "new"), {"text": "new"})
+    time.sleep(0.02)
+
+    assert cache.purge() == 1
+    assert list(cache) == [("loinc", "new")]
+
+
+def test_concurrent_thread_misses_share_one_upstream_call(stub_nlm):
+    stub_nlm.latency = 0.2
+    barrier = threading.Barrier(CONCURRENT_LOOKUPS)
+
+    def lookup(_):
+        barrier.wait()
+        return get_loinc_code("glucose")
+
+    with ThreadPoolExecutor(max_workers=CONCURRENT_LOOKUPS) as pool:
+        results = list(pool.map(lookup, range(CONCURRENT_LOOKUPS)))
+
+    assert stub_nlm.requests == 1
+    assert results[0]["coding"] and all(result == results[0] for result in results)
+    # Each caller gets a dict of its own
+    assert len({id(result) for result in results}) == CONCURRENT_LOOKUPS
+
+
+def test_concurrent_task_misses_share_one_upstream_call(stub_nlm):
+    stub_nlm.latency = 0.2
+
+    async def lookups():
+        async with async_http_client.session():
+            return await asyncio.gather(*(get_loinc_code_async("glucose") for _ in range(CONCURRENT_LOOKUPS)))
+
+    results = asyncio.run(lookups())
+
+    assert stub_nlm.requests == 1
+    assert results[0]["coding"] and all(result == results[0] for result in results)
+
+
+def test_shed_lookups_are_never_cached(stub_nlm):
+    configure_terminology({**stub_nlm.endpoint_config(), "TERMINOLOGY_MAX_CONCURRENT_CALLS": 1,
+                           "TERMINOLOGY_CALL_WAIT_TIMEOUT": 0.01})
+    with http_client.limiter.slot("test"):
+        shed = get_loinc_code("glucose")
+    assert isinstance(shed, TransientFailedLookup)
+    assert stub_nlm.requests == 0
+    assert len(terminology_caches["loinc"]) == 0
+
+    assert get_loinc_code("glucose")["coding"]
+    assert stub_nlm.requests == 1
+
+
+def test_failed_lookups_are_cached_for_the_failure_ttl_only(stub_nlm):
+    stub_nlm.fail_status = 503
+    cache = terminology_caches["loinc"]
+
+    assert isinstance(get_loinc_code("glucose"), FailedLookup)
+    assert isinstance(get_loinc_code("glucose"), FailedLookup)
+    assert stub_nlm.requests == 1
+
+    stub_nlm.fail_status = None
+    cache.l1.expire(time.monotonic() + DEFAULT_FAILURE_TTL + 1)
+    assert get_loinc_code("glucose")["coding"]
+    assert stub_nlm.requests == 2
+
+
+def test_entry_lifetimes_depend_on_the_result(tmp_path):
+    backend = SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    cache = TieredCache("loinc", ttl=1000, negative_ttl=100, failure_ttl=10, backend=backend)
+    cache[("found",)] = {"coding": [{"code": "2345-7"}], "text": "found"}
+    cache[("not found",)] = {"text": "not found"}
+    cache[("failed",)] = FailedLookup(text="failed")
+    cache[("shed",)] = TransientFailedLookup(text="shed")
+    now = time.monotonic()
+
+    assert sorted(cache) == [("failed",), ("found",), ("not found",)]
+    # Failures are never persisted
+    assert sorted(backend) == [("loinc", "found"), ("loinc", "not found")]
+    cache.l1.expire(now + 11)
+    assert sorted(cache) == [("found",), ("not found",)]
+    cache.l1.expire(now + 101)
+    assert sorted(cache) == [("found",)]
+    cache.l1.expire(now + 1001)
+    assert len(cache) == 0
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+import terminology_http
+from terminology_http import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, AsyncTerminologyHTTPClient, CircuitBreaker, CircuitOpenError,
+    TerminologyHTTPClient,
+)
+
+RESET_TIMEOUT = 30
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(terminology_http.time, "monotonic", clock)
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("icd10", failure_threshold=3, reset_timeout=RESET_TIMEOUT)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure("HTTP 503")
+    breaker.before_call()
+    breaker.record_success()
+    assert (breaker.state, breaker.failures) == (STATE_CLOSED, 0)
+
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure("HTTP 503")
+    assert breaker.state == STATE_OPEN
+    assert breaker.snapshot() == {
+        "state": STATE_OPEN, "consecutive_failures": 3, "open_for_seconds": 0, "last_error": "HTTP 503",
+    }
+
+
+def test_open_breaker_fails_fast_until_the_reset_timeout(clock):
+    breaker = CircuitBreaker("icd10", failure_threshold=1, reset_timeout=RESET_TIMEOUT)
+    breaker.record_failure("down")
+    clock.advance(RESET_TIMEOUT - 0.001)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.state == STATE_OPEN
+
+    clock.advance(0.001)
+    breaker.before_call()
+    assert breaker.state == STATE_HALF_OPEN
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_for_another_reset_timeout(clock):
+    breaker = CircuitBreaker("icd10", failure_threshold=5, reset_timeout=RESET_TIMEOUT)
+    for _ in range(5):
+        breaker.record_failure("down")
+    clock.advance(RESET_TIMEOUT)
+    breaker.before_call()
+    breaker.record_failure("still down")
+
+    assert breaker.state == STATE_OPEN
+    clock.advance(RESET_TIMEOUT - 1)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.advance(1)
+    breaker.before_call()
+    assert breaker.state == STATE_HALF_OPEN
+
+
+def test_released_probe_lets_the_next_call_probe(clock):
+    breaker = CircuitBreaker("icd10", failure_threshold=1, reset_timeout=RESET_TIMEOUT)
+    breaker.record_failure("down")
+    clock.advance(RESET_TIMEOUT)
+    breaker.before_call()
+    breaker.release()
+    breaker.before_call()
+    assert breaker.state == STATE_HALF_OPEN
+
+
+def test_client_fails_fast_on_a_failing_upstream_and_recovers(clock, stub_nlm):
+    client = TerminologyHTTPClient(failure_threshold=2, reset_timeout=RESET_TIMEOUT)
+    url = stub_nlm.endpoint_config()["TERMINOLOGY_ICD10_URL"]
+    stub_nlm.fail_status = 503
+
+    assert [client.get("icd10", url, params={"terms": "fever"}).status_code for _ in range(2)] == [503, 503]
+    assert client.breaker("icd10").state == STATE_OPEN
+    requests_made = stub_nlm.requests
+    with pytest.raises(CircuitOpenError):
+        client.get("icd10", url, params={"terms": "fever"})
+    assert stub_nlm.requests == requests_made
+    # Breakers are per endpoint
+    assert client.breaker("loinc").state == STATE_CLOSED
+
+    stub_nlm.fail_status = None
+    clock.advance(RESET_TIMEOUT)
+    assert client.get("icd10", url, params={"terms": "fever"}).status_code == 200
+    assert client.breaker("icd10").state == STATE_CLOSED
+    assert stub_nlm.requests == requests_made + 1
+
+
+def test_async_client_shares_the_sync_breakers(clock, stub_nlm):
+    client = TerminologyHTTPClient(failure_threshold=1, reset_timeout=RESET_TIMEOUT)
+    async_client = AsyncTerminologyHTTPClient(client)
+    url = stub_nlm.endpoint_config()["TERMINOLOGY_ICD10_URL"]
+    stub_nlm.fail_status = 503
+
+    async def get():
+        async with async_client.session():
+            return await async_client.get("icd10", url, params={"terms": "fever"})
+
+    assert asyncio.run(get()).status_code == 503
+    requests_made = stub_nlm.requests
+    with pytest.raises(CircuitOpenError):
+        client.get("icd10", url, params={"terms": "fever"})
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(get())
+    assert stub_nlm.requests == requests_made
@@ -0,0 +1,96 @@
+import logging
+import struct
+
+import pytest
+
+import terminology_index
+from terminology_index import RANK_KEYS, TerminologyIndex, build_index, index_path, load_indexes
+
+ICD10_RECORDS = [
+    ("I15.0", "Renovascular hypertension"),
+    ("I10", "Essential (primary) hypertension"),
+    ("I11.9", "Hypertensive heart disease without heart failure"),
+    ("E11.9", "Type 2 diabetes mellitus without complications"),
+    ("E11", "Type 2 diabetes mellitus"),
+    ("J45.909", "Unspecified asthma, uncomplicated"),
+]
+
+
+@pytest.fixture
+def icd10_index(tmp_path):
+    path = index_path(str(tmp_path), "icd10")
+    assert build_index(ICD10_RECORDS, path, rank_key=RANK_KEYS["icd10"]) == len(ICD10_RECORDS)
+    index = TerminologyIndex(path)
+    yield index
+    index.close()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Unspecified asthma, uncomplicated", ("J45.909", "Unspecified asthma, uncomplicated")),
+    ("renovascular HYPERTENSION", ("I15.0", "Renovascular hypertension")),
+    ("asth uncompl", ("J45.909", "Unspecified asthma, uncomplicated")),
+    ("hypertensive heart", ("I11.9", "Hypertensive heart disease without heart failure")),
+    ("asthma migraine", None),
+    ("", None),
+])
+def test_exact_and_prefix_lookups(icd10_index, text, expected):
+    assert icd10_index.search(text) == expected
+
+
+def test_shortest_code_wins(icd10_index):
+    # Ranked by (len(code), code): the most general code matching every word
+    assert icd10_index.search("hypertension") == ("I10", "Essential (primary) hypertension")
+    assert icd10_index.search("type 2 diabetes") == ("E11", "Type 2 diabetes mellitus")
+    assert [icd10_index.record(i)[0] for i in range(len(icd10_index))] == \
+        sorted((code for code, _ in ICD10_RECORDS), key=lambda code: (len(code), code))
+
+
+@pytest.mark.parametrize("keep", [0, 10, 60, -40, -1])
+def test_truncated_file_is_rejected(tmp_path, keep):
+    path = str(tmp_path / "icd10.idx")
+    build_index(ICD10_RECORDS, path, rank_key=RANK_KEYS["icd10"])
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:keep])
+    with pytest.raises(ValueError):
+        TerminologyIndex(path)
+
+
+def test_corrupt_file_is_rejected(tmp_path):
+    path = str(tmp_path / "icd10.idx")
+    build_index(ICD10_RECORDS, path, rank_key=RANK_KEYS["icd10"])
+    with open(path, "r+b") as f:
+        f.write(b"NOTANIDX")
+    with pytest.raises(ValueError):
+        TerminologyIndex(path)
+
+
+def test_load_indexes_skips_corrupt_files(tmp_path, caplog):
+    build_index(ICD10_RECORDS, index_path(str(tmp_path), "icd10"), rank_key=RANK_KEYS["icd10"])
+    with open(index_path(str(tmp_path), "loinc"), "wb") as f:
+        f.write(b"\0" * 100)
+    with caplog.at_level(logging.ERROR):
+        indexes = load_indexes(str(tmp_path))
+    assert sorted(indexes) == ["icd10"]
+    assert "loinc" in caplog.text
+    indexes["icd10"].close()
+
+
+def test_tables_are_read_little_endian_on_any_host(tmp_path, monkeypatch):
+    path = index_path(str(tmp_path), "icd10")
+    build_index(ICD10_RECORDS, path, rank_key=RANK_KEYS["icd10"])
+    with open(path, "rb") as f:
+        assert struct.unpack_from("<I", f.read(), 8)[0] == len(ICD10_RECORDS)
+    queries = ["hypertension", "type 2 diabetes", "asth uncompl", "hypertensive heart", "asthma migraine"]
+    native = TerminologyIndex(path)
+    expected = ([native.record(i) for i in range(len(native))], [native.search(query) for query in queries])
+    native.close()
+
+    monkeypatch.setattr(terminology_index.sys, "byteorder", "big")
+    index = TerminologyIndex(path)
+    try:
+        assert isinstance(index._postings, terminology_index._LittleEndianUInt32s)
+        assert ([index.record(i) for i in range(len(index))], [index.search(query) for query in queries]) == expected
+    finally:
+        index.close()
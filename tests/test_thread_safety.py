@@ -0,0 +1,82 @@
+"""
+Maps many documents concurrently through the shared mappers, on a thread pool
+and as asyncio tasks, against the stub NLM server with a little latency so
+documents interleave while their lookups are in flight.
+"""
+
+import asyncio
+import copy
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+from document_mapper import BUILD_MODES, get_document_mapper
+
+DOCUMENT_COUNT = 400
+THREADS = 16
+
+
+def make_documents(count):
+    document_types = list(DOCUMENT_GENERATORS)
+    documents = []
+    for i in range(count):
+        document_type = document_types[i % len(document_types)]
+        data = DOCUMENT_GENERATORS[document_type](size=1 + i % 5, seed=i)
+        if i % 7 == 0:
+            # No ID: the mapper generates a UUID for the patient
+            del data["PII"]["ID"]
+        documents.append((document_type, data))
+    return documents
+
+
+def check_bundle(bundle_json, data):
+    """Returns a problem description, or None if every reference is to this document's patient."""
+    entries = json.loads(bundle_json)["entry"]
+    patients = [e["resource"] for e in entries if e["resource"]["resourceType"] == "Patient"]
+    if len(patients) != 1:
+        return f"expected one Patient, found {len(patients)}"
+    patient_id = patients[0]["id"]
+    expected_id = data["PII"].get("ID")
+    if expected_id and patient_id != expected_id.replace("_", "-"):
+        return f"Patient id {patient_id} does not match input {expected_id}"
+    for entry in entries:
+        subject = entry["resource"].get("subject")
+        if subject and subject["reference"] != f"Patient/{patient_id}":
+            return f"{entry['resource']['resourceType']} references {subject['reference']}, not Patient/{patient_id}"
+    return None
+
+
+def map_on_threads(documents, build_mode):
+    def map_one(item):
+        document_type, data = item
+        return check_bundle(get_document_mapper(document_type, build_mode).map_to_fhir(data), data)
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        return list(executor.map(map_one, documents))
+
+
+def map_as_tasks(documents, build_mode):
+    async def map_one(document_type, data):
+        bundle_json = await get_document_mapper(document_type, build_mode).map_to_fhir_async(data)
+        return check_bundle(bundle_json, data)
+
+    async def map_all():
+        return await asyncio.gather(*(map_one(t, d) for t, d in documents))
+
+    return asyncio.run(map_all())
+
+
+@pytest.mark.parametrize("build_mode", BUILD_MODES)
+@pytest.mark.parametrize("runner", [map_on_threads, map_as_tasks])
+def test_concurrent_documents_keep_their_own_patient(stub_nlm, runner, build_mode):
+    stub_nlm.latency = 0.002
+    documents = make_documents(DOCUMENT_COUNT)
+    original = copy.deepcopy(documents)
+
+    problems = [problem for problem in runner(documents, build_mode) if problem]
+
+    assert not problems, f"{len(problems)} crossed references, e.g. {problems[:3]}"
+    # Mapping must not modify the documents it was given
+    assert documents == original
@@ -0,0 +1,134 @@
+import collections
+import json
+import threading
+
+import pytest
+
+from app import create_app
+from benchmarks.synthetic import DOCUMENT_GENERATORS
+from tracing import NOOP_SPAN, bind, configure_tracing, current_span, tracer
+
+TRACEPARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    configure_tracing({"TRACING_ENABLED": True, "TRACE_EXPORTER": "file", "TRACE_FILE": str(path)})
+    yield path
+    configure_tracing({})
+
+
+@pytest.fixture
+def app(stub_nlm, trace_file):
+    app = create_app("testing")
+    # create_app applies the testing config, which has tracing off
+    configure_tracing({"TRACING_ENABLED": True, "TRACE_EXPORTER": "file", "TRACE_FILE": str(trace_file)})
+    return app
+
+
+def _spans(trace_file):
+    configure_tracing({})  # closes the file
+    with open(trace_file, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _bodies(count):
+    document_types = list(DOCUMENT_GENERATORS)
+    return [
+        {"document_type": document_types[i % len(document_types)],
+         "data": DOCUMENT_GENERATORS[document_types[i % len(document_types)]](size=3, seed=i)}
+        for i in range(count)
+    ]
+
+
+def test_disabled_tracer_hands_out_the_noop_span():
+    configure_tracing({})
+    assert tracer.span("anything") is NOOP_SPAN
+    assert tracer.start_request_span("GET /", TRACEPARENT) is NOOP_SPAN
+    assert current_span() is NOOP_SPAN
+
+
+def test_spans_nest_and_are_exported_as_json_lines(trace_file):
+    with tracer.span("outer", kind="test") as outer:
+        with tracer.span("inner") as inner:
+            assert current_span() is inner
+        assert current_span() is outer
+        with pytest.raises(ValueError):
+            with tracer.span("failing"):
+                raise ValueError("boom")
+    assert current_span() is NOOP_SPAN
+
+    spans = {span["name"]: span for span in _spans(trace_file)}
+    assert list(spans) == ["inner", "failing", "outer"]
+    assert spans["outer"]["parent_id"] is None
+    assert spans["inner"]["parent_id"] == spans["failing"]["parent_id"] == spans["outer"]["span_id"]
+    assert {span["trace_id"] for span in spans.values()} == {outer.trace_id}
+    assert spans["outer"]["attributes"] == {"kind": "test"}
+    assert spans["failing"]["status"] == "error" and spans["failing"]["error"] == "ValueError: boom"
+    assert set(spans["outer"]) == {
+        "trace_id", "span_id", "parent_id", "name", "start", "duration_ms", "status", "attributes"
+    }
+
+
+def test_bound_functions_open_child_spans_on_other_threads(trace_file):
+    with tracer.span("request") as request_span:
+        def work():
+            with tracer.span("work"):
+                pass
+        threads = [threading.Thread(target=bind(work)), threading.Thread(target=work)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    work_spans = [span for span in _spans(trace_file) if span["name"] == "work"]
+    assert sorted(span["parent_id"] is None for span in work_spans) == [False, True]
+    bound = next(span for span in work_spans if span["parent_id"] is not None)
+    assert (bound["trace_id"], bound["parent_id"]) == (request_span.trace_id, request_span.span_id)
+
+
+def test_traceparent_is_continued():
+    configure_tracing({"TRACING_ENABLED": True})
+    try:
+        span = tracer.start_request_span("GET /", TRACEPARENT)
+        assert (span.trace_id, span.parent_id) == (TRACEPARENT.split("-")[1], TRACEPARENT.split("-")[2])
+        assert tracer.start_request_span("GET /", "garbage").parent_id is None
+    finally:
+        configure_tracing({})
+
+
+def test_every_request_span_belongs_to_its_trace(app, trace_file):
+    client = app.test_client()
+    bodies = _bodies(4)
+    trace_ids = set()
+    for body in bodies:
+        trace_ids.add(client.post("/api/v1/map/document", json=body).headers["X-Trace-Id"])
+        trace_ids.add(client.post("/api/v1/map/document/async", json=body).headers["X-Trace-Id"])
+    response = client.post("/api/v1/map/documents", data="\n".join(json.dumps(body) for body in bodies),
+                           content_type="application/x-ndjson")
+    response.get_data()
+    trace_ids.add(response.headers["X-Trace-Id"])
+    continued = client.post("/api/v1/map/document", json=bodies[0], headers={"traceparent": TRACEPARENT})
+    assert continued.headers["X-Trace-Id"] == TRACEPARENT.split("-")[1]
+    trace_ids.add(continued.headers["X-Trace-Id"])
+
+    spans = _spans(trace_file)
+    by_trace = collections.defaultdict(dict)
+    for span in spans:
+        by_trace[span["trace_id"]][span["span_id"]] = span
+    assert set(by_trace) == trace_ids
+    for span in spans:
+        if span["parent_id"] is None or span["parent_id"] == TRACEPARENT.split("-")[2]:
+            assert span["name"].startswith("POST ")
+        else:
+            assert span["parent_id"] in by_trace[span["trace_id"]], span["name"]
+
+    names = collections.Counter(span["name"] for span in spans)
+    for name in ("mapper.map", "mapper.prefetch_terminology", "terminology.lookup", "terminology.http",
+                 "map_documents.line"):
+        assert names[name], name
+    lookups = [span for span in spans if span["name"] == "terminology.lookup"]
+    assert {span["attributes"]["cache.outcome"] for span in lookups} <= {"hit", "miss", "error"}
+    # Document text (possibly PHI) is never put on a span
+    assert not any("term" in span["attributes"] for span in spans)
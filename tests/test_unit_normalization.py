@@ -0,0 +1,33 @@
+import io
+import json
+
+import pytest
+
+from benchmarks.bench_unit_normalization import lab_bundle
+from harmonization_service import HarmonizationService, configure_harmonization
+
+
+@pytest.fixture
+def normalize_units():
+    configure_harmonization({"HARMONIZE_NORMALIZE_UNITS": True})
+    yield
+    configure_harmonization({})
+
+
+def _quantities(bundle_json):
+    return [entry["resource"].get("valueQuantity") for entry in json.loads(bundle_json)["entry"]]
+
+
+def test_units_are_left_alone_by_default():
+    configure_harmonization({})
+    bundle = lab_bundle(8)
+    harmonized = HarmonizationService.harmonize_bundle(json.dumps(bundle), mode="fast")
+    assert _quantities(harmonized) == [entry["resource"].get("valueQuantity") for entry in bundle["entry"]]
+
+
+def test_stream_converts_entry_by_entry_like_fast_mode(normalize_units):
+    bundle_json = json.dumps(lab_bundle(16))
+    fast = HarmonizationService.harmonize_bundle(bundle_json, mode="fast")
+    stream = "".join(HarmonizationService.harmonize_bundle_stream(io.BytesIO(bundle_json.encode())))
+    assert stream == fast
+    assert {"value": 97.2864, "unit": "mg/dL", "system": "http://unitsofmeasure.org", "code": "mg/dL"} in _quantities(fast)
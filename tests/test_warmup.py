@@ -0,0 +1,13 @@
+from app import create_app
+from config import config
+from terminology import warmup_state
+
+
+def test_unreadable_warmup_list_starts_cold(tmp_path, monkeypatch):
+    monkeypatch.setattr(config["testing"], "TERMINOLOGY_WARMUP_TERMS_PATH", str(tmp_path / "missing.csv"))
+    monkeypatch.setitem(warmup_state, "status", "idle")
+    monkeypatch.setitem(warmup_state, "error", None)
+    app = create_app("testing")
+
+    assert warmup_state["status"] == "failed"
+    assert app.test_client().get("/api/v1/health").status_code == 200
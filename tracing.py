@@ -0,0 +1,249 @@
+"""
+Lightweight request tracing.
+
+With TRACING_ENABLED, each API request is traced as nested spans: the route,
+the mapper's prefetch, builders and serialization, every terminology lookup
+(with its cache outcome), each ICD-10 search strategy and every upstream HTTP
+call (with its status). Finished spans are exported as one JSON object per
+line to stdout or to TRACE_FILE, so traces can be collected without an
+external service:
+
+    {"trace_id": "...", "span_id": "...", "parent_id": "...", "name": "terminology.http",
+     "start": 1760000000.123, "duration_ms": 41.2, "status": "ok", "attributes": {...}}
+
+The current span lives in a context variable, so spans nest across function
+calls and asyncio tasks; lookups run on the prefetch pool are bound to the
+span that submitted them (see bind). A W3C traceparent request header is
+continued, and responses carry X-Trace-Id. Disabled, span() returns a shared
+no-op span.
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTERS = ('stdout', 'file')
+DEFAULT_TRACE_FILE = os.path.join(tempfile.gettempdir(), 'fhir_traces.jsonl')
+
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed operation of a trace, with attributes."""
+
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'attributes',
+                 'start', '_start_counter', 'status', 'error', '_token', '_parent')
+
+    def __init__(self, tracer, name, attributes, parent=None, trace_id=None, parent_id=None):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self._parent = parent
+        self.trace_id = parent.trace_id if parent is not None else trace_id or os.urandom(16).hex()
+        self.parent_id = parent.span_id if parent is not None else parent_id
+        self.span_id = os.urandom(8).hex()
+        self.status = 'ok'
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_error(self, error):
+        self.status = 'error'
+        self.error = f"{type(error).__name__}: {error}"
+
+    def begin(self):
+        """Starts the span and makes it the current one."""
+        self.start = time.time()
+        self._start_counter = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def end(self):
+        """Ends the span, restores its parent as the current span and exports it."""
+        duration = time.perf_counter() - self._start_counter
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Ended from another context (e.g. after a streamed response)
+            _current_span.set(self._parent)
+        self.tracer.export(self, duration)
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.record_error(exc)
+        self.end()
+        return False
+
+
+class _NoopSpan:
+    """Span returned while tracing is disabled."""
+
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def begin(self):
+        return self
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Creates spans and writes finished ones to the configured exporter."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self.configure()
+
+    def configure(self, enabled=False, exporter='stdout', path=None):
+        if exporter not in TRACE_EXPORTERS:
+            raise ValueError(f"Unsupported TRACE_EXPORTER: {exporter}. Supported exporters: {', '.join(TRACE_EXPORTERS)}")
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.enabled = enabled
+            self.exporter = exporter
+            self.path = path or DEFAULT_TRACE_FILE
+
+    def span(self, name, **attributes):
+        """A child of the current span (or a new trace), to use as a context manager."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes, _current_span.get())
+
+    def start_request_span(self, name, traceparent=None, **attributes):
+        """Root span of a request, continuing the caller's trace if it sent a W3C traceparent header."""
+        if not self.enabled:
+            return NOOP_SPAN
+        match = _TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+        if match:
+            return Span(self, name, attributes, trace_id=match.group(1), parent_id=match.group(2)).begin()
+        return Span(self, name, attributes).begin()
+
+    def export(self, span, duration):
+        record = {
+            'trace_id': span.trace_id,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'name': span.name,
+            'start': round(span.start, 6),
+            'duration_ms': round(duration * 1000, 3),
+            'status': span.status,
+            'attributes': span.attributes,
+        }
+        if span.error:
+            record['error'] = span.error
+        line = json.dumps(record, default=str, ensure_ascii=False) + '\n'
+        try:
+            with self._lock:
+                if self.exporter == 'stdout':
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+                    return
+                if self._file is None or self._file.closed:
+                    self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+                self._file.write(line)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not export span {span.name}: {e}")
+
+
+tracer = Tracer()
+
+
+def current_span():
+    """The active span, or the no-op span outside any trace."""
+    span = _current_span.get()
+    return span if span is not None else NOOP_SPAN
+
+
+def traced(name, **attributes):
+    """Decorator running each call of a function or coroutine function in a span."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await func(*args, **kwargs)
+                with tracer.span(name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func):
+    """
+    func bound to the current span, for running on another thread (e.g. a
+    pool): spans it opens become children of the submitting request's span.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return wrapper
+
+
+def configure_tracing(config):
+    """Applies the TRACING_ENABLED / TRACE_EXPORTER / TRACE_FILE settings."""
+    tracer.configure(
+        config.get('TRACING_ENABLED', False),
+        config.get('TRACE_EXPORTER', 'stdout'),
+        config.get('TRACE_FILE'),
+    )
+    if tracer.enabled:
+        target = 'stdout' if tracer.exporter == 'stdout' else tracer.path
+        logger.info(f"Tracing enabled, exporting spans to {target}")
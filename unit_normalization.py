@@ -0,0 +1,166 @@
+"""
+Unit normalization for Observation quantities.
+
+Lab values arrive in mixed units (glucose in mg/dL from one source, mmol/L
+from another). normalize_observation_units converts every quantity of a
+Bundle whose Observation (or component) carries a LOINC code listed in
+UNIT_CONVERSIONS to that code's canonical unit, rewriting value, unit, system
+and code of the Quantity in place.
+
+All convertible quantities of a Bundle are collected first, each with the
+factor and offset for its (LOINC code, unit) pair from a precomputed table,
+and converted together in one vectorized pass (NumPy when installed, a plain
+loop otherwise, with identical results), so the per-Bundle overhead stays flat
+as the number of labs grows. Quantities already in the canonical unit, with
+units the table does not know, or without a numeric value are left as they are.
+"""
+
+import logging
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+LOINC_SYSTEM = 'http://loinc.org'
+UCUM_SYSTEM = 'http://unitsofmeasure.org'
+
+# Converted values are rounded to this many decimals
+VALUE_DECIMALS = 4
+
+# LOINC code -> (canonical UCUM unit, {UCUM unit: (factor, offset)}), where
+# canonical value = value * factor + offset
+UNIT_CONVERSIONS = {
+    # Glucose [Mass/volume] in Serum, Plasma or Blood
+    '2345-7': ('mg/dL', {'mmol/L': (18.016, 0.0), 'mg/L': (0.1, 0.0), 'g/L': (100.0, 0.0)}),
+    '2339-0': ('mg/dL', {'mmol/L': (18.016, 0.0), 'mg/L': (0.1, 0.0), 'g/L': (100.0, 0.0)}),
+    # Cholesterol (total, HDL, LDL) and triglycerides
+    '2093-3': ('mg/dL', {'mmol/L': (38.67, 0.0)}),
+    '2085-9': ('mg/dL', {'mmol/L': (38.67, 0.0)}),
+    '13457-7': ('mg/dL', {'mmol/L': (38.67, 0.0)}),
+    '18262-6': ('mg/dL', {'mmol/L': (38.67, 0.0)}),
+    '2571-8': ('mg/dL', {'mmol/L': (88.57, 0.0)}),
+    # Creatinine, urea nitrogen, calcium
+    '2160-0': ('mg/dL', {'umol/L': (1 / 88.42, 0.0), 'mg/L': (0.1, 0.0)}),
+    '3094-0': ('mg/dL', {'mmol/L': (2.801, 0.0)}),
+    '17861-6': ('mg/dL', {'mmol/L': (4.008, 0.0)}),
+    # Hemoglobin
+    '718-7': ('g/dL', {'g/L': (0.1, 0.0), 'mmol/L': (1.6114, 0.0)}),
+    # Hemoglobin A1c: IFCC mmol/mol to NGSP %
+    '4548-4': ('%', {'mmol/mol': (0.09148, 2.152)}),
+    # Sodium, potassium, chloride
+    '2951-2': ('mmol/L', {'meq/L': (1.0, 0.0)}),
+    '2823-3': ('mmol/L', {'meq/L': (1.0, 0.0)}),
+    '2075-0': ('mmol/L', {'meq/L': (1.0, 0.0)}),
+    # Vital signs: body weight, height, temperature
+    '29463-7': ('kg', {'[lb_av]': (0.45359237, 0.0), 'g': (0.001, 0.0)}),
+    '8302-2': ('cm', {'m': (100.0, 0.0), '[in_i]': (2.54, 0.0)}),
+    '8310-5': ('Cel', {'[degF]': (5 / 9, -160 / 9)}),
+}
+
+# Unit spellings found in extracted documents, lower-cased -> UCUM code
+UNIT_ALIASES = {
+    'mg/dl': 'mg/dL', 'mmol/l': 'mmol/L', 'mg/l': 'mg/L', 'g/l': 'g/L', 'g/dl': 'g/dL',
+    'umol/l': 'umol/L', 'µmol/l': 'umol/L', 'μmol/l': 'umol/L',
+    'meq/l': 'meq/L', 'mmol/mol': 'mmol/mol', '%': '%',
+    'kg': 'kg', 'g': 'g', 'lb': '[lb_av]', 'lbs': '[lb_av]', '[lb_av]': '[lb_av]',
+    'cm': 'cm', 'm': 'm', 'in': '[in_i]', '[in_i]': '[in_i]',
+    'cel': 'Cel', '°c': 'Cel', 'degc': 'Cel', 'c': 'Cel',
+    '[degf]': '[degF]', '°f': '[degF]', 'degf': '[degF]', 'f': '[degF]',
+}
+
+# Human-readable Quantity.unit for canonical units whose UCUM code is not
+UNIT_DISPLAY = {'Cel': '°C'}
+
+# (LOINC code, UCUM unit) -> (canonical unit, factor, offset), flattened once
+_CONVERSION_TABLE = {
+    (loinc_code, unit): (canonical, factor, offset)
+    for loinc_code, (canonical, conversions) in UNIT_CONVERSIONS.items()
+    for unit, (factor, offset) in conversions.items()
+}
+_SCALE = 10 ** VALUE_DECIMALS
+
+
+def _ucum_unit(quantity):
+    """UCUM code of a Quantity dict: its code if coded in UCUM, else its unit text via UNIT_ALIASES."""
+    if quantity.get('system') == UCUM_SYSTEM and isinstance(quantity.get('code'), str):
+        return UNIT_ALIASES.get(quantity['code'].lower(), quantity['code'])
+    unit = quantity.get('unit')
+    if isinstance(unit, str):
+        return UNIT_ALIASES.get(unit.strip().lower())
+    return None
+
+
+def _conversion(concept, quantity):
+    """(canonical unit, factor, offset) for a quantity under a CodeableConcept, or None."""
+    if not isinstance(quantity, dict) or not isinstance(concept, dict):
+        return None
+    value = quantity.get('value')
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    unit = _ucum_unit(quantity)
+    if unit is None:
+        return None
+    for coding in concept.get('coding') or []:
+        if isinstance(coding, dict) and coding.get('system') == LOINC_SYSTEM:
+            conversion = _CONVERSION_TABLE.get((coding.get('code'), unit))
+            if conversion is not None:
+                return conversion
+    return None
+
+
+def _convert(values, factors, offsets):
+    """values * factors + offsets, rounded to VALUE_DECIMALS, in one pass."""
+    if np is not None:
+        converted = np.asarray(values, dtype=np.float64) * np.asarray(factors) + np.asarray(offsets)
+        return (np.rint(converted * _SCALE) / _SCALE).tolist()
+    return [round((v * f + o) * _SCALE) / _SCALE for v, f, o in zip(values, factors, offsets)]
+
+
+def normalize_observation_units(entries):
+    """
+    Converts the Observation quantities of Bundle entries (parsed dicts) to
+    the canonical unit of their LOINC code, in place.
+
+    Args:
+        entries: Bundle.entry list; anything else is ignored
+
+    Returns:
+        int: Number of quantities converted
+    """
+    if not isinstance(entries, list):
+        return 0
+
+    quantities, targets, values, factors, offsets = [], [], [], [], []
+
+    def collect(concept, quantity):
+        conversion = _conversion(concept, quantity)
+        if conversion is not None:
+            canonical, factor, offset = conversion
+            quantities.append(quantity)
+            targets.append(canonical)
+            values.append(quantity['value'])
+            factors.append(factor)
+            offsets.append(offset)
+
+    for entry in entries:
+        resource = entry.get('resource') if isinstance(entry, dict) else None
+        if not isinstance(resource, dict) or resource.get('resourceType') != 'Observation':
+            continue
+        collect(resource.get('code'), resource.get('valueQuantity'))
+        for component in resource.get('component') or []:
+            if isinstance(component, dict):
+                collect(component.get('code'), component.get('valueQuantity'))
+
+    if not quantities:
+        return 0
+
+    for quantity, canonical, value in zip(quantities, targets, _convert(values, factors, offsets)):
+        quantity['value'] = value
+        quantity['unit'] = UNIT_DISPLAY.get(canonical, canonical)
+        quantity['system'] = UCUM_SYSTEM
+        quantity['code'] = canonical
+    return len(quantities)